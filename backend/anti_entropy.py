@@ -0,0 +1,282 @@
+# backend/anti_entropy.py
+"""
+反熵 (Anti-Entropy) 校验：为每个 (节点, 表) 维护一棵按主键区间分桶的 Merkle 哈希树。
+两个节点先比较根哈希，只向下展开哈希不同的区间，最终定位到差异行并交给同步引擎修复。
+作为增量同步之下的安全网，每隔几分钟运行一次：借用同步租约执行 (与同步互斥)，读取受同步限流约束。
+删除不会出现在按 last_updated 的增量刷新中，改为读取各节点发件箱中的删除记录。
+"""
+import time
+import hashlib
+import zlib
+from datetime import datetime
+from . import models
+from .database import SessionLocals
+from sqlalchemy import func
+from .sync_engine import (scheduler, sync_flight, ALL_DBS, read_db_clock, next_watermark, chunked, coerce_ids,
+                          read_owner_rows, push_to_targets, load_locked_records)
+from .config import settings
+from .topology import topology
+from .sync_metrics import sync_metrics
+from .sync_coordinator import SingleFlight
+from . import sync_throttle
+
+# 参与反熵校验的表 (与同步引擎一致，父表在前)
+ANTI_ENTROPY_MODELS = [models.User, models.Inventory, models.AlertMessage, models.Prescription, models.PrescriptionItem]
+
+# 反熵任务周期 (秒)
+ANTI_ENTROPY_INTERVAL = 300
+
+# 整数主键每个叶子覆盖的 ID 区间宽度；UUID 主键按前 3 位十六进制分为 4096 个区间
+INT_LEAF_SPAN = 64
+
+# 每个树节点的子节点数
+FANOUT = 16
+
+# 不参与摘要的列 (与冲突比对保持一致)
+DIGEST_EXCLUDE = {'last_updated', 'create_time', 'hlc'}
+
+def leaf_key(row_id):
+    """主键 -> 叶子区间编号"""
+    if isinstance(row_id, int):
+        return row_id // INT_LEAF_SPAN
+    try:
+        return int(str(row_id)[:3], 16)
+    except ValueError:
+        return zlib.crc32(str(row_id).encode()) % 4096
+
+def digest_columns(model_class):
+    """参与摘要的列，按定义顺序"""
+    return [c for c in model_class.__table__.columns if c.name not in DIGEST_EXCLUDE]
+
+def row_digest(values, names, db_name):
+    """
+    行摘要：按列名归一化后取哈希。
+    有换算规则的列 (如 PG 的 medicine_id) 先还原为标准 ID，浮点数按比对容差取 3 位小数，保证各节点同一行摘要一致
+    """
+    normalized = []
+    for name, val in zip(names, values):
+        if name in topology.offset_columns and val is not None:
+            val -= topology.id_offset(db_name, name)
+        elif isinstance(val, float):
+            val = round(val, 3)
+        normalized.append(val)
+    return hashlib.md5(repr(normalized).encode('utf-8')).hexdigest()[:16]
+
+def _combine(pairs):
+    h = hashlib.md5()
+    for key, value in sorted(pairs):
+        h.update(f"{key}:{value};".encode('utf-8'))
+    return h.hexdigest()[:16]
+
+class MerkleTree:
+    """一个 (节点, 表) 的哈希树：叶子为一个主键区间内的 {id: 行摘要}，逐层按 FANOUT 合并到根"""
+    def __init__(self):
+        self.leaves = {}
+        self.leaf_hashes = {}
+        self.dirty = set()
+        self.mark = None
+        # 已处理到的发件箱顺序号：之后的删除记录在下一次增量刷新时按主键重读
+        self.outbox_seq = 0
+        self.passes = 0
+
+    def put(self, row_id, digest):
+        key = leaf_key(row_id)
+        self.leaves.setdefault(key, {})[row_id] = digest
+        self.dirty.add(key)
+
+    def remove(self, row_id):
+        key = leaf_key(row_id)
+        leaf = self.leaves.get(key)
+        if leaf and leaf.pop(row_id, None) is not None:
+            if not leaf: del self.leaves[key]
+            self.dirty.add(key)
+
+    def _refresh_leaf_hashes(self):
+        for key in self.dirty:
+            leaf = self.leaves.get(key)
+            if leaf: self.leaf_hashes[key] = _combine(leaf.items())
+            else: self.leaf_hashes.pop(key, None)
+        self.dirty.clear()
+
+    def levels(self, depth):
+        """返回 [第 0 层(叶子), 第 1 层, ..., 第 depth 层(根)] 的 {区间编号: 哈希}"""
+        self._refresh_leaf_hashes()
+        result = [dict(self.leaf_hashes)]
+        for _ in range(depth):
+            parents = {}
+            for key, value in result[-1].items():
+                parents.setdefault(key // FANOUT, []).append((key, value))
+            result.append({key: _combine(children) for key, children in parents.items()})
+        return result
+
+    def max_leaf(self):
+        return max(self.leaves) if self.leaves else 0
+
+def tree_depth(*trees):
+    """让根层只剩一个节点所需的层数"""
+    top, depth = max(t.max_leaf() for t in trees), 0
+    while top > 0:
+        top //= FANOUT
+        depth += 1
+    return depth
+
+def diff_trees(a, b):
+    """
+    自根向下比较两棵树，只展开哈希不同的子树，返回存在差异的主键集合。
+    比较次数与差异区间数成正比，而非与表大小成正比
+    """
+    depth = tree_depth(a, b)
+    la, lb = a.levels(depth), b.levels(depth)
+    frontier = {k for k in set(la[depth]) | set(lb[depth]) if la[depth].get(k) != lb[depth].get(k)}
+    for level in range(depth - 1, -1, -1):
+        frontier = {k for k in set(la[level]) | set(lb[level])
+                    if k // FANOUT in frontier and la[level].get(k) != lb[level].get(k)}
+    ids = set()
+    for key in frontier:
+        leaf_a, leaf_b = a.leaves.get(key, {}), b.leaves.get(key, {})
+        ids.update(i for i in set(leaf_a) | set(leaf_b) if leaf_a.get(i) != leaf_b.get(i))
+    return ids
+
+# 各 (节点, 表) 的哈希树缓存
+trees = {}
+
+# 最近一次反熵校验的概要
+last_anti_entropy_report = {}
+
+def refresh_tree(db_name, model_class):
+    """
+    更新一棵树：首次或到达全量重建周期 (settings.ANTI_ENTROPY_FULL_REBUILD) 时全表读取摘要列，
+    其余时候只读取水位之后变化的行，以及发件箱中新登记的删除 (按主键重读，已不存在的行从树中移除)。
+    返回 (树, 本次增量读到的主键集合)，全量重建时集合为 None
+    """
+    table_name = model_class.__tablename__
+    key = (db_name, table_name)
+    tree = trees.get(key)
+    period = settings.ANTI_ENTROPY_FULL_REBUILD
+    full = tree is None or (period > 0 and tree.passes % period == 0)
+    if full:
+        tree = MerkleTree()
+    columns = digest_columns(model_class)
+    names = [c.name for c in columns]
+    deleted = []
+    session = SessionLocals[db_name]()
+    try:
+        sync_throttle.acquire_queries(db_name, 3)
+        db_now = read_db_clock(session)
+        outbox = models.SyncOutbox
+        if full:
+            # 全量读取已包含此刻之前的删除
+            tree.outbox_seq = session.query(func.max(outbox.id)).scalar() or 0
+        else:
+            for seq, record_id in session.query(outbox.id, outbox.record_id).filter(
+                    outbox.id > tree.outbox_seq, outbox.table_name == table_name, outbox.op == 'DELETE'):
+                tree.outbox_seq = max(tree.outbox_seq, seq)
+                deleted.append(record_id)
+        q = session.query(*columns)
+        if not full and tree.mark is not None:
+            q = q.filter(model_class.last_updated >= tree.mark)
+        changed = None if full else set()
+        batch = 0
+        for row in q.yield_per(settings.SYNC_CHUNK_SIZE):
+            tree.put(row.id, row_digest(row, names, db_name))
+            if changed is not None: changed.add(row.id)
+            batch += 1
+            if batch == settings.SYNC_CHUNK_SIZE:
+                sync_throttle.acquire_rows(db_name, batch)
+                batch = 0
+        sync_throttle.acquire_rows(db_name, batch)
+        tree.mark = next_watermark(tree.mark, db_now)
+        tree.passes += 1
+        trees[key] = tree
+    finally:
+        session.close()
+    if deleted:
+        deleted = coerce_ids(model_class, deleted)
+        reload_rows(db_name, model_class, deleted)
+        changed.update(deleted)
+    return tree, changed
+
+def reload_rows(db_name, model_class, ids):
+    """按主键重新读取摘要：同步与修复写入沿用源 last_updated，目标节点按自身水位的增量刷新看不到"""
+    tree = trees.get((db_name, model_class.__tablename__))
+    if tree is None: return
+    columns = digest_columns(model_class)
+    names = [c.name for c in columns]
+    session = SessionLocals[db_name]()
+    try:
+        seen = set()
+        for ids_chunk in chunked(ids, settings.SYNC_CHUNK_SIZE):
+            sync_throttle.acquire_queries(db_name, 1)
+            sync_throttle.acquire_rows(db_name, len(ids_chunk))
+            for row in session.query(*columns).filter(model_class.id.in_(ids_chunk)):
+                tree.put(row.id, row_digest(row, names, db_name))
+                seen.add(row.id)
+        for row_id in set(ids) - seen:
+            tree.remove(row_id)
+    finally:
+        session.close()
+
+def repair(model_class, ids):
+    """把差异行交给同步引擎：每个节点推送自己拥有的那部分 (并行推送到其他节点)，冲突照常登记"""
+    for owner_db in ALL_DBS:
+        ok, owned = read_owner_rows(model_class, owner_db, ids)
+        if owned:
+            push_to_targets(model_class, owner_db, owned)
+    for db_name in ALL_DBS:
+        reload_rows(db_name, model_class, ids)
+
+def anti_entropy_pass():
+    """【反熵校验】刷新各节点哈希树，逐个与参照节点比较根哈希，只对差异区间内的行做修复"""
+    global last_anti_entropy_report
+    started = time.perf_counter()
+    load_locked_records()
+    report = {}
+    for model_class in ANTI_ENTROPY_MODELS:
+        table_name = model_class.__tablename__
+        sync_flight.ensure_lease()
+        try:
+            refreshed = {db_name: refresh_tree(db_name, model_class) for db_name in ALL_DBS}
+            node_trees = {db_name: tree for db_name, (tree, _) in refreshed.items()}
+            # 任一节点上变化的行，在其他节点上多半是同步写入的副本 (带着源节点较早的 last_updated)，
+            # 按主键在做增量刷新的节点上重读，否则刚同步过的行会一直被判为差异、每轮重复修复
+            changed = set().union(*(ids for _, ids in refreshed.values() if ids))
+            if changed:
+                for db_name, (_, ids) in refreshed.items():
+                    if ids is not None and changed - ids:
+                        reload_rows(db_name, model_class, changed - ids)
+        except Exception as e:
+            sync_metrics.record_error("anti_entropy_refresh", e, table=table_name)
+            continue
+        # 各节点只与第一个节点比较：任意两个节点不一致时至少有一个与它不同，
+        # 差异集合与两两比较相同，比较次数随节点数线性增长
+        reference, *others = ALL_DBS
+        diverged = set()
+        for db_name in others:
+            diverged |= diff_trees(node_trees[reference], node_trees[db_name])
+        report[table_name] = len(diverged)
+        if diverged:
+            print(f"🌳 [反熵校验] {table_name} 发现 {len(diverged)} 条差异行，开始修复")
+            repair(model_class, diverged)
+
+    last_anti_entropy_report = {
+        "finished_at": datetime.now(),
+        "elapsed": round(time.perf_counter() - started, 3),
+        "diverged": report,
+    }
+
+def anti_entropy_cycle():
+    """借用同步租约执行一轮反熵 (同步进行中时跳过，等下一个周期)，读取与修复都计入同步限流"""
+    def anti_entropy():
+        with sync_throttle.scope():
+            anti_entropy_pass()
+    if not sync_flight.run_exclusive(anti_entropy):
+        sync_metrics.incr("anti_entropy_skipped_total")
+        print("⏳ [反熵校验] 同步正在进行，本次跳过")
+
+# 反熵自身的租约只用于集群内去重 (多个 worker 不重复比对)，与同步的互斥由 anti_entropy_cycle 借用同步租约保证
+anti_entropy_flight = SingleFlight("anti_entropy", anti_entropy_cycle, scheduler, min_gap=lambda: ANTI_ENTROPY_INTERVAL / 2)
+
+def start_anti_entropy_job():
+    """注册周期性反熵任务 (与同步任务共用调度器)"""
+    anti_entropy_flight.enabled = True
+    scheduler.add_job(anti_entropy_flight.run, 'interval', seconds=ANTI_ENTROPY_INTERVAL, id='anti_entropy_job', max_instances=1, coalesce=True)
@@ -1,23 +1,80 @@
 # backend/config.py 完整代码
+import os
 
-from .database import SessionLocals
+from .database import SessionLocals, CENTRAL_DB
+from .topology import topology
 from . import models
 
+def parse_node_map(raw):
+    """解析 "mysql=2,pg=2" 形式的按节点整数配置"""
+    result = {}
+    for part in raw.split(","):
+        if "=" in part:
+            name, value = part.split("=", 1)
+            result[name.strip()] = int(value)
+    return result
+
 class SystemConfig:
     def __init__(self):
         # 默认值
         self.REAL_TIME_SYNC = True
         self.SCHEDULED_SYNC = True
         self.SYNC_INTERVAL = 90
-        self.SMTP_SERVER = "smtp.qq.com"
-        self.SMTP_PORT = 465
+        # 自适应周期：开启后 SYNC_INTERVAL 作为基准，实际周期在 [MIN, MAX] 之间随变更量调整
+        self.ADAPTIVE_SYNC = False
+        self.SYNC_INTERVAL_MIN = 10
+        self.SYNC_INTERVAL_MAX = 600
+        self.SMTP_SERVER = os.getenv("SMTP_SERVER", "smtp.qq.com")
+        self.SMTP_PORT = int(os.getenv("SMTP_PORT", "465"))
+        # 本地调试指向不加密的 SMTP 替身时设置 SMTP_SSL=false
+        self.SMTP_SSL = os.getenv("SMTP_SSL", "true").lower() == "true"
+        # 冲突报警摘要窗口 (秒)：第一条冲突到达后等待该时长，期间的冲突合并为一封邮件
+        self.MAIL_DIGEST_WINDOW = float(os.getenv("MAIL_DIGEST_WINDOW", "60"))
         self.SENDER_EMAIL = ""
         self.SMTP_PASSWORD = ""
         self.FRONTEND_URL = "http://127.0.0.1:5173"
+        # 同步引擎每批处理的行数 (同时也是目标库 id IN (...) 查询的批大小)，可通过环境变量调整
+        self.SYNC_CHUNK_SIZE = int(os.getenv("SYNC_CHUNK_SIZE", "500"))
+        # 源库键集分页的页大小：每个 (表, 源节点) 流水线同一时刻只在内存中保留一页，每页处理完记录检查点
+        self.SYNC_PAGE_SIZE = int(os.getenv("SYNC_PAGE_SIZE", "2000"))
+        # 同步并发：每个节点同时参与的同步任务上限默认取拓扑中的 workers，可按节点覆盖 (格式 "mysql=2,pg=2,mssql=1")；
+        # 线程池大小默认为各节点预算之和，随节点数增长
+        self.SYNC_NODE_CONCURRENCY = parse_node_map(os.getenv("SYNC_NODE_CONCURRENCY", ""))
+        self.SYNC_WORKERS = int(os.getenv("SYNC_WORKERS", "0")) or sum(self.node_concurrency(node.name) for node in topology.nodes)
+        # 同步引擎实现："threaded" (线程池 + 同步驱动) 或 "asyncio" (单线程事件循环 + 异步驱动，见 sync_async)
+        self.SYNC_ENGINE = os.getenv("SYNC_ENGINE", "threaded").lower()
+        # 同步限流：每个节点每秒处理的行数与发出的语句数上限，可按节点覆盖 (格式同上)；
+        # 默认 0 不限 (不拖慢首次回填与故障后的追赶)，需要保护业务库时按需开启。
+        # 开启后实际限额随该节点语句耗时的 p95 自动下调，p95 目标值 (毫秒) 以下视为正常
+        self.SYNC_ROWS_PER_SEC = int(os.getenv("SYNC_ROWS_PER_SEC", "0"))
+        self.SYNC_QUERIES_PER_SEC = int(os.getenv("SYNC_QUERIES_PER_SEC", "0"))
+        self.SYNC_NODE_ROWS_PER_SEC = parse_node_map(os.getenv("SYNC_NODE_ROWS_PER_SEC", ""))
+        self.SYNC_NODE_QUERIES_PER_SEC = parse_node_map(os.getenv("SYNC_NODE_QUERIES_PER_SEC", ""))
+        self.SYNC_LATENCY_TARGET_MS = int(os.getenv("SYNC_LATENCY_TARGET_MS", "50"))
+        # 集群同步租约有效期 (秒)，持有者每隔 1/3 有效期续约一次；进程崩溃后最多等待一个有效期即可被接管
+        self.SYNC_LEASE_TTL = int(os.getenv("SYNC_LEASE_TTL", "120"))
+        # 反熵每隔多少轮做一次全量重建 (全表重读摘要，兜住既不更新 last_updated 也不写发件箱的写入，如手工 SQL)；
+        # 0 表示只在进程启动后的首轮全量构建，之后只做增量刷新
+        self.ANTI_ENTROPY_FULL_REBUILD = int(os.getenv("ANTI_ENTROPY_FULL_REBUILD", "0"))
+        # 同步引擎默认运行在独立进程 (python -m backend.sync_worker)，API 进程只有 SYNC_IN_API=true 时才启动定时同步
+        self.SYNC_IN_API = os.getenv("SYNC_IN_API", "false").lower() == "true"
+        # 同步进程的指标端口，以及 API 进程访问它的地址
+        self.SYNC_WORKER_METRICS_PORT = int(os.getenv("SYNC_WORKER_METRICS_PORT", "9108"))
+        self.SYNC_WORKER_URL = os.getenv("SYNC_WORKER_URL", "http://127.0.0.1:9108")
+
+    def node_concurrency(self, db_name):
+        """某个节点允许的并发同步任务数，未在环境变量中覆盖时取拓扑中的 workers"""
+        return self.SYNC_NODE_CONCURRENCY.get(db_name, topology.node(db_name).workers)
+
+    def node_rows_per_sec(self, db_name):
+        return self.SYNC_NODE_ROWS_PER_SEC.get(db_name, self.SYNC_ROWS_PER_SEC)
+
+    def node_queries_per_sec(self, db_name):
+        return self.SYNC_NODE_QUERIES_PER_SEC.get(db_name, self.SYNC_QUERIES_PER_SEC)
 
     def refresh(self):
-        """从总库 (MSSQL) 加载最新设置，仅在发生变化时更新并打印日志"""
-        db = SessionLocals["mssql"]()
+        """从总库加载最新设置，仅在发生变化时更新并打印日志"""
+        db = SessionLocals[CENTRAL_DB]()
         try:
             cfg = db.query(models.SystemSetting).filter(models.SystemSetting.id == 1).first()
             if cfg:
@@ -26,6 +83,9 @@ class SystemConfig:
                     self.REAL_TIME_SYNC != bool(cfg.real_time_sync) or
                     self.SCHEDULED_SYNC != bool(cfg.scheduled_sync) or
                     self.SYNC_INTERVAL != cfg.sync_interval or
+                    self.ADAPTIVE_SYNC != bool(cfg.adaptive_sync) or
+                    self.SYNC_INTERVAL_MIN != (cfg.sync_interval_min or 10) or
+                    self.SYNC_INTERVAL_MAX != (cfg.sync_interval_max or 600) or
                     self.SENDER_EMAIL != (cfg.sender_email or "") or
                     self.SMTP_PASSWORD != (cfg.smtp_password or "") or
                     self.FRONTEND_URL != (cfg.frontend_url or "")
@@ -36,11 +96,15 @@ class SystemConfig:
                     self.REAL_TIME_SYNC = bool(cfg.real_time_sync)
                     self.SCHEDULED_SYNC = bool(cfg.scheduled_sync)
                     self.SYNC_INTERVAL = cfg.sync_interval
+                    self.ADAPTIVE_SYNC = bool(cfg.adaptive_sync)
+                    self.SYNC_INTERVAL_MIN = cfg.sync_interval_min or 10
+                    self.SYNC_INTERVAL_MAX = cfg.sync_interval_max or 600
                     self.SENDER_EMAIL = cfg.sender_email or ""
                     self.SMTP_PASSWORD = cfg.smtp_password or ""
                     self.FRONTEND_URL = cfg.frontend_url or ""
                     
-                    print(f"⚙️ [系统设置已更新] Email: {self.SENDER_EMAIL}, 周期: {self.SYNC_INTERVAL}s")
+                    print(f"⚙️ [系统设置已更新] Email: {self.SENDER_EMAIL}, 周期: {self.SYNC_INTERVAL}s" +
+                          (f" (自适应 {self.SYNC_INTERVAL_MIN}-{self.SYNC_INTERVAL_MAX}s)" if self.ADAPTIVE_SYNC else ""))
             
         except Exception as e:
             # 这里的打印保留，因为报错是异常情况，需要看到
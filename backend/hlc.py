@@ -0,0 +1,100 @@
+# backend/hlc.py
+"""
+混合逻辑时钟 (HLC)：每次业务写入给行打上 "物理毫秒.逻辑计数.节点" 的版本戳 (hlc 列)，
+同步引擎按版本戳而不是各库的墙上时钟 last_updated 判断谁的写入在后。
+更新一行前先观察它现有的版本戳，新戳一定比被覆盖的版本大，与各服务器的时钟偏差无关；
+同步推送时版本戳随行原样复制，目标库上的 hlc 即 Owner 写入时的版本。
+版本戳编码为定长字符串，字典序即先后顺序，可直接在 Python 与 SQL 中比较。
+只有经过 ORM 会话 flush 的写入会自动打戳：手工 SQL、Core 语句以及存储过程 (sp_process_prescription_item)
+改动的行保留原版本戳，业务代码需要自己补打 (见创建处方)；漏打的行在同步时版本戳相同而内容不同，
+按墙上时钟与 CLOCK_SKEW_TOLERANCE 判定 (见 sync_engine.sync_row_clock)。
+"""
+import time
+import threading
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from .sync_metrics import sync_metrics
+
+# 逻辑计数位数 (同一毫秒内最多 10^5 次写入，溢出时借用下一毫秒)
+LOGICAL_DIGITS = 5
+LOGICAL_MAX = 10 ** LOGICAL_DIGITS - 1
+
+# 观察到的版本戳领先本机时钟超过该值 (秒) 时计数告警：某台服务器时钟明显超前
+HLC_MAX_DRIFT = 60
+
+def encode(physical, logical, node):
+    return f"{physical:013d}.{logical:0{LOGICAL_DIGITS}d}.{node}"
+
+def decode(stamp):
+    """版本戳 -> (物理毫秒, 逻辑计数, 节点)"""
+    physical, logical, node = stamp.split('.', 2)
+    return int(physical), int(logical), node
+
+def stamp_node(stamp):
+    """写入该版本的节点"""
+    return stamp.split('.', 2)[2]
+
+class HybridLogicalClock:
+    """进程内单调递增的混合逻辑时钟，节点名在打戳时指定 (一个进程会写多个库)"""
+
+    def __init__(self, wall=time.time):
+        self.wall = wall
+        self.physical = 0
+        self.logical = 0
+        self.lock = threading.Lock()
+
+    def _tick(self, physical, logical):
+        if logical > LOGICAL_MAX:
+            physical, logical = physical + 1, 0
+        self.physical, self.logical = physical, logical
+
+    def now(self, node):
+        """本地写入事件"""
+        with self.lock:
+            wall = int(self.wall() * 1000)
+            if wall > self.physical:
+                self._tick(wall, 0)
+            else:
+                self._tick(self.physical, self.logical + 1)
+            return encode(self.physical, self.logical, node)
+
+    def update(self, node, *observed):
+        """覆盖已有版本的写入事件：返回同时大于本地时钟与全部 observed 版本戳的新戳"""
+        with self.lock:
+            wall = int(self.wall() * 1000)
+            physical, logical = self.physical, self.logical
+            for stamp in observed:
+                if not stamp: continue
+                p, l, _ = decode(stamp)
+                if (p, l) > (physical, logical):
+                    physical, logical = p, l
+            if physical - wall > HLC_MAX_DRIFT * 1000:
+                sync_metrics.incr("hlc_drift_observed_total")
+            if wall > physical:
+                self._tick(wall, 0)
+            else:
+                self._tick(physical, logical + 1)
+            return encode(self.physical, self.logical, node)
+
+hlc_clock = HybridLogicalClock()
+
+def stamp_writes(session, flush_context, instances):
+    """
+    ORM 写入统一打戳：新增行取本地时钟，修改行观察原版本后再打戳；
+    本次已显式赋值 hlc 的对象 (如冲突仲裁对全网写入同一个版本) 保持不变
+    """
+    node = session.info.get("node")
+    if node is None: return
+    for obj in session.new:
+        if hasattr(type(obj), 'hlc') and obj.hlc is None:
+            obj.hlc = hlc_clock.now(node)
+    for obj in session.dirty:
+        if not hasattr(type(obj), 'hlc') or not session.is_modified(obj): continue
+        history = inspect(obj).attrs.hlc.history
+        if history.added: continue
+        # 未加载 (提交后过期) 时读取一次原版本
+        observed = history.unchanged or history.deleted or [obj.hlc]
+        obj.hlc = hlc_clock.update(node, *observed)
+
+# 对所有会话生效：只处理带 hlc 列且会话绑定了节点 (database.SessionLocals) 的对象
+event.listen(Session, "before_flush", stamp_writes)
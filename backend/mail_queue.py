@@ -0,0 +1,120 @@
+# backend/mail_queue.py
+"""
+冲突报警邮件队列：同步引擎登记冲突时只把通知放进内存队列并立即返回，
+后台线程把一个时间窗口内的冲突合并成一封摘要邮件，复用同一条已登录的 SMTP 连接发送；
+发送失败按指数退避重试，期间新到的冲突并入同一封摘要。同步吞吐不再受邮件服务器影响。
+冲突本身已持久化在 sync_conflict_logs 中，进程退出时未发出的通知只影响邮件，不影响人工仲裁。
+"""
+import time
+import threading
+from datetime import datetime
+from .config import settings
+from .utils import SmtpConnection, build_message, render_conflict_digest
+from .sync_metrics import sync_metrics
+
+# 队列中最多保留的冲突明细，超出部分只计数 (摘要中注明 "另有 N 条")
+MAIL_QUEUE_LIMIT = 500
+
+# 发送失败后的重试间隔 (秒)：从 MAIL_RETRY_BASE 开始每次加倍，不超过 MAIL_RETRY_MAX
+MAIL_RETRY_BASE = 5
+MAIL_RETRY_MAX = 300
+
+# 同一封摘要连续失败该次数后放弃 (记录错误，冲突仍可在系统中查看)
+MAIL_MAX_ATTEMPTS = 8
+
+class ConflictMailQueue:
+    """内存邮件队列 + 单个后台发送线程 (首次入队时启动)"""
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._pending = []
+        self._dropped = 0
+        self._thread = None
+        self._closing = False
+        self.smtp = SmtpConnection()
+
+    def enqueue(self, table_name, record_id, reason):
+        """登记一条冲突通知，立即返回"""
+        with self._cond:
+            if len(self._pending) < MAIL_QUEUE_LIMIT:
+                self._pending.append({"time": datetime.now(), "queued": time.monotonic(),
+                                      "table": table_name, "record_id": record_id, "reason": reason})
+            else:
+                self._dropped += 1
+            self._publish()
+            if self._thread is None and not self._closing:
+                self._thread = threading.Thread(target=self._run, name="conflict-mail", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _publish(self):
+        sync_metrics.set_gauge("conflict_mail_queue_depth", len(self._pending) + self._dropped)
+
+    def _take_batch(self):
+        """等到有通知且第一条已等满一个摘要窗口 (关闭时立即)，取走当前全部通知；队列已关闭且为空时返回 None"""
+        with self._cond:
+            while not (self._pending or self._dropped or self._closing):
+                self._cond.wait()
+            if not (self._pending or self._dropped):
+                return None
+            first = self._pending[0]["queued"] if self._pending else time.monotonic()
+            while not self._closing:
+                remaining = first + settings.MAIL_DIGEST_WINDOW - time.monotonic()
+                if remaining <= 0: break
+                self._cond.wait(remaining)
+            batch, dropped = self._pending, self._dropped
+            self._pending, self._dropped = [], 0
+            self._publish()
+            return batch, dropped
+
+    def _requeue(self, batch, dropped):
+        """发送失败：把这一批放回队首，与之后到达的通知合并为下一封摘要"""
+        with self._cond:
+            merged = batch + self._pending
+            self._pending = merged[:MAIL_QUEUE_LIMIT]
+            self._dropped += dropped + len(merged) - len(self._pending)
+            self._publish()
+
+    def _send(self, batch, dropped):
+        if not settings.SENDER_EMAIL or not settings.SMTP_PASSWORD:
+            print("⚠️ 邮件发送失败：管理员尚未在设置面板配置邮箱或授权码")
+            return
+        subject, content = render_conflict_digest(batch, dropped)
+        self.smtp.send(build_message(subject, content))
+        sync_metrics.incr("conflict_mails_sent_total")
+        print(f"✅ 冲突摘要邮件 ({len(batch) + dropped} 条) 已发送至 {settings.SENDER_EMAIL}")
+
+    def _run(self):
+        attempts = 0
+        while True:
+            taken = self._take_batch()
+            if taken is None: break
+            batch, dropped = taken
+            try:
+                self._send(batch, dropped)
+                attempts = 0
+                continue
+            except Exception as e:
+                attempts += 1
+                sync_metrics.record_error("conflict_mail", e)
+            if attempts >= MAIL_MAX_ATTEMPTS or self._closing:
+                print(f"❌ 冲突摘要邮件 ({len(batch) + dropped} 条) 重试 {attempts} 次后放弃")
+                sync_metrics.incr("conflict_mails_abandoned_total")
+                attempts = 0
+                continue
+            self._requeue(batch, dropped)
+            delay = min(MAIL_RETRY_MAX, MAIL_RETRY_BASE * 2 ** (attempts - 1))
+            with self._cond:
+                self._cond.wait_for(lambda: self._closing, timeout=delay)
+        self.smtp.close()
+
+    def close(self, timeout=10):
+        """进程退出前调用：立即发出队列中的通知 (失败不再重试)，并关闭 SMTP 连接"""
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+# 全局单例
+conflict_mail_queue = ConflictMailQueue()
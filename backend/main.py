@@ -3,15 +3,23 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware  # 【关键缺失】
 from contextlib import asynccontextmanager
 from .routers import analysis, medicine, conflict, auth, business, users,  stats, settings as sys_settings, advanced, maintenance
-from .sync_engine import start_sync_job, scheduler
+from .sync_engine import start_sync_job, start_stats_flush_job, scheduler, stats_buffer
+from .anti_entropy import start_anti_entropy_job
 from .config import settings
+from .mail_queue import conflict_mail_queue
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # 启动同步引擎
-    start_sync_job()
+    # 同步引擎默认运行在独立进程 (python -m backend.sync_worker)，API 进程只负责统计落库
+    if settings.SYNC_IN_API:
+        start_sync_job()
+        start_anti_entropy_job()
+    else:
+        start_stats_flush_job()
     yield
     scheduler.shutdown()
+    stats_buffer.flush()
+    conflict_mail_queue.close()
 
 app = FastAPI(
     title="DMSMDS Backend",
@@ -23,9 +31,15 @@ app = FastAPI(
 async def lifespan(app: FastAPI):
     # 【新增】启动时加载数据库配置
     settings.refresh()
-    start_sync_job()
+    if settings.SYNC_IN_API:
+        start_sync_job()
+        start_anti_entropy_job()
+    else:
+        start_stats_flush_job()
     yield
     scheduler.shutdown()
+    stats_buffer.flush()
+    conflict_mail_queue.close()
 
 # 【核心修复】配置 CORS，允许前端跨域访问
 app.add_middleware(
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Text, UniqueConstraint, Unicode, Index
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Text, UniqueConstraint, Unicode, Index, JSON
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.sql import func
 
@@ -32,9 +32,13 @@ class User(Base):
     role = Column(Unicode(20), nullable=False)
     branch_id = Column(Integer, ForeignKey('warehouses.id'), nullable=False)
     last_updated = Column(DateTime, default=func.now(), onupdate=func.now())
+    hlc = Column(String(40))  # 混合逻辑时钟版本戳，同步时据此排序写入
 
-    # 索引：加速按用户名和分院的查询
-    __table_args__ = (Index('idx_user_lookup', 'username', 'branch_id'),)
+    # 索引：加速按用户名和分院的查询；last_updated 索引供增量同步做范围扫描
+    __table_args__ = (
+        Index('idx_user_lookup', 'username', 'branch_id'),
+        Index('idx_user_sync', 'last_updated'),
+    )
 
 # ==========================================
 # 3. 业务数据 (满足要求 b: 增加性能优化索引)
@@ -46,10 +50,12 @@ class Inventory(Base):
     warehouse_id = Column(Integer, ForeignKey('warehouses.id'), nullable=False)
     quantity = Column(Integer, default=0)
     last_updated = Column(DateTime, default=func.now(), onupdate=func.now())
+    hlc = Column(String(40))  # 混合逻辑时钟版本戳，同步时据此排序写入
     
     __table_args__ = (
         UniqueConstraint('warehouse_id', 'medicine_id', name='uq_warehouse_medicine'),
         Index('idx_inventory_stock', 'warehouse_id', 'quantity'), # 加速库存预警查询
+        Index('idx_inventory_sync', 'last_updated'), # 增量同步水位扫描
     )
 
 class AuditLog(Base):
@@ -84,9 +90,13 @@ class Prescription(Base):
     
     create_time = Column(DateTime, default=func.now())
     last_updated = Column(DateTime, default=func.now(), onupdate=func.now())
+    hlc = Column(String(40))  # 混合逻辑时钟版本戳，同步时据此排序写入
 
     # 索引：满足要求 b，加速“医生处方核查”页面的多维搜索
-    __table_args__ = (Index('idx_pres_search', 'doctor_id', 'create_time', 'is_warned'),)
+    __table_args__ = (
+        Index('idx_pres_search', 'doctor_id', 'create_time', 'is_warned'),
+        Index('idx_pres_sync', 'last_updated'), # 增量同步水位扫描
+    )
 
 class PrescriptionItem(Base):
     __tablename__ = 'prescription_items'
@@ -96,6 +106,9 @@ class PrescriptionItem(Base):
     quantity = Column(Integer, nullable=False)
     price_snapshot = Column(Float, nullable=False)
     last_updated = Column(DateTime, default=func.now(), onupdate=func.now())
+    hlc = Column(String(40))  # 混合逻辑时钟版本戳，同步时据此排序写入
+
+    __table_args__ = (Index('idx_pres_item_sync', 'last_updated'),)
 
 # ==========================================
 # 5. 系统辅助
@@ -110,6 +123,9 @@ class AlertMessage(Base):
     create_time = Column(DateTime, default=func.now())
     is_read = Column(Integer, default=0)
     last_updated = Column(DateTime, default=func.now(), onupdate=func.now())
+    hlc = Column(String(40))  # 混合逻辑时钟版本戳，同步时据此排序写入
+
+    __table_args__ = (Index('idx_alert_sync', 'last_updated'),)
 
 class SyncConflictLog(Base):
     __tablename__ = 'sync_conflict_logs'
@@ -119,6 +135,8 @@ class SyncConflictLog(Base):
     source_db = Column(String(20))
     target_db = Column(String(20))
     conflict_reason = Column(Unicode(1000))
+    # 字段级差异 [{"field", "owner", "target"}]，owner 值已换算到冲突节点 (medicine_id 偏移)
+    diff_data = Column(JSON, nullable=True)
     status = Column(String(20), default='PENDING')
     resolution_choice = Column(String(20), nullable=True)
     create_time = Column(DateTime, default=func.now())
@@ -130,6 +148,10 @@ class SystemSetting(Base):
     real_time_sync = Column(Integer, default=1)
     scheduled_sync = Column(Integer, default=1)
     sync_interval = Column(Integer, default=10)
+    # 自适应同步周期：开启后按最近几轮的变更量在 [下限, 上限] 之间自动调整
+    adaptive_sync = Column(Integer, default=0)
+    sync_interval_min = Column(Integer, default=10)
+    sync_interval_max = Column(Integer, default=600)
     sender_email = Column(Unicode(100))
     smtp_password = Column(String(100))
     frontend_url = Column(String(200), default="http://localhost:5173")
@@ -149,4 +171,60 @@ class SyncStats(Base):
     auto_sync_count = Column(Integer, default=0)
     conflict_count = Column(Integer, default=0)
     manual_resolve_count = Column(Integer, default=0)
-    last_updated = Column(DateTime, default=func.now(), onupdate=func.now())
\ No newline at end of file
+    last_updated = Column(DateTime, default=func.now(), onupdate=func.now())
+
+class SyncOutbox(Base):
+    """同步发件箱 - 业务写入在同一本地事务中追加 (表, 记录ID, 操作)，由同步引擎按序消费"""
+    __tablename__ = 'sync_outbox'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    table_name = Column(String(50), nullable=False)
+    record_id = Column(String(36), nullable=False)
+    op = Column(String(10), nullable=False, default='UPSERT') # 'UPSERT' / 'DELETE'
+    is_done = Column(Integer, default=0)
+    create_time = Column(DateTime, default=func.now())
+
+    # 索引：同步引擎按 (未完成, 顺序号) 拉取待消费记录
+    __table_args__ = (Index('idx_outbox_pending', 'is_done', 'id'),)
+
+class SyncWatermark(Base):
+    """同步水位表 - 记录每个 (源节点, 表) 已成功同步到的 last_updated 高水位"""
+    __tablename__ = 'sync_watermarks'
+    source_db = Column(String(20), primary_key=True)
+    table_name = Column(String(50), primary_key=True)
+    high_water = Column(DateTime, nullable=True)
+    # 分页检查点：本轮扫描已完成到的主键，以及本轮开始时的源库时钟 (断点续传时用于推进水位)
+    resume_id = Column(String(36), nullable=True)
+    resume_clock = Column(DateTime, nullable=True)
+    last_updated = Column(DateTime, default=func.now(), onupdate=func.now())
+
+class SyncLease(Base):
+    """同步租约表 (仅总库使用) - 集群内同一时刻只有持有未过期租约的进程执行同步；rerun_requested 记录运行期间收到的合并触发"""
+    __tablename__ = 'sync_leases'
+    name = Column(String(50), primary_key=True) # 'sync' / 'anti_entropy'
+    holder = Column(String(100), nullable=True)
+    expires_at = Column(DateTime, nullable=True)
+    rerun_requested = Column(Integer, default=0)
+    finished_at = Column(DateTime, nullable=True) # 集群内最近一轮结束时间 (总库时钟)
+    last_updated = Column(DateTime, default=func.now(), onupdate=func.now())
+
+class SyncRetry(Base):
+    """同步重试队列 (仅总库使用) - 目标库写入失败的 (表, 记录, 目标节点)，按指数退避重试，多次失败后搁置 (PARKED)"""
+    __tablename__ = 'sync_retry_queue'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    table_name = Column(String(50), nullable=False)
+    record_id = Column(String(36), nullable=False)
+    source_db = Column(String(20), nullable=False) # 重试时从该节点读取权威数据
+    target_db = Column(String(20), nullable=False)
+    error_class = Column(String(100))
+    error_message = Column(Unicode(1000))
+    attempts = Column(Integer, default=0)
+    status = Column(String(20), default='PENDING') # PENDING / PARKED
+    next_attempt = Column(DateTime, nullable=True)
+    first_failed = Column(DateTime, default=func.now())
+    last_attempt = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        UniqueConstraint('table_name', 'record_id', 'target_db', name='uq_retry_record'),
+        # 索引：同步引擎按 (状态, 到期时间) 取出到期记录
+        Index('idx_retry_due', 'status', 'next_attempt'),
+    )
\ No newline at end of file
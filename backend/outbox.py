@@ -0,0 +1,63 @@
+# backend/outbox.py
+"""
+事务性发件箱 (Transactional Outbox)：
+业务接口在写业务数据的同一个本地事务里追加 (表, 记录ID, 操作) 记录，
+同步引擎按顺序号消费并标记完成，删除操作也因此对同步引擎可见。
+"""
+from sqlalchemy import update
+from .database import SessionLocals
+from . import models
+from .config import settings
+from .sync_metrics import sync_metrics
+
+OP_UPSERT = 'UPSERT'
+OP_DELETE = 'DELETE'
+
+# 每轮每个节点最多消费的发件箱记录数
+OUTBOX_BATCH = 5000
+
+def record_change(db, table_name, record_id, op=OP_UPSERT):
+    """在业务事务内追加一条发件箱记录，随业务数据一起提交或回滚"""
+    db.add(models.SyncOutbox(table_name=table_name, record_id=str(record_id), op=op))
+
+def record_obj(db, obj, op=OP_UPSERT):
+    """按 ORM 对象追加发件箱记录；自增主键尚未生成时先 flush 取得 ID"""
+    if obj.id is None:
+        db.flush()
+    record_change(db, obj.__tablename__, obj.id, op)
+
+def load_pending(db_name, limit=OUTBOX_BATCH):
+    """
+    按顺序号读取某个节点上未消费的发件箱记录。
+    返回 {表名: {'UPSERT': [记录ID...], 'DELETE': [记录ID...], 'entries': [发件箱ID...]}}
+    同一记录的多次变更只保留最后一次操作
+    """
+    db = SessionLocals[db_name]()
+    try:
+        rows = db.query(models.SyncOutbox).filter(models.SyncOutbox.is_done == 0).order_by(models.SyncOutbox.id).limit(limit).all()
+        latest = {}
+        pending = {}
+        for row in rows:
+            latest[(row.table_name, row.record_id)] = row.op
+            pending.setdefault(row.table_name, {OP_UPSERT: [], OP_DELETE: [], 'entries': []})['entries'].append(row.id)
+        for (table_name, record_id), op in latest.items():
+            pending[table_name][op].append(record_id)
+        return pending
+    finally:
+        db.close()
+
+def mark_done(db_name, entry_ids):
+    """同步成功后批量标记发件箱记录为已完成"""
+    if not entry_ids: return
+    db = SessionLocals[db_name]()
+    try:
+        entry_ids = list(entry_ids)
+        for i in range(0, len(entry_ids), settings.SYNC_CHUNK_SIZE):
+            chunk = entry_ids[i:i + settings.SYNC_CHUNK_SIZE]
+            db.execute(update(models.SyncOutbox).where(models.SyncOutbox.id.in_(chunk)).values(is_done=1))
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        sync_metrics.record_error("outbox_mark_done", e, node=db_name)
+    finally:
+        db.close()
@@ -0,0 +1,97 @@
+# backend/replication.py
+"""
+实时同步队列：业务接口提交后只把刚写入的记录放入后台队列并立即返回，
+由后台线程把这些记录定向推送到其他节点；接口可按任务 ID 查询或等待同步结果。
+同步引擎运行在独立进程时，API 进程的冲突锁定集合与重试队列键不会随同步轮次刷新，每个任务开始前从总库重新加载。
+"""
+import uuid
+import queue
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from .sync_engine import sync_records, load_locked_records, SYNC_STAGES
+from . import retry_queue
+from .sync_metrics import sync_metrics
+
+# 内存中保留的最近任务数
+MAX_TRACKED_JOBS = 1000
+
+# 按外键依赖排序：先推父表再推子表
+TABLE_ORDER = [m.__tablename__ for stage in SYNC_STAGES for m in stage]
+MODEL_BY_TABLE = {m.__tablename__: m for stage in SYNC_STAGES for m in stage}
+
+class ReplicationJob:
+    """一次定向同步任务：来源节点 + 本次写入的 (表名, 记录ID) 列表"""
+    def __init__(self, source_db, records):
+        self.id = uuid.uuid4().hex
+        self.source_db = source_db
+        self.records = list(records)
+        self.status = 'PENDING'
+        self.error = None
+        self.create_time = datetime.now()
+        self.finished_time = None
+        self.done = threading.Event()
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "status": self.status,
+            "source_db": self.source_db,
+            "records": [{"table": t, "record_id": str(r)} for t, r in self.records],
+            "error": self.error,
+            "create_time": self.create_time,
+            "finished_time": self.finished_time,
+        }
+
+class ReplicationQueue:
+    """单后台线程消费的定向同步队列，任务状态保存在内存中供接口轮询"""
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._worker = None
+
+    def submit(self, source_db, records):
+        """登记一批刚写入的记录并立即返回任务 ID"""
+        job = ReplicationJob(source_db, records)
+        with self._lock:
+            self._jobs[job.id] = job
+            while len(self._jobs) > MAX_TRACKED_JOBS:
+                self._jobs.popitem(last=False)
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="replication", daemon=True)
+                self._worker.start()
+        self._queue.put(job)
+        return job.id
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            job.status = 'RUNNING'
+            try:
+                # 先取最新的冲突锁定与待重试记录：被冲突锁定的行不推送、不重复登记冲突，推送成功的行清出重试队列
+                load_locked_records()
+                retry_queue.load_keys()
+                by_table = {}
+                for table_name, record_id in job.records:
+                    by_table.setdefault(table_name, []).append(record_id)
+                ok = True
+                for table_name in TABLE_ORDER:
+                    if table_name in by_table:
+                        ok = sync_records(job.source_db, MODEL_BY_TABLE[table_name], by_table[table_name]) and ok
+                job.status = 'DONE' if ok else 'FAILED'
+                if not ok: job.error = "部分记录推送失败，将由定时同步补齐"
+            except Exception as e:
+                job.status = 'FAILED'
+                job.error = str(e)
+                sync_metrics.record_error("replication", e, node=job.source_db)
+            finally:
+                job.finished_time = datetime.now()
+                job.done.set()
+                self._queue.task_done()
+
+replication_queue = ReplicationQueue()
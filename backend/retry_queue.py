@@ -0,0 +1,160 @@
+# backend/retry_queue.py
+"""
+同步重试队列：目标库写入失败的 (表, 记录, 目标节点) 连同错误类型与尝试次数持久化到总库的 sync_retry_queue，
+流水线照常推进水位，不再因为个别行写不进去而每轮重读整页。
+每轮同步结束前按指数退避取出到期的记录，回到源节点读取最新数据重新推送；
+连续失败达到上限后搁置 (PARKED)，不再自动重试，直到源记录再次变更并同步成功，或管理员在运维接口重新排队。
+"""
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import delete, update, func
+from .database import SessionLocals, CENTRAL_DB
+from . import models
+from .config import settings
+from .sync_metrics import sync_metrics
+
+STATUS_PENDING = 'PENDING'
+STATUS_PARKED = 'PARKED'
+
+# 第 n 次失败后等待 RETRY_BASE * 2^(n-1) 秒再重试，不超过 RETRY_MAX
+RETRY_BASE = 30
+RETRY_MAX = 3600
+
+# 连续失败该次数后搁置
+RETRY_MAX_ATTEMPTS = 8
+
+# 每轮最多重试的记录数
+RETRY_BATCH = 500
+
+# 队列中的 (表名, 记录ID, 目标节点)：每轮开始时从总库加载，同步成功的行只在命中时才访问数据库
+_lock = threading.Lock()
+queued_keys = set()
+
+def backoff(attempts):
+    return min(RETRY_MAX, RETRY_BASE * 2 ** (attempts - 1))
+
+def load_keys():
+    """一次查询加载队列中的全部键，替换内存中的集合"""
+    global queued_keys
+    db = SessionLocals[CENTRAL_DB]()
+    try:
+        rows = db.query(models.SyncRetry.table_name, models.SyncRetry.record_id, models.SyncRetry.target_db).all()
+        keys = {(r.table_name, r.record_id, r.target_db) for r in rows}
+    finally:
+        db.close()
+    with _lock:
+        queued_keys = keys
+
+def record_failures(db, table_name, source_db, target_db, failures):
+    """
+    登记一批写入失败 [(记录ID, 异常)]：已在队列中的记录累加尝试次数并按退避延后，达到上限的搁置。
+    返回是否登记成功 (失败时调用方按原方式处理，不推进水位)
+    """
+    if not failures: return True
+    now = datetime.now()
+    record_ids = [str(record_id) for record_id, _ in failures]
+    parked = 0
+    try:
+        existing = {}
+        for i in range(0, len(record_ids), settings.SYNC_CHUNK_SIZE):
+            existing.update((entry.record_id, entry) for entry in db.query(models.SyncRetry).filter(
+                models.SyncRetry.table_name == table_name,
+                models.SyncRetry.target_db == target_db,
+                models.SyncRetry.record_id.in_(record_ids[i:i + settings.SYNC_CHUNK_SIZE])
+            ))
+        for record_id, (_, exc) in zip(record_ids, failures):
+            entry = existing.get(record_id)
+            if entry is None:
+                entry = existing[record_id] = models.SyncRetry(
+                    table_name=table_name, record_id=record_id, target_db=target_db, attempts=0, first_failed=now)
+                db.add(entry)
+            entry.source_db = source_db
+            entry.attempts += 1
+            entry.error_class = type(exc).__name__
+            entry.error_message = str(exc)[:1000]
+            entry.last_attempt = now
+            if entry.attempts >= RETRY_MAX_ATTEMPTS:
+                parked += entry.status != STATUS_PARKED
+                entry.status, entry.next_attempt = STATUS_PARKED, None
+            else:
+                entry.status, entry.next_attempt = STATUS_PENDING, now + timedelta(seconds=backoff(entry.attempts))
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        sync_metrics.record_error("retry_queue", e, node=CENTRAL_DB)
+        return False
+
+    with _lock:
+        queued_keys.update((table_name, record_id, target_db) for record_id in record_ids)
+    sync_metrics.incr("sync_retry_queued_total", len(failures), table=table_name, node=target_db)
+    if parked:
+        sync_metrics.incr("sync_retry_parked_total", parked, table=table_name, node=target_db)
+        print(f"🅿️ [重试队列] {table_name} x{parked} -> {target_db} 连续失败 {RETRY_MAX_ATTEMPTS} 次，已搁置")
+    return True
+
+def clear(db, table_name, target_db, record_ids):
+    """同步成功 (或已无需同步) 的记录移出队列；不在队列中的记录没有任何数据库往返"""
+    if not queued_keys: return
+    with _lock:
+        keys = [key for key in ((table_name, str(record_id), target_db) for record_id in record_ids) if key in queued_keys]
+    if not keys: return
+    try:
+        for i in range(0, len(keys), settings.SYNC_CHUNK_SIZE):
+            db.execute(delete(models.SyncRetry).where(
+                models.SyncRetry.table_name == table_name,
+                models.SyncRetry.target_db == target_db,
+                models.SyncRetry.record_id.in_([key[1] for key in keys[i:i + settings.SYNC_CHUNK_SIZE]])
+            ))
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        sync_metrics.record_error("retry_queue", e, node=CENTRAL_DB)
+        return
+    with _lock:
+        queued_keys.difference_update(keys)
+    sync_metrics.incr("sync_retry_succeeded_total", len(keys), table=table_name, node=target_db)
+
+def load_due(limit=RETRY_BATCH):
+    """到期的待重试记录，按 (表名, 源节点, 目标节点) 分组：{(表名, 源节点, 目标节点): [记录ID...]}"""
+    if not queued_keys: return {}
+    db = SessionLocals[CENTRAL_DB]()
+    try:
+        rows = db.query(models.SyncRetry.table_name, models.SyncRetry.source_db, models.SyncRetry.target_db, models.SyncRetry.record_id).filter(
+            models.SyncRetry.status == STATUS_PENDING,
+            models.SyncRetry.next_attempt <= datetime.now()
+        ).order_by(models.SyncRetry.next_attempt).limit(limit).all()
+    finally:
+        db.close()
+    due = {}
+    for row in rows:
+        due.setdefault((row.table_name, row.source_db, row.target_db), []).append(row.record_id)
+    return due
+
+def requeue_parked():
+    """搁置的记录重新排队 (尝试次数清零，下一轮即重试)，返回条数"""
+    db = SessionLocals[CENTRAL_DB]()
+    try:
+        res = db.execute(update(models.SyncRetry).where(models.SyncRetry.status == STATUS_PARKED)
+                         .values(status=STATUS_PENDING, attempts=0, next_attempt=datetime.now()))
+        db.commit()
+        return res.rowcount
+    finally:
+        db.close()
+
+def summary():
+    """队列深度 (按状态) 与最早一条失败记录的等待时间，同时更新告警用的仪表盘指标"""
+    db = SessionLocals[CENTRAL_DB]()
+    try:
+        rows = db.query(models.SyncRetry.status, func.count(), func.min(models.SyncRetry.first_failed)).group_by(models.SyncRetry.status).all()
+    finally:
+        db.close()
+    now = datetime.now()
+    depth = dict.fromkeys((STATUS_PENDING, STATUS_PARKED), 0)
+    oldest = {}
+    for status, count, first_failed in rows:
+        depth[status] = count
+        oldest[status] = round((now - first_failed).total_seconds(), 3) if first_failed else 0
+    for status, count in depth.items():
+        sync_metrics.set_gauge("sync_retry_queue_depth", count, status=status)
+        sync_metrics.set_gauge("sync_retry_oldest_age_seconds", oldest.get(status, 0), status=status)
+    return {"depth": depth, "oldest_age": oldest}
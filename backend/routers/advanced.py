@@ -4,6 +4,7 @@ from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy import text
 import time
 from ..database import SessionLocals
+from ..topology import topology
 from ..security import get_current_user
 from .. import models
 
@@ -15,12 +16,13 @@ def performance_challenge(current_user: dict = Depends(get_current_user)):
     性能挑战：修复了 MSSQL 的 LIMIT 语法兼容性问题
     """
     db_name = current_user['db_name']
+    dialect = topology.dialect(db_name)
     db = SessionLocals[db_name]()
     
     # 1. 根据数据库类型，处理“限制行数”的语法差异
     limit_clause = "LIMIT 20"
     top_clause = ""
-    if db_name == 'mssql':
+    if dialect == 'mssql':
         limit_clause = ""
         top_clause = "TOP 20"
 
@@ -37,12 +39,12 @@ def performance_challenge(current_user: dict = Depends(get_current_user)):
     
     # 3. 针对不同数据库构造“强制忽略索引”的语法
     unoptimized_sql = base_sql
-    if db_name == 'mysql':
+    if dialect == 'mysql':
         unoptimized_sql = base_sql.replace(
             "JOIN prescriptions p", 
             "JOIN prescriptions p IGNORE INDEX (PRIMARY, idx_pres_search)"
         )
-    elif db_name == 'mssql':
+    elif dialect == 'mssql':
         # SQL Server 强制全表扫描
         unoptimized_sql = base_sql.replace(
             "JOIN prescriptions p", 
@@ -62,13 +64,13 @@ def performance_challenge(current_user: dict = Depends(get_current_user)):
         # 获取执行计划 (Explain)
         explain_str = ""
         try:
-            if db_name == 'mysql':
+            if dialect == 'mysql':
                 exp = db.execute(text(f"EXPLAIN {sql}")).fetchall()
                 explain_str = f"Plan: {exp[0][3]} | type: {exp[0][4]} | key: {exp[0][5]}"
-            elif db_name == 'pg':
+            elif dialect == 'postgresql':
                 exp = db.execute(text(f"EXPLAIN {sql}")).fetchall()
                 explain_str = str(exp[0][0])
-            elif db_name == 'mssql':
+            elif dialect == 'mssql':
                 # MSSQL 查看执行计划的方法比较特殊，这里展示逻辑说明
                 explain_str = "SQL Server Index Hint: WITH (INDEX(0)) forced Full Table Scan."
         except:
@@ -111,7 +113,7 @@ def run_diagnosis(current_user: dict = Depends(get_current_user)):
         print(f"正在为分院 {branch_id} 执行游标诊断...")
         
         # 1. 调用存储过程
-        if db_name == "mssql":
+        if topology.dialect(db_name) == "mssql":
             # MSSQL 的存储过程通常不通过 res.scalar() 直接返回，而是写入表
             db.execute(text(f"EXEC sp_generate_stock_report @p_warehouse_id={branch_id}"))
         else:
@@ -143,7 +145,7 @@ def run_diagnosis(current_user: dict = Depends(get_current_user)):
 def get_alerts(current_user: dict = Depends(get_current_user)):
     """
     风险预警查询：
-    - super_admin: 看全院 (warehouse_id 1,2,3)
+    - super_admin: 看全院 (全部分院)
     - branch_admin: 只看本院
     """
     db = SessionLocals[current_user['db_name']]()
@@ -2,7 +2,7 @@
 from fastapi import APIRouter, Depends
 from sqlalchemy.orm import Session
 from sqlalchemy import func
-from ..database import get_db
+from ..database import get_db, CENTRAL_DB
 from .. import models, schemas
 
 router = APIRouter(prefix="/analysis", tags=["复杂查询与分析"])
@@ -10,7 +10,7 @@ router = APIRouter(prefix="/analysis", tags=["复杂查询与分析"])
 @router.get("/inventory-value", response_model=list[schemas.AnalysisResult])
 def get_inventory_value_by_category(
     category: str, 
-    db: Session = Depends(lambda: next(get_db("mssql"))) # 默认去 SQL Server (总库) 查
+    db: Session = Depends(lambda: next(get_db(CENTRAL_DB))) # 默认去总库查
 ):
     """
     【满足任务书第5条】：多表连接、聚合查询
@@ -2,16 +2,13 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 from ..database import get_db, SessionLocals
+from ..topology import topology
 from .. import models, security
 
 router = APIRouter(prefix="/auth", tags=["认证与登录"])
 
-# 分院ID 到 数据库名 的映射
-BRANCH_DB_MAP = {
-    1: "mysql",   # 分院1 -> MySQL
-    2: "pg",      # 分院2 -> PostgreSQL
-    3: "mssql"    # 总院 -> SQL Server
-}
+# 分院ID 到 数据库名 的映射 (来自拓扑文件)
+BRANCH_DB_MAP = topology.owner_map
 
 @router.post("/login")
 def login(form_data: OAuth2PasswordRequestForm = Depends()):
@@ -21,7 +18,7 @@ def login(form_data: OAuth2PasswordRequestForm = Depends()):
     user = None
     
     # 1. 轮询所有数据库查找用户 (利用数据冗余提高可用性)
-    for db_scan in ["mysql", "pg", "mssql"]:
+    for db_scan in topology.names:
         db = SessionLocals[db_scan]()
         try:
             found_user = db.query(models.User).filter(models.User.username == username).first()
@@ -5,12 +5,13 @@ from pydantic import BaseModel
 from typing import List, Optional
 import uuid
 from datetime import datetime
-from ..database import SessionLocals
+from ..database import SessionLocals, CENTRAL_DB
+from ..topology import topology
 from ..security import get_current_user
-from .. import models
-from ..sync_engine import sync_logic 
+from .. import models, outbox
+from ..replication import replication_queue
+from ..hlc import hlc_clock
 from ..config import settings
-import time
 
 router = APIRouter(prefix="/business", tags=["核心业务"])
 
@@ -73,7 +74,13 @@ class AdminActionOut(BaseModel):
     class Config:
         from_attributes = True
 
-DB_BRANCH_NAMES = {1: "第一分院(MySQL)", 2: "第二分院(PG)", 3: "集团总院(MSSQL)"}
+# 分院 (仓库) ID -> 所属节点的显示名 (来自拓扑文件)
+DB_BRANCH_NAMES = {branch: topology.node(db_name).label for branch, db_name in topology.owner_map.items()}
+
+def submit_replication(db_name, records):
+    """实时同步开启时，把本次写入的记录交给后台队列定向推送，立即返回任务 ID"""
+    if not settings.REAL_TIME_SYNC: return None
+    return replication_queue.submit(db_name, records)
 
 # --- 1. 创建处方 ---
 @router.post("/prescription/create")
@@ -88,28 +95,34 @@ def create_prescription(req: PrescriptionCreate, current_user: dict = Depends(ge
                                       doctor_id=current_user['id'], warehouse_id=current_user['branch_id'],
                                       total_amount=0.0, create_time=now_time, last_updated=now_time)
         db.add(new_pres)
+        changed = [(models.Prescription.__tablename__, pres_uuid)]
         total_price = 0.0
         for item in req.items:
-            if db_name == "mssql":
+            if topology.dialect(db_name) == "mssql":
                 sql = text(f"EXEC sp_process_prescription_item @p_user_id={current_user['id']}, @p_medicine_id={item.medicine_id}, @p_quantity={item.quantity}")
             else:
                 sql = text(f"CALL sp_process_prescription_item({current_user['id']}, {item.medicine_id}, {item.quantity})")
             db.execute(sql)
             med = db.query(models.Medicine).filter(models.Medicine.id == item.medicine_id).first()
             total_price += med.price * item.quantity
-            db.add(models.PrescriptionItem(id=str(uuid.uuid4()), prescription_id=pres_uuid, medicine_id=item.medicine_id,
+            item_uuid = str(uuid.uuid4())
+            db.add(models.PrescriptionItem(id=item_uuid, prescription_id=pres_uuid, medicine_id=item.medicine_id,
                                           quantity=item.quantity, price_snapshot=med.price, last_updated=now_time))
+            outbox.record_change(db, models.PrescriptionItem.__tablename__, item_uuid)
+            changed.append((models.PrescriptionItem.__tablename__, item_uuid))
+            # 存储过程扣减了本院库存，同样登记到发件箱；存储过程不经过 ORM，在这里补打版本戳
+            inv = db.query(models.Inventory).filter(models.Inventory.warehouse_id == current_user['branch_id'], models.Inventory.medicine_id == item.medicine_id).first()
+            if inv:
+                inv.hlc = hlc_clock.update(db_name, inv.hlc)
+                outbox.record_change(db, models.Inventory.__tablename__, inv.id)
+                changed.append((models.Inventory.__tablename__, inv.id))
             db.add(models.AuditLog(medicine_id=item.medicine_id, warehouse_id=current_user['branch_id'],
                                   change_amount=-item.quantity, operation_type="PRESCRIPTION",
                                   operator_id=current_user['id'], description=f"处方: {pres_no}", create_time=now_time))
         new_pres.total_amount = total_price
+        outbox.record_change(db, models.Prescription.__tablename__, pres_uuid)
         db.commit()
-        if settings.REAL_TIME_SYNC:
-            try: 
-                time.sleep(1)
-                sync_logic()
-            except: pass
-        return {"status": "success"}
+        return {"status": "success", "replication_id": submit_replication(db_name, changed)}
     except Exception as e:
         db.rollback()
         raise HTTPException(400, detail=str(e))
@@ -136,13 +149,10 @@ def create_allocation(req: AllocationReq, current_user: dict = Depends(get_curre
         
         detail = f"【调配】从 {DB_BRANCH_NAMES.get(req.source_branch_id)} 调拨 {med.name} x{req.quantity} 至 {DB_BRANCH_NAMES.get(req.target_branch_id)}"
         db.add(models.AdminAction(operator_id=current_user['id'], action_type="ALLOCATE", details=detail, create_time=now_time))
+        outbox.record_obj(db, s_inv)
+        outbox.record_obj(db, t_inv)
         db.commit()
-        if settings.REAL_TIME_SYNC:
-            try: 
-                time.sleep(1)
-                sync_logic()
-            except: pass
-        return {"status": "success"}
+        return {"status": "success", "replication_id": submit_replication(current_user['db_name'], [(models.Inventory.__tablename__, s_inv.id), (models.Inventory.__tablename__, t_inv.id)])}
     except Exception as e:
         db.rollback()
         raise HTTPException(500, detail=str(e))
@@ -168,23 +178,28 @@ def create_inbound(req: InboundReq, current_user: dict = Depends(get_current_use
         
         detail = f"【入库】为 {DB_BRANCH_NAMES.get(req.warehouse_id)} 办理 {med.name} 采购入库 x{req.quantity}"
         db.add(models.AdminAction(operator_id=current_user['id'], action_type="INBOUND", details=detail, create_time=now_time))
+        outbox.record_obj(db, inv)
         db.commit()
-        if settings.REAL_TIME_SYNC:
-            try: 
-                time.sleep(1)
-                sync_logic()
-            except: pass
-        return {"status": "success"}
+        return {"status": "success", "replication_id": submit_replication(current_user['db_name'], [(models.Inventory.__tablename__, inv.id)])}
     except Exception as e:
         db.rollback()
         raise HTTPException(500, detail=str(e))
     finally: db.close()
 
+# --- 4. 实时同步状态查询 ---
+@router.get("/replication/{job_id}")
+def get_replication_status(job_id: str, wait: float = 0, current_user: dict = Depends(get_current_user)):
+    """查询定向同步任务状态；wait > 0 时最多阻塞等待该秒数 (上限 30 秒) 直到同步完成"""
+    job = replication_queue.get(job_id)
+    if not job: raise HTTPException(404, "同步任务不存在或已过期")
+    if wait > 0: job.done.wait(min(wait, 30))
+    return job.to_dict()
+
 # --- 查询类接口 ---
 @router.get("/admin-actions", response_model=List[AdminActionOut])
 def get_admin_actions(current_user: dict = Depends(get_current_user)):
     if current_user['role'] != 'super_admin': raise HTTPException(403)
-    db = SessionLocals["mssql"]()
+    db = SessionLocals[CENTRAL_DB]()
     try:
         return db.query(models.AdminAction).order_by(models.AdminAction.create_time.desc()).all()
     finally: db.close()
@@ -193,10 +208,9 @@ def get_admin_actions(current_user: dict = Depends(get_current_user)):
 def get_warehouse_stock(db_name: str):
     db = SessionLocals[db_name]()
     try:
-        target_map = { "mysql": 1, "pg": 2, "mssql": 3 }
-        target = target_map.get(db_name)
+        branches = topology.node(db_name).branches
         q = db.query(models.Inventory)
-        if target: q = q.filter(models.Inventory.warehouse_id == target)
+        if branches: q = q.filter(models.Inventory.warehouse_id.in_(branches))
         return q.all()
     finally: db.close()
 
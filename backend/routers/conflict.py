@@ -1,12 +1,14 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
-from sqlalchemy import inspect
 from pydantic import BaseModel
 from typing import List, Optional
 from datetime import datetime
-from ..database import SessionLocals
+from ..database import SessionLocals, CENTRAL_DB
+from ..topology import topology
+from ..hlc import hlc_clock
 from .. import models
-from ..sync_engine import update_daily_stats # 引入
+from ..sync_engine import update_daily_stats, unlock_record # 引入
+from ..row_transform import get_transformer, CANONICAL
 
 router = APIRouter(prefix="/conflicts", tags=["冲突管理"])
 
@@ -14,11 +16,12 @@ router = APIRouter(prefix="/conflicts", tags=["冲突管理"])
 
 class ConflictResolveRequest(BaseModel):
     log_id: int
-    db_choice: str  # 管理员选定的权威数据库：'mysql', 'pg', 或 'mssql'
+    db_choice: str  # 管理员选定的权威数据库 (拓扑中的节点名，如 'mysql', 'pg', 'mssql')
 
 class ConflictLogOut(BaseModel):
     id: int
     conflict_reason: str
+    diff_data: Optional[List[dict]] = None  # 字段级差异 (早期记录为空，仅有 conflict_reason)
     create_time: datetime
     table_name: str
     source_db: str
@@ -52,41 +55,21 @@ def extract_normalized_data(src_obj, model_class, src_db_name):
     逻辑：如果是从 PG 提取，medicine_id 需要减去 253 变成标准 ID 1, 2, 3...
     这样在分发给其他库时才不会出错。
     """
-    mapper = inspect(model_class)
-    data = {}
-    for column in mapper.attrs:
-        prop_name = column.key
-        # 排除主键和系统自动生成的字段
-        if prop_name in ['id', 'last_updated', 'create_time', '_sa_instance_state']:
-            continue
-        
-        val = getattr(src_obj, prop_name)
-        
-        # ID 归一化：处理分院2 (PostgreSQL) 的特殊偏移
-        if prop_name == 'medicine_id' and src_db_name == 'pg' and val is not None:
-            val -= 253
-            
-        data[prop_name] = val
-    return data
+    return get_transformer(model_class, src_db_name, CANONICAL).normalized(src_obj)
 
 def apply_data_with_offset(target_obj, data_dict, target_db_name):
     """
     【核心补丁】：将归一化后的数据写入目标对象
     逻辑：如果目标是 PG，medicine_id 需要重新加上 253。
     """
-    for key, val in data_dict.items():
-        # ID 差异化写入
-        if key == 'medicine_id' and target_db_name == 'pg' and val is not None:
-            setattr(target_obj, key, val + 253)
-        else:
-            setattr(target_obj, key, val)
+    get_transformer(type(target_obj), CANONICAL, target_db_name).apply_dict(data_dict, target_obj)
 
 # --- API 接口实现 ---
 
 @router.get("/", response_model=List[ConflictLogOut])
 def get_pending_conflicts():
     """获取所有待处理的冲突列表（从总库读取）"""
-    db = SessionLocals["mssql"]() 
+    db = SessionLocals[CENTRAL_DB]() 
     try:
         conflicts = db.query(models.SyncConflictLog).filter(
             models.SyncConflictLog.status == 'PENDING'
@@ -98,7 +81,7 @@ def get_pending_conflicts():
 @router.get("/history", response_model=List[ConflictLogOut])
 def get_conflict_history():
     """获取所有已解决的冲突历史记录"""
-    db = SessionLocals["mssql"]()
+    db = SessionLocals[CENTRAL_DB]()
     try:
         history = db.query(models.SyncConflictLog).filter(
             models.SyncConflictLog.status == 'RESOLVED'
@@ -113,10 +96,10 @@ def resolve_conflict(req: ConflictResolveRequest):
     【核心仲裁逻辑 - 完整版】
     1. 选定一个库作为“真理”。
     2. 自动处理跨库 ID 偏移 (+253)。
-    3. 同时强制更新全网三个数据库，确保数据绝对同步。
-    4. 对齐所有库的时间戳，解除同步引擎的死循环报警。
+    3. 同时强制更新拓扑中的全部数据库，确保数据绝对同步。
+    4. 对齐所有库的时间戳与版本戳，解除同步引擎的死循环报警。
     """
-    central_db = SessionLocals["mssql"]()
+    central_db = SessionLocals[CENTRAL_DB]()
     try:
         # A. 查找冲突日志
         log = central_db.query(models.SyncConflictLog).filter(models.SyncConflictLog.id == req.log_id).first()
@@ -130,12 +113,8 @@ def resolve_conflict(req: ConflictResolveRequest):
         if not ModelClass:
             raise HTTPException(status_code=400, detail=f"暂不支持处理表 {log.table_name} 的冲突")
 
-        # C. 准备连接全网三个数据库
-        sessions = {
-            "mysql": SessionLocals["mysql"](),
-            "pg": SessionLocals["pg"](),
-            "mssql": SessionLocals["mssql"]()
-        }
+        # C. 准备连接拓扑中的全部数据库
+        sessions = {db_name: SessionLocals[db_name]() for db_name in topology.names}
 
         try:
             # D. 提取并“洗白”选中的权威数据
@@ -150,9 +129,13 @@ def resolve_conflict(req: ConflictResolveRequest):
 
             # E. 执行全网强制同步覆盖
             now_time = datetime.now()
+            targets = {db_name: sess.query(ModelClass).filter(ModelClass.id == log.record_id).first()
+                       for db_name, sess in sessions.items()}
+            # 全网写入同一个版本戳，且大于任何一份副本的现有版本，同步引擎视为同一版本不再报警
+            version = hlc_clock.update(req.db_choice, *(getattr(r, 'hlc', None) for r in targets.values() if r is not None))
 
             for db_name, sess in sessions.items():
-                target_record = sess.query(ModelClass).filter(ModelClass.id == log.record_id).first()
+                target_record = targets[db_name]
                 
                 if target_record:
                     # 场景 1：目标库已有记录 -> 执行更新并处理偏移
@@ -160,16 +143,12 @@ def resolve_conflict(req: ConflictResolveRequest):
                     target_record.last_updated = now_time
                 else:
                     # 场景 2：目标库缺失记录 -> 执行强制创建
-                    new_params = {}
-                    for k, v in normalized_data.items():
-                        if k == 'medicine_id' and db_name == 'pg':
-                            new_params[k] = v + 253
-                        else:
-                            new_params[k] = v
-                    
-                    new_obj = ModelClass(id=master_record.id, **new_params)
-                    new_obj.last_updated = now_time
-                    sess.add(new_obj)
+                    target_record = ModelClass(id=master_record.id)
+                    apply_data_with_offset(target_record, normalized_data, db_name)
+                    target_record.last_updated = now_time
+                    sess.add(target_record)
+                if hasattr(ModelClass, 'hlc'):
+                    target_record.hlc = version
                 
                 # 提交当前数据库的事务
                 sess.commit()
@@ -179,6 +158,7 @@ def resolve_conflict(req: ConflictResolveRequest):
             log.resolution_choice = req.db_choice
             log.resolved_time = now_time
             central_db.commit()
+            unlock_record(log.table_name, log.record_id)
 
             update_daily_stats('resolve') # 【新增】
 
@@ -1,9 +1,11 @@
 from fastapi import APIRouter, Depends, HTTPException
 from fastapi.responses import PlainTextResponse
-from sqlalchemy import inspect, text
-from ..database import SessionLocals
+from sqlalchemy import inspect, text, insert, select
+from ..database import SessionLocals, CENTRAL_DB
 from ..security import get_current_user
 from .. import models
+from ..row_transform import get_transformer
+from .. import retry_queue
 from datetime import datetime
 from typing import List
 
@@ -96,21 +98,12 @@ def migrate_database(source_db: str, target_db: str, current_user: dict = Depend
         
         # 2. 按照依赖顺序迁移数据
         for model in TABLE_MODELS:
-            rows = s_db.query(model).all()
-            for row in rows:
-                # 提取数据
-                new_data = {c.key: getattr(row, c.key) for c in inspect(model).attrs if not c.key.startswith('_')}
-                
-                # 【核心补丁】处理你之前的 PG ID 不对齐问题 (+253 逻辑)
-                if 'medicine_id' in new_data and new_data['medicine_id'] is not None:
-                    # 如果是从非 PG 迁往 PG
-                    if source_db != 'pg' and target_db == 'pg':
-                        new_data['medicine_id'] += 253
-                    # 如果是从 PG 迁往 非 PG
-                    elif source_db == 'pg' and target_db != 'pg':
-                        new_data['medicine_id'] -= 253
-
-                t_db.add(model(**new_data))
+            # 【核心补丁】处理 PG ID 不对齐问题 (+253 逻辑)，由预编译转换器统一换算；按 Core 元组读取
+            transformer = get_transformer(model, source_db, target_db)
+            rows = s_db.execute(select(*transformer.columns)).all()
+            new_rows = [transformer.row_dict(row) for row in rows]
+            if new_rows:
+                t_db.execute(insert(model), new_rows)
             
             t_db.flush() # 每迁移一张表刷新一次缓存
             
@@ -121,4 +114,32 @@ def migrate_database(source_db: str, target_db: str, current_user: dict = Depend
         raise HTTPException(status_code=500, detail=f"迁移失败: {str(e)}")
     finally:
         s_db.close()
-        t_db.close()
\ No newline at end of file
+        t_db.close()
+# --- 3. 同步重试队列 ---
+@router.get("/retry-queue")
+def get_retry_queue(status: str = retry_queue.STATUS_PARKED, limit: int = 100, current_user: dict = Depends(get_current_user)):
+    """查看同步重试队列：按状态的深度、最早失败记录的等待时间，以及最近失败的若干条记录"""
+    if current_user['role'] != 'super_admin':
+        raise HTTPException(status_code=403, detail="权限不足")
+    db = SessionLocals[CENTRAL_DB]()
+    try:
+        entries = db.query(models.SyncRetry).filter(models.SyncRetry.status == status).order_by(
+            models.SyncRetry.last_attempt.desc()).limit(limit).all()
+        return {
+            **retry_queue.summary(),
+            "entries": [{
+                "table_name": e.table_name, "record_id": e.record_id, "source_db": e.source_db, "target_db": e.target_db,
+                "error_class": e.error_class, "error_message": e.error_message, "attempts": e.attempts,
+                "next_attempt": e.next_attempt, "first_failed": e.first_failed, "last_attempt": e.last_attempt,
+            } for e in entries]
+        }
+    finally:
+        db.close()
+
+@router.post("/retry-queue/requeue")
+def requeue_parked_retries(current_user: dict = Depends(get_current_user)):
+    """排除故障后把搁置的记录重新排队，下一轮同步即重试"""
+    if current_user['role'] != 'super_admin':
+        raise HTTPException(status_code=403, detail="权限不足")
+    count = retry_queue.requeue_parked()
+    return {"status": "success", "message": f"已重新排队 {count} 条搁置记录"}
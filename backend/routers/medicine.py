@@ -74,8 +74,8 @@ def simulate_central_update(
     """
     # 这里的 db 依赖如果默认不是 mssql，需要手动获取 mssql 的 session
     # 为了演示简单，我们假设 main.py 里 get_db 默认行为或这里手动通过 database.SessionLocals 获取
-    from ..database import SessionLocals
-    mssql_db = SessionLocals["mssql"]
+    from ..database import SessionLocals, CENTRAL_DB
+    mssql_db = SessionLocals[CENTRAL_DB]
     
     try:
         inventory = mssql_db.query(models.Inventory).filter(
@@ -1,10 +1,11 @@
 # backend/routers/settings.py 完整代码
 from fastapi import APIRouter, Depends, HTTPException
 from ..config import settings
-from ..database import SessionLocals
+from ..database import SessionLocals, CENTRAL_DB
+from ..topology import topology
 from .. import models
 from ..security import get_current_user
-from ..sync_engine import scheduler
+from ..sync_engine import request_sync, apply_sync_interval
 from pydantic import BaseModel
 
 router = APIRouter(prefix="/settings", tags=["系统配置"])
@@ -16,6 +17,9 @@ class ConfigUpdate(BaseModel):
     admin_email: str
     smtp_password: str
     frontend_url: str  # 【新增】支持修改前端 URL
+    adaptive: bool = False  # 自适应周期，interval 作为基准
+    interval_min: int = 10
+    interval_max: int = 600
 
 @router.get("/")
 def get_settings(current_user: dict = Depends(get_current_user)):
@@ -28,14 +32,27 @@ def get_settings(current_user: dict = Depends(get_current_user)):
         "interval": settings.SYNC_INTERVAL,
         "admin_email": settings.SENDER_EMAIL,
         "smtp_password": settings.SMTP_PASSWORD,
-        "frontend_url": settings.FRONTEND_URL # 【新增】返回当前 URL
+        "frontend_url": settings.FRONTEND_URL, # 【新增】返回当前 URL
+        "adaptive": settings.ADAPTIVE_SYNC,
+        "interval_min": settings.SYNC_INTERVAL_MIN,
+        "interval_max": settings.SYNC_INTERVAL_MAX,
+    }
+
+@router.get("/topology")
+def get_topology(current_user: dict = Depends(get_current_user)):
+    """节点清单 (前端的院区切换、冲突仲裁按钮据此生成)"""
+    return {
+        "central": topology.central,
+        "nodes": [{"name": node.name, "label": node.label, "branches": node.branches} for node in topology.nodes],
     }
 
 @router.put("/")
 def update_settings(configs: ConfigUpdate, current_user: dict = Depends(get_current_user)):
     if current_user['role'] != 'super_admin': raise HTTPException(403)
+    if configs.interval_min < 1 or configs.interval_min > configs.interval_max:
+        raise HTTPException(400, "周期下限必须大于 0 且不超过上限")
     
-    db = SessionLocals["mssql"]()
+    db = SessionLocals[CENTRAL_DB]()
     try:
         cfg = db.query(models.SystemSetting).filter(models.SystemSetting.id == 1).first()
         if not cfg:
@@ -49,16 +66,24 @@ def update_settings(configs: ConfigUpdate, current_user: dict = Depends(get_curr
         cfg.sender_email = configs.admin_email
         cfg.smtp_password = configs.smtp_password
         cfg.frontend_url = configs.frontend_url # 【新增】保存到数据库
+        cfg.adaptive_sync = int(configs.adaptive)
+        cfg.sync_interval_min = configs.interval_min
+        cfg.sync_interval_max = configs.interval_max
         db.commit()
 
         # 2. 同步更新内存
-        old_interval = settings.SYNC_INTERVAL
         settings.refresh()
 
-        # 3. 动态调整定时器周期
-        if old_interval != configs.interval:
-            scheduler.reschedule_job('sync_job_id', trigger='interval', seconds=settings.SYNC_INTERVAL)
+        # 3. 动态调整定时器周期 (本进程未运行定时同步时不做任何事)
+        # (同步运行在独立进程时由其定时任务在下一次触发时自行重新调度)
+        apply_sync_interval()
             
         return {"message": "配置已成功保存至数据库并应用"}
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+@router.post("/sync-now")
+def trigger_sync(current_user: dict = Depends(get_current_user)):
+    """立即触发一轮同步：交给后台调度器执行，集群内正在同步时合并到下一轮"""
+    if current_user['role'] != 'super_admin': raise HTTPException(403)
+    return {"status": request_sync()}
@@ -1,9 +1,15 @@
 # backend/routers/stats.py 完整代码
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import PlainTextResponse
+import json
+from urllib.request import urlopen
 from sqlalchemy import func, text, cast, Date
-from ..database import SessionLocals
+from ..database import SessionLocals, CENTRAL_DB
 from ..security import get_current_user
-from .. import models
+from ..config import settings
+from ..sync_metrics import sync_metrics
+from ..sync_engine import sync_flight, adaptive_interval
+from .. import models, anti_entropy
 
 router = APIRouter(prefix="/stats", tags=["统计分析"])
 
@@ -71,7 +77,7 @@ def get_dashboard_stats(start_date: str, end_date: str, current_user: dict = Dep
 @router.get("/sync-report")
 def get_sync_report(current_user: dict = Depends(get_current_user)):
     if current_user['role'] != 'super_admin': raise HTTPException(403)
-    db = SessionLocals["mssql"]()
+    db = SessionLocals[CENTRAL_DB]()
     try:
         # 获取最近 7 天的同步数据
         stats = db.query(models.SyncStats).order_by(models.SyncStats.sync_date.desc()).limit(7).all()
@@ -79,4 +85,35 @@ def get_sync_report(current_user: dict = Depends(get_current_user)):
         stats.reverse()
         return stats
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+def fetch_worker_metrics(path):
+    """同步运行在独立进程时，从同步进程的指标端口转发"""
+    with urlopen(settings.SYNC_WORKER_URL.rstrip('/') + path, timeout=3) as resp:
+        return resp.read().decode('utf-8')
+
+@router.get("/sync-metrics")
+def get_sync_metrics(current_user: dict = Depends(get_current_user)):
+    """同步引擎运行指标 (JSON)：最近若干轮的耗时分布、按表/节点的耗时与行数、往返次数与最近错误"""
+    if current_user['role'] != 'super_admin': raise HTTPException(403)
+    if not sync_flight.enabled:
+        try:
+            return json.loads(fetch_worker_metrics("/metrics.json"))
+        except Exception as e:
+            raise HTTPException(502, detail=f"同步进程指标不可用: {e}")
+    data = sync_metrics.to_dict(adaptive_interval.current())
+    data["anti_entropy"] = anti_entropy.last_anti_entropy_report
+    return data
+
+@router.get("/sync-metrics/prometheus", response_class=PlainTextResponse)
+def get_sync_metrics_prometheus(current_user: dict = Depends(get_current_user)):
+    """同步引擎运行指标 (Prometheus 文本格式)；独立部署时也可以直接抓取同步进程的 /metrics"""
+    if current_user['role'] != 'super_admin': raise HTTPException(403)
+    if not sync_flight.enabled:
+        try:
+            body = fetch_worker_metrics("/metrics")
+        except Exception as e:
+            raise HTTPException(502, detail=f"同步进程指标不可用: {e}")
+    else:
+        body = sync_metrics.render_prometheus(adaptive_interval.current())
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
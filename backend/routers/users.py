@@ -3,7 +3,7 @@ from sqlalchemy.orm import Session
 from pydantic import BaseModel
 from typing import List, Optional
 from ..database import get_db, SessionLocals
-from .. import models, security
+from .. import models, security, outbox
 from ..security import get_current_user
 
 router = APIRouter(prefix="/users", tags=["用户管理"])
@@ -74,6 +74,7 @@ def create_user(user: UserCreate, current_user: dict = Depends(get_current_user)
             branch_id=user.branch_id
         )
         db.add(new_user)
+        outbox.record_obj(db, new_user)
         db.commit()
         return {"status": "success"}
     finally:
@@ -97,6 +98,7 @@ def update_user(user_id: int, update: UserUpdate, current_user: dict = Depends(g
 
         if update.role: user.role = update.role
         if update.branch_id: user.branch_id = update.branch_id
+        outbox.record_obj(db, user)
         db.commit()
         return {"status": "success"}
     finally:
@@ -127,6 +129,7 @@ def delete_user(user_id: int, current_user: dict = Depends(get_current_user)):
             raise HTTPException(403, "权限不足")
 
         db.delete(user)
+        outbox.record_obj(db, user, outbox.OP_DELETE)
         db.commit()
         return {"status": "success", "message": "用户已删除"}
     finally:
@@ -0,0 +1,158 @@
+# backend/row_transform.py
+"""
+行转换器：启动时为每个 (模型, 源节点, 目标节点) 预编译一次
+列清单、ID 偏移换算 (规则来自拓扑文件)、快速相等判断、差异描述与 Core UPDATE 语句，
+同步引擎、整库迁移与冲突仲裁共用，热循环里不再逐行 inspect 模型或拼接字符串。
+同步热路径上的行是按 columns 顺序查询得到的 Core 元组 (Row)，按下标取值，不构造 ORM 实例。
+"""
+from sqlalchemy import Float, inspect, update, bindparam
+from .topology import topology
+from . import models
+
+# 比对时忽略的列 (由各库自行维护的时间戳与写入版本戳)
+COMPARE_EXCLUDE = ('last_updated', 'create_time', 'hlc')
+
+# 浮点列比对容差
+FLOAT_TOLERANCE = 0.001
+
+# 标准 ID 空间 (不属于任何节点)，用于冲突仲裁时的归一化
+CANONICAL = None
+
+def column_offset(column, source_db, target_db):
+    """从源节点换算到目标节点时该列需要加上的常量 (如第二分院 PG 的药品字典 ID 从 254 开始，medicine_id +253)"""
+    return topology.id_offset(target_db, column) - topology.id_offset(source_db, column)
+
+class RowTransformer:
+    """一个 (模型, 源节点, 目标节点) 的预编译转换器"""
+    __slots__ = ('model_class', 'source_db', 'target_db', 'columns', 'keys', 'data_keys', 'offsets',
+                 'shifts', 'compare', 'id_index', 'ts_index', 'hlc_index', 'update_stmt', 'align_stmt')
+
+    def __init__(self, model_class, source_db, target_db):
+        self.model_class = model_class
+        self.source_db = source_db
+        self.target_db = target_db
+        attrs = [a for a in inspect(model_class).column_attrs if not a.key.startswith('_')]
+        # 查询列清单 (Core 元组按此顺序返回)、全部列名 (插入 / 迁移) 与除主键外的列名 (更新)
+        self.columns = tuple(a.columns[0] for a in attrs)
+        self.keys = tuple(a.key for a in attrs)
+        self.data_keys = tuple(k for k in self.keys if k != 'id')
+        self.offsets = {k: d for k in self.keys if k in topology.offset_columns and (d := column_offset(k, source_db, target_db))}
+        # 需要换算的列：(下标, 偏移)
+        self.shifts = tuple((self.keys.index(k), d) for k, d in self.offsets.items())
+        # 比对清单：(下标, 列名, 偏移, 是否浮点)
+        self.compare = tuple(
+            (i, a.key, self.offsets.get(a.key, 0), isinstance(a.columns[0].type, Float))
+            for i, a in enumerate(attrs) if a.key not in COMPARE_EXCLUDE
+        )
+        self.id_index = self.keys.index('id') if 'id' in self.keys else None
+        self.ts_index = self.keys.index('last_updated') if 'last_updated' in self.keys else None
+        self.hlc_index = self.keys.index('hlc') if 'hlc' in self.keys else None
+        # 按主键批量更新 (executemany)：全部列，以及仅对齐时间戳与版本戳
+        self.update_stmt = self.align_stmt = None
+        if self.id_index is not None:
+            table = model_class.__table__
+            where = table.c.id == bindparam('b_id')
+            self.update_stmt = update(table).where(where).values({c: bindparam(f"b_{c.key}") for c in self.columns if c.key != 'id'})
+            if self.ts_index is not None:
+                aligned = {table.c.last_updated: bindparam('b_last_updated')}
+                if self.hlc_index is not None:
+                    aligned[table.c.hlc] = bindparam('b_hlc')
+                self.align_stmt = update(table).where(where).values(aligned)
+
+    # ---------- Core 元组 (同步热路径 / 迁移) ----------
+
+    def values(self, row):
+        """取出源行的列值并换算到目标节点"""
+        values = list(row)
+        for i, delta in self.shifts:
+            if values[i] is not None:
+                values[i] += delta
+        return values
+
+    def row_dict(self, row):
+        """源行 -> 目标节点的 {列名: 值} (用于批量插入、迁移)"""
+        return dict(zip(self.keys, self.values(row)))
+
+    def update_params(self, row):
+        """源行 -> update_stmt 的一组参数"""
+        return {f"b_{k}": v for k, v in zip(self.keys, self.values(row))}
+
+    def align_params(self, row):
+        """源行 -> align_stmt 的一组参数 (只对齐 last_updated 与 hlc)"""
+        params = {'b_id': row[self.id_index], 'b_last_updated': row[self.ts_index]}
+        if self.hlc_index is not None:
+            params['b_hlc'] = row[self.hlc_index]
+        return params
+
+    def differs(self, row, target_row):
+        """快速判断两行业务内容是否不同，遇到第一处差异即返回"""
+        for i, _, delta, is_float in self.compare:
+            v1 = row[i]
+            v2 = target_row[i]
+            if delta and v1 is not None: v1 += delta
+            if is_float and isinstance(v1, float) and isinstance(v2, float):
+                if abs(v1 - v2) > FLOAT_TOLERANCE: return True
+            elif v1 != v2:
+                return True
+        return False
+
+    def diff_fields(self, row, target_row):
+        """
+        字段级差异：[(列名, 源值, 目标值)]，源值已换算到目标节点 (与目标值可直接比较)；
+        只有确实存在差异时才逐列收集，否则返回 None
+        """
+        if not self.differs(row, target_row): return None
+        fields = []
+        for i, key, delta, is_float in self.compare:
+            v1 = row[i]
+            v2 = target_row[i]
+            if delta and v1 is not None: v1 += delta
+            if is_float and isinstance(v1, float) and isinstance(v2, float):
+                if abs(v1 - v2) <= FLOAT_TOLERANCE: continue
+            elif v1 == v2:
+                continue
+            fields.append((key, v1, v2))
+        return fields
+
+    def diff(self, row, target_row):
+        """差异描述：只有确实存在差异时才格式化文本，否则返回 None"""
+        fields = self.diff_fields(row, target_row)
+        return format_diff(fields) if fields else None
+
+    # ---------- ORM 对象 (冲突仲裁) ----------
+
+    def translate(self, key, val):
+        delta = self.offsets.get(key)
+        return val + delta if delta and val is not None else val
+
+    def normalized(self, obj):
+        """提取 ORM 对象的业务列 (不含主键与时间戳) 并换算到目标坐标系，目标为 CANONICAL 时即标准 ID"""
+        return {key: self.translate(key, getattr(obj, key)) for _, key, _, _ in self.compare if key != 'id'}
+
+    def apply_dict(self, data, target_obj):
+        """把一份 (源节点坐标系下的) 字典写到目标 ORM 对象上"""
+        for key, val in data.items():
+            setattr(target_obj, key, self.translate(key, val))
+
+def format_diff(fields):
+    """字段级差异 -> 日志与冲突表中的差异描述 "列名:[源值 vs 目标值], ..." """
+    return ", ".join(f"{key}:[{v1} vs {v2}]" for key, v1, v2 in fields)
+
+def _compile_all():
+    nodes = topology.names + [CANONICAL]
+    compiled = {}
+    for mapper in models.Base.registry.mappers:
+        for source_db in nodes:
+            for target_db in nodes:
+                compiled[(mapper.class_, source_db, target_db)] = RowTransformer(mapper.class_, source_db, target_db)
+    return compiled
+
+# 启动时一次性编译全部转换器
+TRANSFORMERS = _compile_all()
+
+def get_transformer(model_class, source_db, target_db):
+    return TRANSFORMERS[(model_class, source_db, target_db)]
+
+def row_columns(model_class):
+    """同步/迁移读取一张表时的查询列清单，与转换器的下标一一对应"""
+    return TRANSFORMERS[(model_class, CANONICAL, CANONICAL)].columns
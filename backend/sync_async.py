@@ -0,0 +1,384 @@
+# backend/sync_async.py
+"""
+asyncio 同步引擎 (SYNC_ENGINE=asyncio)：与线程池引擎相同的流水线 (键集分页 -> 回查 Owner -> 推送 -> 检查点)，
+所有节点、所有表的数据库往返在同一个事件循环线程里交错进行，同一条流水线内读取下一页与推送当前页也相互重叠。
+PG 使用 asyncpg，MySQL 使用 aiomysql；MSSQL 没有成熟的异步驱动，用同步会话 + asyncio.to_thread 适配。
+比对、归属判断、写入语句与一轮的记账复用 sync_engine 的实现；总库上的水位、发件箱、冲突登记等少量操作
+沿用同步实现并放到线程中执行。
+"""
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from sqlalchemy import event, select, func
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from . import database, sync_throttle
+from .database import SessionLocals
+from .config import settings
+from .sync_metrics import sync_metrics
+from .row_transform import get_transformer
+from .sync_engine import (ALL_DBS, SYNC_LANES, SyncCycle, sync_flight, SyncJobResult, SyncPass, chunked, coerce_ids, classify_rows,
+                          owned_by, not_covered_by_owner, resume_point, naive_clock, next_watermark, save_watermark,
+                          page_query, ids_queries, sync_row, row_writes, record_chunk, delete_stmt, record_deletes, is_connection_error,
+                          CHUNK_STATEMENTS, ROW_STATEMENTS)
+
+# 同步驱动 -> 异步驱动；不在表中的节点 (MSSQL) 走线程适配
+ASYNC_DRIVERS = {
+    "mysql+pymysql": "mysql+aiomysql",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+def async_engine_args(url):
+    """由同步引擎的 URL 推出异步引擎的 URL 与连接参数"""
+    connect_args = {}
+    options = url.query.get("options")
+    if url.get_backend_name() == "postgresql" and options:
+        # asyncpg 不认 libpq 的 options 参数，"-c timezone=..." 改为 server_settings
+        connect_args["server_settings"] = dict(part.strip().split("=", 1) for part in options.split("-c") if "=" in part)
+        url = url.difference_update_query(["options"])
+    return url.set(drivername=ASYNC_DRIVERS[url.drivername]), connect_args
+
+# {节点: async_sessionmaker}，在事件循环线程中首次使用时创建，连接池跨轮复用
+_async_factories = {}
+
+def async_factory(db_name):
+    """节点的异步会话工厂；没有异步驱动的节点返回 None"""
+    if db_name not in _async_factories:
+        url = database.engines[db_name].url
+        factory = None
+        if url.drivername in ASYNC_DRIVERS:
+            async_url, connect_args = async_engine_args(url)
+            engine = create_async_engine(async_url, pool_pre_ping=True, pool_recycle=300, connect_args=connect_args)
+            # 与同步引擎一样计入连接池取出次数与数据库往返次数
+            event.listen(engine.sync_engine, "checkout", database._make_checkout_counter(db_name))
+            event.listen(engine.sync_engine, "before_cursor_execute", database._make_query_counter(db_name))
+            factory = async_sessionmaker(engine, expire_on_commit=False)
+        _async_factories[db_name] = factory
+    return _async_factories[db_name]
+
+class NodeSession:
+    """一个节点的会话适配：每条语句扣减该节点预付的令牌 (不等待)，执行并记录耗时"""
+    def __init__(self, db_name):
+        self.db_name = db_name
+
+    async def _timed(self, call):
+        sync_throttle.charge_query_async(self.db_name)
+        started = time.perf_counter()
+        result = await call
+        sync_throttle.record_latency(self.db_name, time.perf_counter() - started)
+        return result
+
+    async def all(self, stmt):
+        return await self._timed(self._all(stmt))
+
+    async def execute(self, stmt, params=None):
+        return await self._timed(self._execute(stmt, params))
+
+    async def scalar(self, stmt):
+        rows = await self.all(stmt)
+        return rows[0][0] if rows else None
+
+class AsyncDriverSession(NodeSession):
+    def __init__(self, db_name, session):
+        super().__init__(db_name)
+        self.session = session
+
+    async def _all(self, stmt):
+        return (await self.session.execute(stmt)).all()
+
+    async def _execute(self, stmt, params):
+        await self.session.execute(stmt, params)
+
+    async def commit(self):
+        await self.session.commit()
+
+    async def rollback(self):
+        await self.session.rollback()
+
+    async def close(self):
+        await self.session.close()
+
+class ThreadedDriverSession(NodeSession):
+    """没有异步驱动的节点：同步会话的每次调用放到线程中执行 (同一会话的调用依次 await，不会并发)"""
+    def __init__(self, db_name):
+        super().__init__(db_name)
+        self.session = SessionLocals[db_name](expire_on_commit=False)
+
+    async def _all(self, stmt):
+        return await asyncio.to_thread(lambda: self.session.execute(stmt).all())
+
+    async def _execute(self, stmt, params):
+        await asyncio.to_thread(self.session.execute, stmt, params)
+
+    async def commit(self):
+        await asyncio.to_thread(self.session.commit)
+
+    async def rollback(self):
+        await asyncio.to_thread(self.session.rollback)
+
+    async def close(self):
+        await asyncio.to_thread(self.session.close)
+
+def open_session(db_name):
+    factory = async_factory(db_name)
+    return AsyncDriverSession(db_name, factory()) if factory else ThreadedDriverSession(db_name)
+
+class AsyncSyncPass:
+    """与 SyncPass 相同：一次推送过程中每个目标节点只打开一个会话，结束时统一关闭"""
+    def __init__(self):
+        self.sessions = {}
+
+    def session(self, db_name):
+        if db_name not in self.sessions:
+            self.sessions[db_name] = open_session(db_name)
+        return self.sessions[db_name]
+
+    async def close(self):
+        for session in self.sessions.values():
+            await session.close()
+
+async def fetch_rows_by_ids_async(session, model_class, ids, before=None):
+    rows = []
+    for q in ids_queries(model_class, ids, before):
+        rows.extend(await session.all(q))
+    return rows
+
+async def write_rows_async(session, transformer, events):
+    for stmt, params in row_writes(transformer, events):
+        await session.execute(stmt, params)
+
+def record_events(events, model_class, source_db_name, target_db_name, failures):
+    """统计、日志、冲突与重试队列登记 (写总库，在线程中执行)"""
+    with SyncPass() as sp:
+        return record_chunk(sp, events, model_class, source_db_name, target_db_name, failures)
+
+async def sync_chunk_async(sp, items, model_class, source_db_name, target_db_name):
+    """与 sync_chunk 相同：一次回查、内存比对、按动作批量写入并整批提交，失败时逐行重放，出错的行进入重试队列；连接级错误直接返回 False"""
+    if not items: return True
+    failures = []
+    target_session = sp.session(target_db_name)
+    transformer = get_transformer(model_class, source_db_name, target_db_name)
+    await sync_throttle.acquire_rows_async(target_db_name, len(items))
+    # 事务开始前预付本批的语句令牌：一次回查 + 至多新增/更新/对齐三条写入
+    await sync_throttle.acquire_queries_async(target_db_name, CHUNK_STATEMENTS)
+    try:
+        target_map = {row.id: row for row in await fetch_rows_by_ids_async(target_session, model_class, [item.id for item in items])}
+        events = [(item, *sync_row(item, target_map.get(item.id), transformer)) for item in items]
+        await write_rows_async(target_session, transformer, events)
+        await target_session.commit()
+    except Exception as e:
+        await target_session.rollback()
+        sync_metrics.record_error("batch_commit", e, table=model_class.__tablename__, node=target_db_name)
+        if is_connection_error(e):
+            print(f"🔌 [同步中断] {target_db_name} 连接失败，{model_class.__tablename__} 本批 {len(items)} 行留待下一轮")
+            return False
+        events = []
+        for item in items:
+            try:
+                await sync_throttle.acquire_queries_async(target_db_name, ROW_STATEMENTS)
+                target_row = next(iter(await fetch_rows_by_ids_async(target_session, model_class, [item.id])), None)
+                row_event = (item, *sync_row(item, target_row, transformer))
+                await write_rows_async(target_session, transformer, [row_event])
+                await target_session.commit()
+                events.append(row_event)
+            except Exception as e:
+                await target_session.rollback()
+                sync_metrics.record_error("row_write", e, table=model_class.__tablename__, node=target_db_name)
+                if is_connection_error(e):
+                    await asyncio.to_thread(record_events, events, model_class, source_db_name, target_db_name, failures)
+                    return False
+                failures.append((item.id, e))
+
+    return await asyncio.to_thread(record_events, events, model_class, source_db_name, target_db_name, failures)
+
+async def push_rows_async(model_class, source_db_name, target_db_name, items):
+    sp = AsyncSyncPass()
+    try:
+        for chunk in chunked(items, settings.SYNC_CHUNK_SIZE):
+            if not await sync_chunk_async(sp, chunk, model_class, source_db_name, target_db_name):
+                return False
+    finally:
+        await sp.close()
+    return True
+
+async def read_owner_rows_async(model_class, owner_db, ids):
+    session = open_session(owner_db)
+    try:
+        return owned_by(model_class, owner_db, await fetch_rows_by_ids_async(session, model_class, ids))
+    finally:
+        await session.close()
+
+async def sync_page_async(model_class, source_db_name, items, node_slots, owner_marks=None):
+    """与 sync_page 相同，但各 Owner 的回查、各目标节点的推送并发进行"""
+    owned, foreign = classify_rows(items, model_class, source_db_name)
+
+    async def owner_batch(owner_db, ids):
+        async with node_slots[owner_db]:
+            rows = await read_owner_rows_async(model_class, owner_db, ids)
+        return owner_db, not_covered_by_owner(rows, owner_db, owner_marks)
+
+    async def push(owner_db, rows, target_db_name):
+        async with node_slots[target_db_name]:
+            return await push_rows_async(model_class, owner_db, target_db_name, rows)
+
+    batches = [(source_db_name, owned)]
+    batches += await asyncio.gather(*(owner_batch(owner_db, ids) for owner_db, ids in foreign.items()))
+    results = await asyncio.gather(*(push(owner_db, rows, target_db_name)
+                                     for owner_db, rows in batches if rows
+                                     for target_db_name in ALL_DBS if target_db_name != owner_db))
+    return all(results)
+
+async def stream_source_async(model_class, source_db_name, node_slots, watermarks, outbox_ids=(), deadline=None):
+    """
+    与 stream_source 相同的分页、检查点与预算语义；推送当前页的同时预读下一页 (内存中最多两页)
+    """
+    table_name = model_class.__tablename__
+    page_size = settings.SYNC_PAGE_SIZE
+    owner_marks, old_mark, cursor, clock = resume_point(model_class, source_db_name, watermarks)
+    had_checkpoint = cursor is not None
+
+    async def read_page(after_id):
+        nonlocal clock
+        sync_flight.ensure_lease()
+        await sync_throttle.acquire_queries_async(source_db_name, 1 + (clock is None))
+        async with node_slots[source_db_name]:
+            session = open_session(source_db_name)
+            try:
+                if clock is None: clock = naive_clock(await session.scalar(select(func.now())))
+                items = await session.all(page_query(model_class, old_mark, after_id, page_size))
+            finally:
+                await session.close()
+        await sync_throttle.acquire_rows_async(source_db_name, len(items))
+        sync_metrics.incr("sync_rows_scanned_total", len(items), table=table_name, node=source_db_name)
+        return items
+
+    items = await read_page(cursor)
+    prefetch = None
+    try:
+        while items:
+            if len(items) == page_size:
+                prefetch = asyncio.create_task(read_page(items[-1].id))
+            if not await sync_page_async(model_class, source_db_name, items, node_slots, owner_marks):
+                return False, None
+            if prefetch is None: break
+            # 还有下一页：记录检查点
+            cursor = items[-1].id
+            await asyncio.to_thread(save_watermark, source_db_name, table_name, old_mark, cursor, clock)
+            had_checkpoint = True
+            if deadline is not None and time.perf_counter() >= deadline:
+                return True, False
+            items, prefetch = await prefetch, None
+    finally:
+        if prefetch is not None:
+            prefetch.cancel()
+
+    if old_mark is not None:
+        for ids_chunk in chunked(coerce_ids(model_class, outbox_ids), page_size):
+            sync_flight.ensure_lease()
+            async with node_slots[source_db_name]:
+                session = open_session(source_db_name)
+                try:
+                    items = await fetch_rows_by_ids_async(session, model_class, ids_chunk, before=old_mark)
+                finally:
+                    await session.close()
+            await sync_throttle.acquire_rows_async(source_db_name, len(items))
+            sync_metrics.incr("sync_rows_scanned_total", len(items), table=table_name, node=source_db_name)
+            if items and not await sync_page_async(model_class, source_db_name, items, node_slots, owner_marks):
+                return False, None
+
+    high_water = next_watermark(old_mark, clock)
+    if high_water is not None and (high_water != old_mark or had_checkpoint):
+        await asyncio.to_thread(save_watermark, source_db_name, table_name, high_water)
+    return True, True
+
+async def apply_deletes_async(model_class, source_db_name, target_db_name, ids):
+    """与 apply_deletes 相同：目标库中仍存在、且归属于删除方节点的行一并删除"""
+    session = open_session(target_db_name)
+    try:
+        deleted = 0
+        for q in ids_queries(model_class, coerce_ids(model_class, ids)):
+            doomed = [row.id for row in owned_by(model_class, source_db_name, await session.all(q))]
+            if doomed:
+                await session.execute(delete_stmt(model_class, doomed))
+                deleted += len(doomed)
+        await session.commit()
+        record_deletes(model_class, source_db_name, target_db_name, deleted)
+        return True, None
+    except Exception:
+        await session.rollback()
+        raise
+    finally:
+        await session.close()
+
+async def run_job_async(db_name, fn, *args):
+    """与 run_job 相同：计时，任务自身的异常转换为失败结果"""
+    started = time.perf_counter()
+    table_name = args[0].__tablename__
+    try:
+        ok, data = await fn(*args)
+    except Exception as e:
+        sync_metrics.record_error(fn.__name__, e, table=table_name, node=db_name)
+        ok, data = False, None
+    elapsed = time.perf_counter() - started
+    sync_metrics.incr("sync_job_seconds_total", elapsed, table=table_name, node=db_name)
+    return SyncJobResult(ok, elapsed, data)
+
+async def run_node_job_async(node_slots, db_name, fn, *args):
+    async with node_slots[db_name]:
+        return await run_job_async(db_name, fn, *args)
+
+async def sync_logic_async():
+    """与 sync_logic 相同的通道、阶段与记账，流水线以协程并发执行"""
+    cycle = await asyncio.to_thread(SyncCycle, "asyncio")
+    node_slots = {db_name: asyncio.Semaphore(settings.node_concurrency(db_name)) for db_name in ALL_DBS}
+
+    async def run_all(jobs, runner):
+        keys = [key for key, _, _, _ in jobs]
+        results = await asyncio.gather(*(runner(db_name, fn, *args) for _, db_name, fn, args in jobs))
+        cycle.work_time += sum(r.elapsed for r in results)
+        return dict(zip(keys, results))
+
+    for lane in SYNC_LANES:
+        deadline = cycle.begin_lane(lane)
+        for stage in lane.stages:
+            sync_flight.ensure_lease()
+            cycle.finish_stage(stage, await run_all([
+                ((m, src), src, stream_source_async, (m, src, node_slots, cycle.watermarks, outbox_ids, deadline))
+                for m, src, outbox_ids in cycle.upsert_jobs(stage)
+            ], run_job_async))
+        for stage in reversed(lane.stages):
+            sync_flight.ensure_lease()
+            deletes = await run_all([
+                ((m, src, tgt), tgt, apply_deletes_async, (m, src, tgt, ids))
+                for m, src, tgt, ids in cycle.delete_jobs(stage)
+            ], partial(run_node_job_async, node_slots))
+            await asyncio.to_thread(cycle.mark_outbox, stage, deletes)
+        cycle.finish_lane(lane)
+
+    # 重试队列每轮只有少量到期记录，沿用同步实现在线程中执行
+    sync_flight.ensure_lease()
+    await asyncio.to_thread(cycle.retry_writes)
+    await asyncio.to_thread(cycle.finish)
+
+class LoopThread:
+    """同步专用的事件循环线程：异步引擎的连接池绑定在这个循环上，跨轮复用；调度器线程提交协程并等待结果"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.loop = None
+
+    def run(self, coro):
+        with self._lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                # 线程适配 (MSSQL) 与总库操作使用的线程数与线程池引擎一致
+                self.loop.set_default_executor(ThreadPoolExecutor(max_workers=settings.SYNC_WORKERS, thread_name_prefix="sync-offload"))
+                threading.Thread(target=self.loop.run_forever, name="sync-asyncio", daemon=True).start()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+_loop_thread = LoopThread()
+
+def run_coroutine(coro):
+    """在同步专用事件循环中执行协程并阻塞等待结果"""
+    return _loop_thread.run(coro)
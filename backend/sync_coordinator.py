@@ -0,0 +1,334 @@
+# backend/sync_coordinator.py
+"""
+同步协调器 (Single-Flight)：保证整个集群同一时刻只有一轮同步在执行。
+每个进程 (uvicorn worker) 都有自己的调度器，执行前先在总库 sync_leases 表上用条件 UPDATE 抢占租约，
+租约时间以总库时钟为准，执行期间后台线程定期续约；进程崩溃后租约过期即可被其他进程接管。
+续约被拒 (租约已被接管) 或持续出错到租约即将过期时，心跳线程设置 "租约失效" 标记，
+正在执行的一轮在阶段与分页之间检查该标记并中止，不会与接管的进程同时写入。
+执行期间收到的触发不会并发执行，而是合并为 "结束后再跑一轮"：本进程内用内存标记，跨进程用租约行上的 rerun_requested。
+反熵校验等维护任务通过 run_exclusive() 借用同步租约执行，与同步在集群内互斥。
+"""
+import os
+import time
+import uuid
+import socket
+import threading
+from datetime import timedelta
+from sqlalchemy import update, or_, func
+from sqlalchemy.exc import IntegrityError
+from .database import SessionLocals, CENTRAL_DB
+from . import models
+from .config import settings
+from .sync_metrics import sync_metrics
+
+# 租约存放的节点 (总库)
+LEASE_DB = CENTRAL_DB
+
+# 本进程的租约持有者标识
+HOLDER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+# 续约出错 (如总库瞬时故障) 后的重试间隔 (秒)
+LEASE_RENEW_RETRY = 1
+
+class LeaseLost(RuntimeError):
+    """本进程持有的租约已失效，正在执行的一轮必须中止"""
+
+class LeaseHeartbeat(threading.Thread):
+    """
+    持有租约期间每隔 1/3 有效期续约一次；续约出错时按 LEASE_RENEW_RETRY 重试，
+    续约被拒或直到租约按本地估计即将过期仍未成功时，标记租约失效
+    """
+    def __init__(self, flight, acquired_at):
+        super().__init__(name=f"lease-{flight.name}", daemon=True)
+        self.flight = flight
+        # 本地估计的租约到期时刻 (monotonic)：以发起抢占 / 续约的时刻为起点，偏保守
+        self.expires = acquired_at + settings.SYNC_LEASE_TTL
+        self.stopped = threading.Event()
+
+    def run(self):
+        interval = max(1, settings.SYNC_LEASE_TTL / 3)
+        wait = interval
+        while not self.stopped.wait(wait):
+            attempted = time.monotonic()
+            try:
+                renewed = self.flight.renew()
+            except Exception as e:
+                sync_metrics.record_error("lease_renew", e, lease=self.flight.name)
+                if time.monotonic() + LEASE_RENEW_RETRY < self.expires:
+                    wait = LEASE_RENEW_RETRY
+                    continue
+                self.flight.lose_lease("续约持续失败，租约即将过期")
+                return
+            if not renewed:
+                self.flight.lose_lease("租约已被其他进程接管")
+                return
+            self.expires = attempted + settings.SYNC_LEASE_TTL
+            wait = interval
+
+    def stop(self):
+        self.stopped.set()
+
+class SingleFlight:
+    """
+    一个集群级单飞任务：run() 由调度器周期调用，request() 供人工/接口触发 (交给调度器线程执行)。
+    min_gap 返回两轮之间的最小间隔 (秒)：多个进程的定时器各自触发时，集群内刚跑完一轮就跳过
+    """
+    def __init__(self, name, fn, scheduler, min_gap=None):
+        self.name = name
+        self.fn = fn
+        self.scheduler = scheduler
+        self.min_gap = min_gap or (lambda: 0)
+        # 本进程是否执行该任务 (同步进程，或 SYNC_IN_API 时的 API 进程)；否则人工触发只登记到租约行
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._running = False
+        self._rerun = False
+        # 本进程持有的租约已失效：由心跳线程设置，执行中的一轮通过 ensure_lease() 检查
+        self.lease_lost = threading.Event()
+
+    # ---------- 租约 (总库上的条件 UPDATE，天然原子) ----------
+
+    def _now(self, db):
+        return db.query(func.now()).scalar()
+
+    def acquire(self, min_gap=0):
+        """租约空闲/已过期/本进程持有时抢占成功；min_gap > 0 时集群内上一轮结束不足该间隔也视为失败"""
+        db = SessionLocals[LEASE_DB]()
+        try:
+            now = self._now(db)
+            lease = models.SyncLease
+            conditions = [lease.name == self.name,
+                          or_(lease.holder.is_(None), lease.holder == HOLDER_ID, lease.expires_at < now)]
+            if min_gap:
+                conditions.append(or_(lease.finished_at.is_(None), lease.finished_at <= now - timedelta(seconds=min_gap)))
+            res = db.execute(update(lease).where(*conditions).values(
+                holder=HOLDER_ID, expires_at=now + timedelta(seconds=settings.SYNC_LEASE_TTL), rerun_requested=0
+            ))
+            if res.rowcount == 0:
+                if db.query(lease.name).filter(lease.name == self.name).first():
+                    db.rollback()
+                    return False
+                # 首次运行：插入租约行，并发插入时主键冲突的一方失败
+                db.add(lease(name=self.name, holder=HOLDER_ID, rerun_requested=0,
+                             expires_at=now + timedelta(seconds=settings.SYNC_LEASE_TTL)))
+            db.commit()
+            return True
+        except IntegrityError:
+            db.rollback()
+            return False
+        finally:
+            db.close()
+
+    def renew(self):
+        db = SessionLocals[LEASE_DB]()
+        try:
+            now = self._now(db)
+            res = db.execute(update(models.SyncLease).where(
+                models.SyncLease.name == self.name, models.SyncLease.holder == HOLDER_ID
+            ).values(expires_at=now + timedelta(seconds=settings.SYNC_LEASE_TTL)))
+            db.commit()
+            return res.rowcount == 1
+        finally:
+            db.close()
+
+    def release(self, finished=True):
+        """
+        结束一轮：没有待合并的触发时释放租约并记录结束时间 (finished=False 时不记录)，返回 'released'；
+        有其他进程请求的重跑时清除标记并继续持有，返回 'rerun'；租约已不属于本进程返回 'lost'
+        """
+        db = SessionLocals[LEASE_DB]()
+        try:
+            now = self._now(db)
+            lease = models.SyncLease
+            mine = (lease.name == self.name, lease.holder == HOLDER_ID)
+            # rerun_requested = 0 作为释放条件，避免在 "检查标记" 与 "释放" 之间丢失触发
+            values = {"holder": None, "expires_at": None}
+            if finished: values["finished_at"] = now
+            res = db.execute(update(lease).where(*mine, or_(lease.rerun_requested.is_(None), lease.rerun_requested == 0))
+                             .values(**values))
+            if res.rowcount == 1:
+                db.commit()
+                return 'released'
+            res = db.execute(update(lease).where(*mine).values(
+                rerun_requested=0, expires_at=now + timedelta(seconds=settings.SYNC_LEASE_TTL)
+            ))
+            db.commit()
+            return 'rerun' if res.rowcount == 1 else 'lost'
+        finally:
+            db.close()
+
+    def lose_lease(self, reason):
+        sync_metrics.record_error("lease_renew", LeaseLost(reason), lease=self.name)
+        print(f"⛔ [租约失效] {self.name}: {reason}，中止本轮")
+        self.lease_lost.set()
+
+    def ensure_lease(self):
+        """执行中的一轮在阶段与分页之间调用：租约已失效时抛出 LeaseLost (不在持有租约期间调用时无效果)"""
+        if self.lease_lost.is_set():
+            raise LeaseLost(f"{self.name} 的租约已失效")
+
+    def request_remote(self):
+        """本进程不执行该任务时的人工触发：在租约行上登记请求，由执行进程轮询或在本轮结束时接手"""
+        db = SessionLocals[LEASE_DB]()
+        try:
+            res = db.execute(update(models.SyncLease).where(models.SyncLease.name == self.name).values(rerun_requested=1))
+            if res.rowcount == 0:
+                db.add(models.SyncLease(name=self.name, rerun_requested=1))
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            return self.request_remote()
+        finally:
+            db.close()
+
+    def poll_requests(self):
+        """执行进程定期检查租约行上的人工触发请求 (租约被持有时由持有者在释放前接手)"""
+        db = SessionLocals[LEASE_DB]()
+        try:
+            lease = db.get(models.SyncLease, self.name)
+            requested = bool(lease and lease.rerun_requested and (lease.holder is None or lease.expires_at < self._now(db)))
+        finally:
+            db.close()
+        if requested:
+            self.run(force=True)
+
+    def request_rerun(self):
+        """租约被其他进程持有时，请求持有者在本轮结束后再跑一轮；返回 False 表示租约此刻空闲"""
+        db = SessionLocals[LEASE_DB]()
+        try:
+            res = db.execute(update(models.SyncLease).where(
+                models.SyncLease.name == self.name, models.SyncLease.holder.isnot(None)
+            ).values(rerun_requested=1))
+            db.commit()
+            return res.rowcount == 1
+        finally:
+            db.close()
+
+    # ---------- 执行 ----------
+
+    def run(self, force=False):
+        """
+        尝试以集群内唯一执行者的身份跑一轮。force=False (定时触发) 时集群内刚跑完或正在跑就直接跳过；
+        force=True (人工触发) 时若正在执行则合并为结束后的下一轮。返回本次调用是否执行了同步
+        """
+        with self._lock:
+            if self._running:
+                if force:
+                    self._rerun = True
+                    sync_metrics.incr("sync_triggers_merged_total", lease=self.name)
+                return False
+            self._running = True
+        ran = False
+        try:
+            while True:
+                ran = self._lead(force) or ran
+                with self._lock:
+                    # 释放租约之后、退出之前到达的本进程触发，再补跑一轮
+                    if not self._rerun:
+                        self._running = False
+                        return ran
+                    self._rerun = False
+                force = True
+        except BaseException:
+            with self._lock:
+                self._running = False
+            raise
+
+    def _lead(self, force):
+        acquired_at = time.monotonic()
+        try:
+            acquired = self.acquire(0 if force else self.min_gap())
+            if not acquired and force and not self.request_rerun():
+                acquired = self.acquire()
+        except Exception as e:
+            sync_metrics.record_error("lease_acquire", e, lease=self.name)
+            return False
+        if not acquired:
+            sync_metrics.incr("sync_triggers_skipped_total" if not force else "sync_triggers_merged_total", lease=self.name)
+            return False
+
+        self.lease_lost.clear()
+        heartbeat = LeaseHeartbeat(self, acquired_at)
+        heartbeat.start()
+        try:
+            while True:
+                with self._lock:
+                    self._rerun = False
+                try:
+                    self.fn()
+                except Exception as e:
+                    sync_metrics.record_error(self.name, e)
+                sync_metrics.incr("sync_leader_cycles_total", lease=self.name)
+                if self.lease_lost.is_set():
+                    # 租约已失效：不再补跑，也不释放 (可能已属于接管的进程)；本进程的触发交给下一次抢占
+                    return True
+                with self._lock:
+                    local_rerun = self._rerun
+                if local_rerun:
+                    continue
+                try:
+                    outcome = self.release()
+                except Exception as e:
+                    # 释放失败不影响正确性：租约到期后自动失效
+                    sync_metrics.record_error("lease_release", e, lease=self.name)
+                    return True
+                if outcome != 'rerun':
+                    return True
+        finally:
+            heartbeat.stop()
+            self.lease_lost.clear()
+
+    def run_exclusive(self, fn):
+        """
+        在本任务的租约下执行另一项维护任务 (如反熵校验)：与本任务在集群内互斥，租约被占用时跳过本次。
+        释放时不记录结束时间，不影响本任务的 min_gap；期间到达的本任务触发在结束后补跑。返回是否执行了 fn
+        """
+        with self._lock:
+            if self._running: return False
+            self._running = True
+        rerun = False
+        try:
+            acquired_at = time.monotonic()
+            try:
+                acquired = self.acquire()
+            except Exception as e:
+                sync_metrics.record_error("lease_acquire", e, lease=self.name)
+                return False
+            if not acquired: return False
+
+            self.lease_lost.clear()
+            heartbeat = LeaseHeartbeat(self, acquired_at)
+            heartbeat.start()
+            try:
+                fn()
+            except Exception as e:
+                sync_metrics.record_error(fn.__name__, e)
+            finally:
+                heartbeat.stop()
+                lost = self.lease_lost.is_set()
+                self.lease_lost.clear()
+            if not lost:
+                try:
+                    rerun = self.release(finished=False) == 'rerun'
+                except Exception as e:
+                    sync_metrics.record_error("lease_release", e, lease=self.name)
+            return True
+        finally:
+            with self._lock:
+                self._running = False
+                rerun, self._rerun = rerun or self._rerun, False
+            if rerun:
+                self.run(force=True)
+
+    def request(self):
+        """人工/接口触发：交给调度器线程执行，请求线程立即返回；正在执行时合并到下一轮"""
+        if not self.enabled:
+            self.request_remote()
+            return 'queued'
+        with self._lock:
+            if self._running:
+                self._rerun = True
+                sync_metrics.incr("sync_triggers_merged_total", lease=self.name)
+                return 'merged'
+        self.scheduler.add_job(self.run, kwargs={"force": True}, id=f"{self.name}_manual", replace_existing=True)
+        return 'scheduled'
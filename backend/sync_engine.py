@@ -1,236 +1,1115 @@
 import time
+import threading
+from contextlib import nullcontext
+from functools import partial, lru_cache
 from apscheduler.schedulers.background import BackgroundScheduler
 from sqlalchemy.orm import Session
-from sqlalchemy import inspect, and_
+from sqlalchemy import or_, func, update, insert, delete, select
+from sqlalchemy.exc import OperationalError, DisconnectionError
 from datetime import datetime, timedelta
-from .database import SessionLocals
-from . import models
+from concurrent.futures import ThreadPoolExecutor
+from .database import SessionLocals, pool_checkouts, query_counts, CENTRAL_DB
+from .topology import topology
+from . import models, outbox, retry_queue
 from .config import settings
-from .utils import send_conflict_email
+from .mail_queue import conflict_mail_queue
+from .row_transform import get_transformer, row_columns, format_diff
+from .hlc import stamp_node
+from .sync_metrics import sync_metrics
+from .sync_coordinator import SingleFlight
+from . import sync_throttle
 
 scheduler = BackgroundScheduler()
 
-# 定义所有数据库节点
-ALL_DBS = ["mysql", "pg", "mssql"]
+# 所有数据库节点 (来自拓扑文件)
+ALL_DBS = topology.names
 
-# 数据归属映射 (ID -> 负责的 DB Name)
-OWNER_MAP = {1: "mysql", 2: "pg", 3: "mssql"}
+# 数据归属映射 (分院/仓库 ID -> 负责的 DB Name)
+OWNER_MAP = topology.owner_map
 
-# 时钟偏差容忍阈值 (秒)
+# 时钟偏差容忍阈值 (秒)：只用于没有混合逻辑时钟版本戳、或版本戳相同而内容不同的行 (见 sync_row_clock)
 CLOCK_SKEW_TOLERANCE = 10 
 
+# 定时触发时，集群内上一轮结束不足当前生效周期 * 该比例则跳过 (多个 worker 的定时器错开触发时不重复同步)
+SYNC_MIN_GAP_RATIO = 0.5
+
+# 同步进程检查人工触发请求的周期 (秒)
+SYNC_REQUEST_POLL_INTERVAL = 5
+
+# 自适应周期：一轮变更行数达到该值视为繁忙，下一轮周期减半
+ADAPTIVE_BUSY_CHANGES = 200
+
+# 自适应周期：发件箱积压不足该值时不因积压增长而缩短周期 (避免零星写入引起抖动)
+ADAPTIVE_BACKLOG_FLOOR = 50
+
+# 增量同步水位回看窗口 (秒)：补偿时钟偏差与事务晚提交导致的 last_updated 乱序
+WATERMARK_OVERLAP = 30
+
 def get_db_session(db_name):
     return SessionLocals[db_name]()
 
+# 统计字段映射：update_daily_stats 的类型 -> SyncStats 列名
+STAT_COLUMNS = {'auto': 'auto_sync_count', 'conflict': 'conflict_count', 'resolve': 'manual_resolve_count'}
+
+# 统计缓冲定时落库周期 (秒)，进程崩溃时最多丢失一个周期内的计数
+STATS_FLUSH_INTERVAL = 30
+
+class StatsBuffer:
+    """
+    【统计缓冲】同步引擎、冲突登记、人工仲裁只在内存中累加计数，
+    由 flush() 按日期一次性以原子自增的方式写入总库，避免逐行开会话并争用同一热点行
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+
+    def incr(self, stat_type, n=1):
+        column = STAT_COLUMNS.get(stat_type)
+        if not column: return
+        today = datetime.now().strftime('%Y-%m-%d')
+        with self._lock:
+            day = self._pending.setdefault(today, dict.fromkeys(STAT_COLUMNS.values(), 0))
+            day[column] += n
+
+    def _restore(self, pending):
+        """落库失败时把计数放回缓冲区，下次 flush 重试"""
+        with self._lock:
+            for sync_date, counts in pending.items():
+                day = self._pending.setdefault(sync_date, dict.fromkeys(STAT_COLUMNS.values(), 0))
+                for column, n in counts.items():
+                    day[column] += n
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending: return
+        db = SessionLocals[CENTRAL_DB]() # 统计统一存在总库
+        try:
+            for sync_date, counts in pending.items():
+                # UPDATE ... SET col = col + n：由数据库完成自增，不需要先查再改
+                res = db.execute(
+                    update(models.SyncStats)
+                    .where(models.SyncStats.sync_date == sync_date)
+                    .values({getattr(models.SyncStats, col): getattr(models.SyncStats, col) + n for col, n in counts.items()})
+                )
+                if res.rowcount == 0:
+                    db.add(models.SyncStats(sync_date=sync_date, **counts))
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            self._restore(pending)
+            sync_metrics.record_error("stats_flush", e, node=CENTRAL_DB)
+        finally:
+            db.close()
+
+stats_buffer = StatsBuffer()
+
 def update_daily_stats(stat_type: str):
     """
     【统计逻辑】更新每日统计指标：'auto' (自动同步), 'conflict' (冲突), 'resolve' (手动解决)
+    仅累加到内存缓冲，由每轮同步结束或定时任务统一落库
     """
-    db = SessionLocals["mssql"]() # 统计统一存在总库
-    today = datetime.now().strftime('%Y-%m-%d')
+    stats_buffer.incr(stat_type)
+
+# 冲突锁定集合：每轮开始时从总库一次性加载全部 PENDING 的 (表名, 记录ID)，行级检查只查内存
+locked_records = set()
+
+def load_locked_records(db: Session = None):
+    """【冲突锁定】一次查询加载全部待处理冲突，替换内存中的锁定集合"""
+    global locked_records
+    own_session = db is None
+    if own_session: db = SessionLocals[CENTRAL_DB]()
     try:
-        stat = db.query(models.SyncStats).filter(models.SyncStats.sync_date == today).first()
-        if not stat:
-            stat = models.SyncStats(sync_date=today, auto_sync_count=0, conflict_count=0, manual_resolve_count=0)
-            db.add(stat)
-        
-        if stat_type == 'auto': 
-            stat.auto_sync_count += 1
-        elif stat_type == 'conflict': 
-            stat.conflict_count += 1
-        elif stat_type == 'resolve': 
-            stat.manual_resolve_count += 1
-        
-        db.commit()
-    except Exception as e:
-        print(f"统计更新失败: {e}")
+        rows = db.query(models.SyncConflictLog.table_name, models.SyncConflictLog.record_id).filter(
+            models.SyncConflictLog.status == 'PENDING'
+        ).all()
+        locked_records = {(r.table_name, str(r.record_id)) for r in rows}
     finally:
-        db.close()
+        if own_session: db.close()
 
 def is_record_locked(table_name, record_id):
-    """检查记录是否处于冲突锁定状态"""
-    db = SessionLocals["mssql"]()
+    """检查记录是否处于冲突锁定状态 (O(1) 内存查找)"""
+    return (table_name, str(record_id)) in locked_records
+
+def unlock_record(table_name, record_id):
+    """冲突被人工解决后解除内存锁定"""
+    locked_records.discard((table_name, str(record_id)))
+
+# 冲突登记时对锁定集合的 "检查 + 占用" 需要原子完成：同一条记录可能在同一轮中被多个流水线同时发现
+conflict_lock = threading.Lock()
+
+def log_conflicts(db: Session, conflicts):
+    """
+    【冲突登记】一批冲突 [(表名, 记录ID, Owner 节点, 冲突节点, 字段级差异)] 先按锁定集合在内存中去重，
+    再按表一次查询总库中已有的 PENDING 冲突 (同步进程、API 的定向推送与反熵校验各自维护锁定集合，
+    其他进程刚登记的冲突只在总库中可见)，剩余的一条多行 INSERT 写入冲突表，统计一次累加，邮件通知入队。
+    字段级差异以 JSON 存入 diff_data，冲突页面直接展示，不必再查询各个节点
+    """
+    rows = []
+    with conflict_lock:
+        for table, record_id, owner_db, intruder_db, fields in conflicts:
+            lock_key = (table, str(record_id))
+            if lock_key in locked_records: continue
+            locked_records.add(lock_key)
+            rows.append({
+                "table_name": table,
+                "record_id": str(record_id),
+                "source_db": owner_db,
+                "target_db": intruder_db,
+                "conflict_reason": f"内容冲突: {format_diff(fields)}"[:1000],
+                "diff_data": [{"field": key, "owner": v1, "target": v2} for key, v1, v2 in fields],
+                "status": 'PENDING',
+            })
+    if not rows: return 0
     try:
-        conflict = db.query(models.SyncConflictLog).filter(
-            and_(
-                models.SyncConflictLog.table_name == table_name,
-                models.SyncConflictLog.record_id == str(record_id),
-                models.SyncConflictLog.status == 'PENDING'
-            )
-        ).first()
-        return conflict is not None
+        existing = set()
+        log = models.SyncConflictLog
+        for table in {row["table_name"] for row in rows}:
+            ids = [row["record_id"] for row in rows if row["table_name"] == table]
+            for ids_chunk in chunked(ids, settings.SYNC_CHUNK_SIZE):
+                existing.update((table, r.record_id) for r in db.query(log.record_id).filter(
+                    log.table_name == table, log.status == 'PENDING', log.record_id.in_(ids_chunk)))
+        # 已登记过的记录保持锁定，不再重复登记与报警
+        rows = [row for row in rows if (row["table_name"], row["record_id"]) not in existing]
+        if not rows:
+            db.commit()
+            return 0
+        db.execute(insert(log.__table__), rows)
+        db.commit()
+    except Exception as e:
+        # 登记失败：释放占用，这些记录下一轮会被重新发现
+        db.rollback()
+        with conflict_lock:
+            for row in rows: locked_records.discard((row["table_name"], row["record_id"]))
+        sync_metrics.record_error("conflict_log", e, node=CENTRAL_DB)
+        return 0
+
+    stats_buffer.incr('conflict', len(rows))
+    for row in rows:
+        print(f"📧 [冲突报警] {row['table_name']}:{row['record_id']} -> {row['conflict_reason']}")
+        sync_metrics.incr("sync_conflicts_total", table=row["table_name"], node=row["target_db"])
+        # 邮件通知入队后立即返回，由后台线程合并为摘要发送
+        conflict_mail_queue.enqueue(row["table_name"], row["record_id"], row["conflict_reason"])
+    return len(rows)
+
+class SyncPass:
+    """
+    【同步会话上下文】一次表同步过程中每个节点只打开一个 Session (另有一个总库会话用于
+    冲突/统计/水位)，目标写入按批提交；退出时统一关闭。
+    比对与写入都是 Core 元组与 Core 语句，会话中不保留 ORM 实例。
+    """
+    def __init__(self):
+        self.sessions = {}
+        self.central = None
+
+    def session(self, db_name):
+        if db_name not in self.sessions:
+            self.sessions[db_name] = SessionLocals[db_name](expire_on_commit=False)
+        return self.sessions[db_name]
+
+    def central_session(self):
+        if self.central is None:
+            self.central = SessionLocals[CENTRAL_DB](expire_on_commit=False)
+        return self.central
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        for sess in list(self.sessions.values()) + [self.central]:
+            if sess is not None: sess.close()
+        return False
+
+def checkout_snapshot():
+    """连接池取出次数快照，与本轮结束时的快照相减即为本轮开销"""
+    return dict(pool_checkouts)
+
+def round_trip_snapshot():
+    """各节点语句执行次数快照"""
+    return dict(query_counts)
+
+def load_watermarks(db: Session = None):
+    """【增量同步】一次性读取总库中全部 (源节点, 表) 的同步高水位与分页检查点，返回 {(源节点, 表): SyncWatermark}"""
+    own_session = db is None
+    if own_session: db = SessionLocals[CENTRAL_DB]()
+    try:
+        return {(w.source_db, w.table_name): w for w in db.query(models.SyncWatermark).all()}
     finally:
-        db.close()
+        if own_session: db.close()
 
-def log_conflict(table, record_id, owner_db, intruder_db, diff_msg):
-    """记录冲突并触发邮件报警"""
-    db = SessionLocals["mssql"]()
+def save_watermark(source_db, table_name, high_water, resume_id=None, resume_clock=None, db: Session = None):
+    """
+    持久化某个 (源节点, 表) 的高水位。本轮扫描进行中时附带分页检查点 (resume_id / resume_clock)，
+    扫描全部成功后以新水位调用并清除检查点
+    """
+    own_session = db is None
+    if own_session: db = SessionLocals[CENTRAL_DB]()
     try:
-        exists = db.query(models.SyncConflictLog).filter(
-            and_(
-                models.SyncConflictLog.table_name == table,
-                models.SyncConflictLog.record_id == str(record_id),
-                models.SyncConflictLog.status == 'PENDING'
-            )
-        ).first()
-        
-        if not exists:
-            detailed_reason = f"内容冲突: {diff_msg}"
-            print(f"📧 [冲突报警] {table}:{record_id} -> {detailed_reason}")
-            
-            # 1. 存入冲突表
-            conflict = models.SyncConflictLog(
-                table_name=table,
-                record_id=str(record_id),
-                source_db=owner_db,
-                target_db=intruder_db,
-                conflict_reason=detailed_reason,
-                status='PENDING'
-            )
-            db.add(conflict)
-            db.commit()
-            
-            # 2. 增加冲突统计计数
-            update_daily_stats('conflict')
-            
-            # 3. 触发邮件通知
-            try:
-                send_conflict_email(table, record_id, detailed_reason)
-            except Exception as mail_err:
-                print(f"邮件发送失败: {mail_err}")
+        db.merge(models.SyncWatermark(
+            source_db=source_db, table_name=table_name, high_water=high_water,
+            resume_id=str(resume_id) if resume_id is not None else None, resume_clock=resume_clock
+        ))
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        sync_metrics.record_error("save_watermark", e, table=table_name, node=source_db)
     finally:
-        db.close()
-
-def get_model_diff_str(obj1, obj2, model_class, source_db, target_db):
-    """【内容比对】加入 PostgreSQL ID 偏移兼容 (+253)"""
-    mapper = inspect(model_class)
-    diffs = []
-    for column in mapper.attrs:
-        prop_name = column.key
-        if prop_name in ['last_updated', 'create_time'] or prop_name.startswith('_'): 
-            continue
-        
-        v1 = getattr(obj1, prop_name)
-        v2 = getattr(obj2, prop_name)
-
-        # 处理 medicine_id 偏移补偿比对
-        if prop_name == 'medicine_id':
-            if source_db != 'pg' and target_db == 'pg':
-                if v1 is not None: v1 += 253
-            elif source_db == 'pg' and target_db != 'pg':
-                if v1 is not None: v1 -= 253
-
-        is_different = False
-        if isinstance(v1, float) and isinstance(v2, float):
-            if abs(v1 - v2) > 0.001: is_different = True
-        elif v1 != v2:
-            is_different = True
-        
-        if is_different:
-            diffs.append(f"{prop_name}:[{v1} vs {v2}]")
-            
-    return ", ".join(diffs) if diffs else None
+        if own_session: db.close()
+
+def read_db_clock(session):
+    """读取源库自身的当前时间，水位以源库时钟为准，避免应用服务器与数据库之间的时钟偏差"""
+    return naive_clock(session.query(func.now()).scalar())
+
+def naive_clock(value):
+    """
+    PG 的 now() 是 timestamptz，驱动返回带时区的时间 (已按会话时区换算)；
+    last_updated 列与总库中保存的水位都是不带时区的本地时间，去掉 tzinfo 后才能比较与保存
+    """
+    return value.replace(tzinfo=None) if value is not None and value.tzinfo is not None else value
+
+def next_watermark(old_mark, db_now):
+    """新水位 = 源库时钟 - 回看窗口，窗口内的行下一轮会被再读一次以兜住晚提交的事务"""
+    if db_now is None: return old_mark
+    db_now, old_mark = naive_clock(db_now), naive_clock(old_mark)
+    mark = db_now - timedelta(seconds=WATERMARK_OVERLAP)
+    return max(old_mark, mark) if old_mark else mark
+
+def fetch_page(session, model_class, since, after_id, limit):
+    """
+    【键集分页】按主键顺序读取水位之后变化的一页 (无水位时即全表)：id > 上一页最后一个主键。
+    每页是一次独立的有界查询，不用 OFFSET，也不会把整张表装进会话的 identity map
+    返回按 row_columns 顺序的 Core 元组，不构造 ORM 实例
+    """
+    return session.execute(page_query(model_class, since, after_id, limit)).all()
+
+def page_query(model_class, since, after_id, limit):
+    q = select(*row_columns(model_class))
+    if since is not None:
+        q = q.where(model_class.last_updated >= since)
+    if after_id is not None:
+        q = q.where(model_class.id > after_id)
+    return q.order_by(model_class.id).limit(limit)
+
+def chunked(seq, size):
+    """按固定大小切分列表"""
+    seq = list(seq)
+    for i in range(0, len(seq), size):
+        yield seq[i:i + size]
+
+def fetch_rows_by_ids(session, model_class, ids, before=None):
+    """按主键批量回查 (Core 元组)，IN 列表按 SYNC_CHUNK_SIZE 分段；before 非空时只取 last_updated 早于该时间的行"""
+    rows = []
+    for q in ids_queries(model_class, ids, before):
+        rows.extend(session.execute(q).all())
+    return rows
+
+def ids_queries(model_class, ids, before=None):
+    for ids_chunk in chunked(ids, settings.SYNC_CHUNK_SIZE):
+        q = select(*row_columns(model_class)).where(model_class.id.in_(ids_chunk))
+        if before is not None:
+            q = q.where(or_(model_class.last_updated < before, model_class.last_updated.is_(None)))
+        yield q
+
+def get_model_diff_str(row1, row2, model_class, source_db, target_db):
+    """【内容比对】按拓扑中的 ID 换算规则 (如 PG 药品 ID +253) 兼容，由预编译转换器完成，无差异时不拼接文本"""
+    return get_transformer(model_class, source_db, target_db).diff(row1, row2)
 
 def get_owner_db(item, source_db_name):
-    """判断数据拥有者"""
-    owner_id = getattr(item, 'branch_id', getattr(item, 'warehouse_id', -1))
+    """判断数据拥有者：处方明细归当前持有它的节点，其余按分院/仓库 ID 查拓扑"""
     if hasattr(item, 'prescription_id'):
-        if source_db_name == 'mysql': owner_id = 1
-        elif source_db_name == 'pg': owner_id = 2
-        else: owner_id = 3
-    return OWNER_MAP.get(owner_id)
+        return source_db_name
+    return OWNER_MAP.get(getattr(item, 'branch_id', getattr(item, 'warehouse_id', -1)))
 
-def sync_logic():
-    """全能网格广播同步引擎：支持全表监控、冲突锁定、ID偏移补丁、精准统计"""
-    sync_models = [models.User, models.Inventory, models.Prescription, models.PrescriptionItem, models.AlertMessage]
+@lru_cache(maxsize=None)
+def owner_index(model_class):
+    """
+    预编译的归属判断 (与 get_owner_db 规则一致)：返回归属列在 Core 元组中的下标；
+    处方明细永远归当前持有它的节点所有，返回 None；没有归属列返回 -1
+    """
+    keys = [c.key for c in row_columns(model_class)]
+    if 'prescription_id' in keys: return None
+    for key in ('branch_id', 'warehouse_id'):
+        if key in keys: return keys.index(key)
+    return -1
+
+def row_owner(index, row, source_db_name):
+    """按 owner_index 的结果判断一条 Core 元组的 Owner 节点"""
+    if index is None: return source_db_name
+    return OWNER_MAP.get(row[index]) if index >= 0 else None
+
+def sync_row(item, target_row, transformer):
+    """
+    比对一条 Owner 行与目标库中的对应行 (Core 元组，目标行可能为 None)，只决定动作，不写库。
+    返回 (动作, 字段级差异)：'insert' / 'update' / 'conflict' 由调用方在提交成功后统计与记录，
+    'correct' (时钟纠偏后覆盖) 与 'align' (内容相同，仅对齐时间戳) 静默写入。
+    任一行带混合逻辑时钟版本戳时按版本戳排序 (没有版本戳的一方视为最旧的版本)；
+    两行都没有 (引入版本戳之前的历史数据)，或版本戳相同而内容不同 (绕过 ORM 的写入没有打新戳) 时退回墙上时钟比较
+    """
+    if target_row is None:
+        # [新增同步] 由调用方收集后批量插入
+        return 'insert', None
+
+    fields = transformer.diff_fields(item, target_row)
+    if transformer.hlc_index is not None:
+        item_hlc = item[transformer.hlc_index]
+        target_hlc = target_row[transformer.hlc_index]
+        if item_hlc is not None or target_hlc is not None:
+            return sync_row_hlc(item, target_row, item_hlc or '', target_hlc or '', fields, transformer.source_db)
+    return sync_row_clock(item, target_row, fields)
+
+def sync_row_clock(item, target_row, fields):
+    """按墙上时钟 last_updated 决定动作：没有版本戳的行，或版本戳分不出先后的行"""
+    # 情况 2: Owner 时间领先或相同 (正常更新；时间相同但内容不同说明目标被旁路修改，以 Owner 为准)
+    if item.last_updated >= target_row.last_updated:
+        if fields:
+            # 内容有变，执行更新
+            return 'update', fields
+        # 仅时间偏移，静默对齐，不计入同步次数，不打印日志
+        if item.last_updated != target_row.last_updated:
+            return 'align', None
+    
+    # 情况 3: Target 时间领先 (潜在冲突)
+    elif fields:
+        delta = (target_row.last_updated - item.last_updated).total_seconds()
+        if delta < CLOCK_SKEW_TOLERANCE:
+            # 时钟纠偏：以 Owner 的内容与时间戳覆盖
+            return 'correct', None
+        # 确认为非拥有者篡改 -> 报警
+        return 'conflict', fields
+    return None, None
+
+def sync_row_hlc(item, target_row, item_hlc, target_hlc, fields, owner_db):
+    """
+    按版本戳决定动作：每次写入的版本戳都大于它覆盖的版本，所以目标行版本领先只有两种可能——
+    Owner 自己更新的版本已经先一步推送过去 (本条是旧快照，跳过)，或者目标库上发生了 Owner 没见过的写入 (冲突)。
+    只有 ORM 写入会打新戳，手工 SQL、存储过程等绕过 ORM 的写入保留原版本戳：
+    版本戳相同而内容不同时分不出是哪一方改的，退回墙上时钟与 CLOCK_SKEW_TOLERANCE 比较
+    """
+    if item_hlc == target_hlc and fields:
+        return sync_row_clock(item, target_row, fields)
+    if item_hlc >= target_hlc:
+        if fields:
+            # Owner 版本更新：以 Owner 为准
+            return 'update', fields
+        if item_hlc != target_hlc or item.last_updated != target_row.last_updated:
+            return 'align', None
+        return None, None
+    if not fields or stamp_node(target_hlc) == owner_db:
+        return None, None
+    # 目标库上有 Owner 之后的非拥有者写入 -> 报警
+    return 'conflict', fields
+
+def write_rows(target_session, transformer, events):
+    """
+    按动作把一批比对结果写入目标库，每类动作一条 Core 语句 (executemany / 多行 VALUES)：
+    新增 INSERT，更新与纠偏按主键 UPDATE 全部列，对齐只 UPDATE last_updated
+    """
+    for stmt, params in row_writes(transformer, events):
+        target_session.execute(stmt, params)
+
+def row_writes(transformer, events):
+    """一批比对结果对应的 [(语句, 参数列表)]，没有对应动作的语句不出现"""
+    inserts, updates, aligns = [], [], []
+    for item, action, _ in events:
+        if action == 'insert': inserts.append(transformer.row_dict(item))
+        elif action in ('update', 'correct'): updates.append(transformer.update_params(item))
+        elif action == 'align': aligns.append(transformer.align_params(item))
+    return [(stmt, params) for stmt, params in ((insert(transformer.model_class.__table__), inserts),
+                                                (transformer.update_stmt, updates),
+                                                (transformer.align_stmt, aligns)) if params]
+
+# 同步一批 (不超过 SYNC_CHUNK_SIZE 行) 发出的语句数上限：一次回查 + 新增/更新/对齐各一条；逐行重放时每行一次回查 + 一条写入
+CHUNK_STATEMENTS = 4
+ROW_STATEMENTS = 2
+
+def is_connection_error(e):
+    """连接级错误 (目标库不可达、连接中断或超时)：不是某一行的问题，逐行重放只会让每行再超时一次"""
+    return isinstance(e, (OperationalError, DisconnectionError, ConnectionError)) or getattr(e, "connection_invalidated", False)
+
+def sync_chunk(sp, items, model_class, source_db_name, target_db_name):
+    """
+    【批量比对】将一批 Owner 数据 (Core 元组) 推送到一个目标节点：
+    只发一次 id IN (...) 查询取回对应行，在内存中逐行比对，按动作各一条语句写入并整批一次提交；
+    整批提交失败时回滚并逐行重放，把出错的行隔离出来登记到重试队列。
+    连接级错误视为整条流水线失败：不重放、不登记重试队列，直接返回 False。
+    返回是否全部写入成功或已进入重试队列 (返回 False 时流水线不推进水位，下一轮整批重来)
+    """
+    if not items: return True
+    failures = []
+    target_session = sp.session(target_db_name)
+    transformer = get_transformer(model_class, source_db_name, target_db_name)
+    sync_throttle.acquire_rows(target_db_name, len(items))
+    # 事务开始前预付本批的语句令牌，限流等待不发生在持有行锁期间
+    sync_throttle.acquire_queries(target_db_name, CHUNK_STATEMENTS)
+    try:
+        target_map = {row.id: row for row in fetch_rows_by_ids(target_session, model_class, [item.id for item in items])}
+        events = [(item, *sync_row(item, target_map.get(item.id), transformer)) for item in items]
+        write_rows(target_session, transformer, events)
+        target_session.commit()
+    except Exception as e:
+        target_session.rollback()
+        sync_metrics.record_error("batch_commit", e, table=model_class.__tablename__, node=target_db_name)
+        if is_connection_error(e):
+            print(f"🔌 [同步中断] {target_db_name} 连接失败，{model_class.__tablename__} 本批 {len(items)} 行留待下一轮")
+            return False
+        events = []
+        for item in items:
+            try:
+                sync_throttle.acquire_queries(target_db_name, ROW_STATEMENTS)
+                target_row = next(iter(fetch_rows_by_ids(target_session, model_class, [item.id])), None)
+                event = (item, *sync_row(item, target_row, transformer))
+                write_rows(target_session, transformer, [event])
+                target_session.commit()
+                events.append(event)
+            except Exception as e:
+                # 单行写入失败：回滚并登记错误，该行进入重试队列
+                target_session.rollback()
+                sync_metrics.record_error("row_write", e, table=model_class.__tablename__, node=target_db_name)
+                if is_connection_error(e):
+                    # 重放途中连接断开：已提交的行照常登记，其余行不进入重试队列
+                    record_chunk(sp, events, model_class, source_db_name, target_db_name, failures)
+                    return False
+                failures.append((item.id, e))
+
+    return record_chunk(sp, events, model_class, source_db_name, target_db_name, failures)
+
+def record_chunk(sp, events, model_class, source_db_name, target_db_name, failures=()):
+    """
+    目标库提交成功后再计入统计、打印日志并登记冲突，避免回滚重放时重复计数：
+    新增与更新各累加一次统计，本批冲突一次批量登记。
+    已处理的行移出重试队列，写入失败的行 [(记录ID, 异常)] 登记到重试队列，返回是否登记成功
+    """
+    table_name = model_class.__tablename__
+    inserted = updated = 0
+    conflicts = []
+    for item, action, fields in events:
+        if action == 'insert':
+            # 【核心修改】执行了真实的插入，统计数+1 (日志按批汇总打印)
+            inserted += 1
+        elif action == 'update':
+            # 【核心修改】内容变了才计入统计，并打印日志
+            updated += 1
+            print(f"⬆️ [同步更新] {table_name}:{str(item.id)[:8]} {source_db_name}->{target_db_name} | {format_diff(fields)}")
+        elif action == 'conflict':
+            conflicts.append((table_name, item.id, source_db_name, target_db_name, fields))
+    if inserted or updated:
+        stats_buffer.incr('auto', inserted + updated)
+    if conflicts:
+        log_conflicts(sp.central_session(), conflicts)
+    sync_metrics.incr("sync_rows_inserted_total", inserted, table=table_name, node=target_db_name)
+    sync_metrics.incr("sync_rows_updated_total", updated, table=table_name, node=target_db_name)
+    if inserted:
+        print(f"➕ [同步新增] {table_name} x{inserted} {source_db_name}->{target_db_name}")
+    retry_queue.clear(sp.central_session(), table_name, target_db_name, [item.id for item, _, _ in events])
+    return retry_queue.record_failures(sp.central_session(), table_name, source_db_name, target_db_name, failures)
+
+class SyncLane:
+    """
+    同步优先级通道：通道内按外键依赖分阶段 (同一阶段内的表互不依赖可并行)，
+    每轮的时间预算 (秒，None 表示不限) 与同步延迟目标 (秒，None 表示不设)
+    """
+    __slots__ = ('name', 'stages', 'budget', 'latency_target')
+
+    def __init__(self, name, stages, budget=None, latency_target=None):
+        self.name = name
+        self.stages = stages
+        self.budget = budget
+        self.latency_target = latency_target
+
+# 按优先级排列：库存与处方 (跨分院调货依据) 每轮最先同步且不受预算限制，医生用户是处方的外键父表随之同步；
+# 预警消息等低优先级表只使用本轮剩余的预算，超出时在页检查点处停下，下一轮接着同步
+SYNC_LANES = [
+    SyncLane("critical", [[models.User, models.Inventory], [models.Prescription], [models.PrescriptionItem]],
+             latency_target=120),
+    SyncLane("bulk", [[models.AlertMessage]], budget=30),
+]
+
+# 全部表的外键顺序 (父表在前)
+SYNC_STAGES = [stage for lane in SYNC_LANES for stage in lane.stages]
+
+# 每轮的总时间预算占当前生效周期的比例，低优先级通道只能使用其中剩余的部分
+SYNC_CYCLE_BUDGET_RATIO = 0.8
 
-    for model_class in sync_models:
-        table_name = model_class.__tablename__
-        for source_db_name in ALL_DBS:
-            source_session = get_db_session(source_db_name)
+# 表名 -> 模型 (重试队列中按表名记录)
+SYNC_MODELS = {m.__tablename__: m for stage in SYNC_STAGES for m in stage}
+
+class SyncJobResult:
+    """并行同步任务的返回值：是否成功、任务耗时及附带数据"""
+    __slots__ = ('ok', 'elapsed', 'data')
+
+    def __init__(self, ok, elapsed, data=None):
+        self.ok = ok
+        self.elapsed = elapsed
+        self.data = data
+
+def run_job(db_name, fn, *args):
+    """执行一个同步任务并计时 (第一个参数为模型类)；任务自身的异常转换为失败结果"""
+    started = time.perf_counter()
+    table_name = args[0].__tablename__
+    try:
+        with sync_throttle.scope():
+            ok, data = fn(*args)
+    except Exception as e:
+        sync_metrics.record_error(fn.__name__, e, table=table_name, node=db_name)
+        ok, data = False, None
+    elapsed = time.perf_counter() - started
+    sync_metrics.incr("sync_job_seconds_total", elapsed, table=table_name, node=db_name)
+    return SyncJobResult(ok, elapsed, data)
+
+def run_node_job(node_slots, db_name, fn, *args):
+    """在节点并发槽位内执行一个只访问单个节点的同步任务"""
+    with node_slots[db_name]:
+        return run_job(db_name, fn, *args)
+
+def node_slot(node_slots, db_name):
+    """流水线内每次访问某个节点前占用该节点的槽位 (不嵌套持有，避免节点之间互相等待)；无槽位时不限制"""
+    return node_slots[db_name] if node_slots else nullcontext()
+
+def coerce_ids(model_class, ids):
+    """发件箱中的记录ID统一存为字符串，整数主键的表需要还原类型"""
+    if model_class.__table__.c.id.type.python_type is int:
+        return [int(i) for i in ids]
+    return list(ids)
+
+def classify_rows(items, model_class, source_db_name):
+    """
+    按归属拆分源行：返回 (本节点拥有的行, 其他节点拥有的 {owner: ids})，已锁定的记录直接跳过
+    """
+    table_name = model_class.__tablename__
+    index = owner_index(model_class)
+    owned, foreign = [], {}
+    for item in items:
+        if is_record_locked(table_name, item.id): continue
+
+        owner_db = row_owner(index, item, source_db_name)
+        if owner_db != source_db_name:
+            if owner_db: foreign.setdefault(owner_db, set()).add(item.id)
+            continue
+        owned.append(item)
+    return owned, foreign
+
+def read_owner_rows(model_class, owner_db, ids):
+    """【回查阶段】回到 Owner 节点按主键取权威数据"""
+    session = SessionLocals[owner_db]()
+    try:
+        return True, owned_by(model_class, owner_db, fetch_rows_by_ids(session, model_class, ids))
+    finally:
+        session.close()
+
+def owned_by(model_class, owner_db, rows):
+    """只保留未锁定、且确实归属于 owner_db 的行"""
+    table_name = model_class.__tablename__
+    index = owner_index(model_class)
+    return [row for row in rows if not is_record_locked(table_name, row.id) and row_owner(index, row, owner_db) == owner_db]
+
+def push_rows(model_class, source_db_name, target_db_name, items):
+    """【写阶段】一条 (表, 源->目标) 同步流水线：独占一个目标会话，按批比对并提交"""
+    with SyncPass() as sp:
+        for chunk in chunked(items, settings.SYNC_CHUNK_SIZE):
+            # 一批失败 (目标库不可达或重试队列登记失败) 时水位本来就不会推进，后面的批次留给下一轮
+            if not sync_chunk(sp, chunk, model_class, source_db_name, target_db_name):
+                return False, None
+    return True, None
+
+def apply_deletes(model_class, source_db_name, target_db_name, ids):
+    """
+    【删除同步】发件箱中的 DELETE 记录：目标库中仍存在、且归属于删除方节点的行一并删除
+    """
+    session = SessionLocals[target_db_name]()
+    try:
+        deleted = 0
+        for q in ids_queries(model_class, coerce_ids(model_class, ids)):
+            doomed = [row.id for row in owned_by(model_class, source_db_name, session.execute(q).all())]
+            if doomed:
+                session.execute(delete_stmt(model_class, doomed))
+                deleted += len(doomed)
+        session.commit()
+        record_deletes(model_class, source_db_name, target_db_name, deleted)
+        return True, None
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+def delete_stmt(model_class, ids):
+    return delete(model_class.__table__).where(model_class.__table__.c.id.in_(ids))
+
+def record_deletes(model_class, source_db_name, target_db_name, deleted):
+    table_name = model_class.__tablename__
+    sync_metrics.incr("sync_rows_deleted_total", deleted, table=table_name, node=target_db_name)
+    if deleted:
+        stats_buffer.incr('auto', deleted)
+        print(f"🗑️ [同步删除] {table_name} x{deleted} {source_db_name}->{target_db_name}")
+
+def sync_page(model_class, source_db_name, items, node_slots=None, owner_marks=None):
+    """
+    同步一页源数据：本节点拥有的行直接推送到其他节点，
+    不归本节点所有的行 (可能是篡改) 回到 Owner 取权威数据后推送。
+    owner_marks 为本轮各 Owner 的水位 {节点: 水位}：Owner 上 last_updated 不早于其水位的行
+    本轮会由 Owner 自己的流水线推送，这里跳过，避免两条流水线同时向同一目标插入同一行。返回是否全部成功
+    """
+    owned, foreign = classify_rows(items, model_class, source_db_name)
+    batches = [(source_db_name, owned)]
+    for owner_db, foreign_ids in foreign.items():
+        with node_slot(node_slots, owner_db):
+            rows = read_owner_rows(model_class, owner_db, foreign_ids)[1]
+        batches.append((owner_db, not_covered_by_owner(rows, owner_db, owner_marks)))
+
+    ok = True
+    for owner_db, rows in batches:
+        if rows and not push_to_targets(model_class, owner_db, rows, node_slots):
+            ok = False
+    return ok
+
+# 推送扇出线程池：一批 Owner 行同时推送到其他各节点 (每个推送占用目标节点的槽位)，
+# 流水线耗时不随节点数线性增长；大小为各节点预算之和，首次使用时创建
+_fanout_pool = None
+_fanout_lock = threading.Lock()
+
+def fanout_pool():
+    global _fanout_pool
+    with _fanout_lock:
+        if _fanout_pool is None:
+            _fanout_pool = ThreadPoolExecutor(max_workers=sum(settings.node_concurrency(db) for db in ALL_DBS),
+                                              thread_name_prefix="sync-push")
+        return _fanout_pool
+
+def push_to_targets(model_class, owner_db, rows, node_slots=None):
+    """一批 Owner 行推送到其他全部节点，各目标并行；调用方在同步任务中时推送同样计入限流。返回是否全部成功"""
+    targets = [db for db in ALL_DBS if db != owner_db]
+    throttled = sync_throttle.active()
+
+    def push(target_db_name):
+        with (sync_throttle.scope() if throttled else nullcontext()), node_slot(node_slots, target_db_name):
+            return push_rows(model_class, owner_db, target_db_name, rows)[0]
+
+    if len(targets) <= 1:
+        return all(push(db) for db in targets)
+    return all(list(fanout_pool().map(push, targets)))
+
+def not_covered_by_owner(rows, owner_db, owner_marks):
+    """去掉本轮会由 Owner 自己的流水线推送的行 (Owner 上 last_updated 不早于其水位)"""
+    if owner_marks is None or owner_db not in owner_marks:
+        return rows
+    mark = owner_marks[owner_db]
+    return [r for r in rows if mark is not None and (r.last_updated is None or r.last_updated < mark)]
+
+def resume_point(model_class, source_db_name, watermarks):
+    """
+    一条流水线的起点：(各 Owner 水位, 本节点水位, 检查点主键, 检查点时钟)。
+    断点续传沿用被中断那一轮开始时的源库时钟，中断期间被修改的行由下一轮的水位兜住
+    """
+    table_name = model_class.__tablename__
+    owner_marks = {db: (watermarks[(db, table_name)].high_water if (db, table_name) in watermarks else None)
+                   for db in ALL_DBS if db != source_db_name}
+    watermark = watermarks.get((source_db_name, table_name))
+    old_mark = watermark.high_water if watermark else None
+    cursor = watermark.resume_id if watermark else None
+    clock = watermark.resume_clock if cursor is not None else None
+    if cursor is not None:
+        cursor = coerce_ids(model_class, [cursor])[0]
+        print(f"⏯️ [断点续传] {source_db_name}.{table_name} 从主键 {cursor} 之后继续")
+    return owner_marks, old_mark, cursor, clock
+
+def stream_source(model_class, source_db_name, node_slots, watermarks, outbox_ids=(), deadline=None):
+    """
+    【流式同步】一条 (表, 源节点) 流水线：按主键键集分页读取水位之后变化的行，逐页比对推送，
+    内存中只保留一页；每处理完一整页记录检查点，进程中途退出时下一轮从检查点之后继续。
+    之后补上发件箱登记、但 last_updated 早于水位 (分页扫描读不到) 的行。
+    全部成功时推进水位并清除检查点。到达 deadline (perf_counter 时刻) 时在页边界停下，留待下一轮从检查点继续
+    (每轮至少处理一页，保证预算再紧也能推进)。每页开始前确认本进程仍持有同步租约，失效时抛出 LeaseLost。
+    返回 (是否全部成功, 是否同步完毕)
+    """
+    table_name = model_class.__tablename__
+    page_size = settings.SYNC_PAGE_SIZE
+    owner_marks, old_mark, cursor, clock = resume_point(model_class, source_db_name, watermarks)
+    had_checkpoint = cursor is not None
+
+    while True:
+        sync_flight.ensure_lease()
+        sync_throttle.acquire_queries(source_db_name, 1 + (clock is None))
+        with node_slot(node_slots, source_db_name):
+            session = SessionLocals[source_db_name]()
             try:
-                items = source_session.query(model_class).all()
-                for item in items:
-                    if is_record_locked(table_name, item.id): continue
-
-                    owner_db = get_owner_db(item, source_db_name)
-                    if owner_db != source_db_name: continue 
-
-                    for target_db_name in ALL_DBS:
-                        if target_db_name == source_db_name: continue
-                        target_session = get_db_session(target_db_name)
-                        try:
-                            target_item = target_session.query(model_class).filter(model_class.id == item.id).first()
-                            
-                            if not target_item:
-                                # [新增同步]
-                                new_data = {c.key: getattr(item, c.key) for c in inspect(model_class).attrs if c.key != 'id'}
-                                if target_db_name == 'pg' and 'medicine_id' in new_data:
-                                    new_data['medicine_id'] += 253
-                                target_session.add(model_class(id=item.id, **new_data))
-                                target_session.commit()
-                                # 时间戳对齐
-                                t_ref = target_session.query(model_class).filter(model_class.id == item.id).first()
-                                if t_ref:
-                                    t_ref.last_updated = item.last_updated
-                                    target_session.commit()
-                                
-                                # 【核心修改】执行了真实的插入，统计数+1
-                                update_daily_stats('auto') 
-                                print(f"➕ [同步新增] {table_name}:{str(item.id)[:8]} {source_db_name}->{target_db_name}")
-
-                            else:
-                                diff_str = get_model_diff_str(item, target_item, model_class, source_db_name, target_db_name)
-                                
-                                # 情况 2: Owner 时间领先 (正常更新)
-                                if item.last_updated > target_item.last_updated:
-                                    if diff_str:
-                                        # 内容有变，执行更新
-                                        for c in inspect(model_class).attrs:
-                                            if c.key != 'id': 
-                                                val = getattr(item, c.key)
-                                                if target_db_name == 'pg' and c.key == 'medicine_id': val += 253
-                                                setattr(target_item, c.key, val)
-                                        target_session.commit()
-                                        
-                                        # 【核心修改】内容变了才计入统计，并打印日志
-                                        update_daily_stats('auto')
-                                        print(f"⬆️ [同步更新] {table_name}:{str(item.id)[:8]} {source_db_name}->{target_db_name} | {diff_str}")
-                                    else:
-                                        # 仅时间偏移，静默对齐，不计入同步次数，不打印日志
-                                        target_item.last_updated = item.last_updated
-                                        target_session.commit()
-                                
-                                # 情况 3: Target 时间领先 (潜在冲突)
-                                elif target_item.last_updated > item.last_updated:
-                                    if diff_str:
-                                        delta = (target_item.last_updated - item.last_updated).total_seconds()
-                                        if delta < CLOCK_SKEW_TOLERANCE:
-                                            # 时钟纠偏
-                                            for c in inspect(model_class).attrs:
-                                                if c.key != 'id':
-                                                    val = getattr(item, c.key)
-                                                    if target_db_name == 'pg' and c.key == 'medicine_id': val += 253
-                                                    setattr(target_item, c.key, val)
-                                            target_item.last_updated = item.last_updated
-                                            target_session.commit()
-                                        else:
-                                            # 确认为非拥有者篡改 -> 报警
-                                            log_conflict(table_name, item.id, source_db_name, target_db_name, diff_str)
-                        except Exception:
-                            target_session.rollback()
-                        finally:
-                            target_session.close()
+                if clock is None: clock = read_db_clock(session)
+                items = fetch_page(session, model_class, old_mark, cursor, page_size)
             finally:
-                source_session.close()
+                session.close()
+        sync_throttle.acquire_rows(source_db_name, len(items))
+        sync_metrics.incr("sync_rows_scanned_total", len(items), table=table_name, node=source_db_name)
+        if not items: break
+        if not sync_page(model_class, source_db_name, items, node_slots, owner_marks):
+            return False, None
+        cursor = items[-1].id
+        if len(items) < page_size: break
+        # 还有下一页：记录检查点
+        save_watermark(source_db_name, table_name, old_mark, cursor, clock)
+        had_checkpoint = True
+        if deadline is not None and time.perf_counter() >= deadline:
+            return True, False
+
+    if old_mark is not None:
+        for ids_chunk in chunked(coerce_ids(model_class, outbox_ids), page_size):
+            sync_flight.ensure_lease()
+            with node_slot(node_slots, source_db_name):
+                session = SessionLocals[source_db_name]()
+                try:
+                    items = fetch_rows_by_ids(session, model_class, ids_chunk, before=old_mark)
+                finally:
+                    session.close()
+            sync_throttle.acquire_rows(source_db_name, len(items))
+            sync_metrics.incr("sync_rows_scanned_total", len(items), table=table_name, node=source_db_name)
+            if items and not sync_page(model_class, source_db_name, items, node_slots, owner_marks):
+                return False, None
+
+    high_water = next_watermark(old_mark, clock)
+    if high_water is not None and (high_water != old_mark or had_checkpoint):
+        save_watermark(source_db_name, table_name, high_water)
+    return True, True
+
+def retry_failed_writes():
+    """
+    【重试队列】到期的失败写入回到源节点读取最新数据重新推送：成功的移出队列，再次失败的按退避延后或搁置；
+    源节点上已不存在、已锁定或不再归属源节点的记录无需重试，直接移出。返回重试的记录数
+    """
+    retried = 0
+    for (table_name, source_db_name, target_db_name), record_ids in retry_queue.load_due().items():
+        model_class = SYNC_MODELS.get(table_name)
+        if model_class is None: continue
+        with SyncPass() as sp:
+            rows = owned_by(model_class, source_db_name,
+                            fetch_rows_by_ids(sp.session(source_db_name), model_class, coerce_ids(model_class, record_ids)))
+            found = {str(row.id) for row in rows}
+            retry_queue.clear(sp.central_session(), table_name, target_db_name, [i for i in record_ids if i not in found])
+            for chunk in chunked(rows, settings.SYNC_CHUNK_SIZE):
+                sync_chunk(sp, chunk, model_class, source_db_name, target_db_name)
+        retried += len(record_ids)
+    return retried
+
+def sync_records(source_db_name, model_class, ids):
+    """
+    【定向推送】只同步指定的记录，不做全表增量扫描。返回是否全部成功
+    """
+    session = SessionLocals[source_db_name]()
+    try:
+        items = fetch_rows_by_ids(session, model_class, coerce_ids(model_class, ids))
+    finally:
+        session.close()
+    return sync_page(model_class, source_db_name, items)
+
+# 计入 "变更量" 的计数器 (按表汇总后的短名)
+CHANGE_COUNTERS = ("rows_inserted", "rows_updated", "rows_deleted", "conflicts")
+
+class AdaptiveInterval:
+    """
+    【自适应周期】每轮结束后根据本轮的变更行数与发件箱积压选择下一轮的间隔：
+    变更多、积压增长、发件箱一轮读不完或有通道超出延迟目标时减半，本轮没有任何变更且无积压时加倍退避，
+    介于两者之间时逐步回到设置页配置的基准周期；结果始终限制在 SystemSetting 的上下限之内。
+    未开启自适应时直接使用基准周期
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.chosen = None
+        self.reason = "fixed"
+        self.backlog = 0
+
+    def bounds(self):
+        low = max(1, settings.SYNC_INTERVAL_MIN)
+        return low, max(low, settings.SYNC_INTERVAL_MAX)
+
+    def current(self):
+        """当前生效的同步周期 (秒)"""
+        if not settings.ADAPTIVE_SYNC:
+            return settings.SYNC_INTERVAL
+        low, high = self.bounds()
+        with self._lock:
+            chosen = self.chosen or settings.SYNC_INTERVAL
+        return min(high, max(low, chosen))
+
+    def observe(self, changes, backlog, saturated=False, lagging=False):
+        """登记一轮的观测值并选择下一轮周期，返回 (周期, 原因)"""
+        with self._lock:
+            previous_backlog, self.backlog = self.backlog, backlog
+            if not settings.ADAPTIVE_SYNC:
+                self.chosen, self.reason = None, "fixed"
+                return settings.SYNC_INTERVAL, self.reason
+            low, high = self.bounds()
+            chosen, base = self.chosen or settings.SYNC_INTERVAL, settings.SYNC_INTERVAL
+            if changes >= ADAPTIVE_BUSY_CHANGES:
+                chosen, reason = chosen / 2, "busy"
+            elif saturated or (backlog >= ADAPTIVE_BACKLOG_FLOOR and backlog > previous_backlog):
+                chosen, reason = chosen / 2, "backlog"
+            elif changes and lagging:
+                # 有变更且某个通道超出延迟目标：周期太长，追不上写入
+                chosen, reason = chosen / 2, "lagging"
+            elif not changes and not backlog:
+                chosen, reason = chosen * 2, "idle"
+            else:
+                # 有少量变更：每轮向基准周期靠拢一半
+                chosen, reason = (chosen + base) / 2, "steady"
+            self.chosen = min(high, max(low, int(round(chosen))))
+            self.reason = reason
+            return self.chosen, reason
+
+adaptive_interval = AdaptiveInterval()
+
+def apply_sync_interval():
+    """把定时任务的周期调整为当前生效的周期 (仅在变化时重新调度，下一次触发从现在起算)"""
+    job = scheduler.get_job('sync_job_id')
+    interval = adaptive_interval.current()
+    if job and job.trigger.interval.total_seconds() != interval:
+        scheduler.reschedule_job('sync_job_id', trigger='interval', seconds=interval)
+
+def publish_interval_gauges(changes=None):
+    sync_metrics.set_gauge("sync_interval_base_seconds", settings.SYNC_INTERVAL)
+    sync_metrics.set_gauge("sync_interval_min_seconds", adaptive_interval.bounds()[0])
+    sync_metrics.set_gauge("sync_interval_max_seconds", adaptive_interval.bounds()[1])
+    sync_metrics.set_gauge("sync_adaptive_enabled", int(settings.ADAPTIVE_SYNC))
+    if changes is not None:
+        sync_metrics.set_gauge("sync_last_cycle_changes", changes)
+
+# 各通道最近一次完整同步的开始时间：该时刻之前的变更已全部同步 (只在执行同步的进程内有意义)
+lane_synced_at = {}
+
+def lane_deadline(lane, cycle_started, lane_started):
+    """低优先级通道的截止时刻：不超过本通道预算，也不超过本轮总预算的剩余部分；不限预算的通道返回 None"""
+    if lane.budget is None:
+        return None
+    cycle_deadline = cycle_started + adaptive_interval.current() * SYNC_CYCLE_BUDGET_RATIO
+    return min(lane_started + lane.budget, cycle_deadline)
+
+def record_lane(lane, cycle_started_at, elapsed, complete, deferred):
+    """
+    登记一个通道本轮的结果。延迟 (lag) 指该通道的数据最多落后多久：
+    从最近一次完整同步的开始时间到现在，超出延迟目标时计入 sync_lane_target_missed_total
+    """
+    if complete:
+        lane_synced_at[lane.name] = cycle_started_at
+    synced_at = lane_synced_at.get(lane.name)
+    lag = (datetime.now() - synced_at).total_seconds() if synced_at else None
+    missed = bool(lane.latency_target and (lag is None or lag > lane.latency_target))
+    sync_metrics.incr("sync_lane_seconds_total", elapsed, lane=lane.name)
+    if deferred:
+        sync_metrics.incr("sync_lane_deferred_total", lane=lane.name)
+        print(f"⏳ [同步预算] {lane.name} 通道预算用尽，{sorted(set(deferred))} 留待下一轮")
+    if missed:
+        sync_metrics.incr("sync_lane_target_missed_total", lane=lane.name)
+    if lag is not None:
+        sync_metrics.set_gauge("sync_lane_lag_seconds", round(lag, 3), lane=lane.name)
+        sync_metrics.set_gauge("sync_lane_synced_timestamp_seconds", round(synced_at.timestamp(), 3), lane=lane.name)
+    if lane.latency_target:
+        sync_metrics.set_gauge("sync_lane_latency_target_seconds", lane.latency_target, lane=lane.name)
+    return {
+        "elapsed": round(elapsed, 3),
+        "complete": complete,
+        "deferred": sorted(set(deferred)),
+        "lag": round(lag, 3) if lag is not None else None,
+        "latency_target": lane.latency_target,
+        "missed": missed,
+    }
+
+# 最近一轮同步的概要 (墙钟耗时、按表/节点的耗时与行数、数据库往返与连接池取出次数)
+last_cycle_report = {}
+
+class SyncCycle:
+    """
+    一轮同步的公共状态与记账：水位、发件箱待消费记录、每个通道的完成情况，以及结束时的概要。
+    线程池引擎 (sync_logic) 与 asyncio 引擎 (sync_async) 只负责调度流水线，其余逻辑共用
+    """
+    def __init__(self, engine):
+        self.engine = engine
+        self.started = time.perf_counter()
+        self.started_at = datetime.now()
+        self.checkouts_before = checkout_snapshot()
+        self.round_trips_before = round_trip_snapshot()
+        self.counters_before = sync_metrics.snapshot()
+        self.watermarks = load_watermarks()
+        load_locked_records()
+        retry_queue.load_keys()
+        # 各节点发件箱中待消费的记录 {节点: {表名: {...}}}
+        self.pending = {}
+        for db_name in ALL_DBS:
+            try:
+                self.pending[db_name] = outbox.load_pending(db_name)
+            except Exception as e:
+                self.pending[db_name] = {}
+                sync_metrics.record_error("outbox_load", e, node=db_name)
+        self.backlog = {db_name: sum(len(entry['entries']) for entry in tables.values()) for db_name, tables in self.pending.items()}
+        for db_name, n in self.backlog.items():
+            sync_metrics.set_gauge("sync_outbox_backlog", n, node=db_name)
+        self.work_time = 0.0
+        self.upserted = set()
+        self.lanes = {}
+        self._lane = None
+        self.retried = 0
+
+    def begin_lane(self, lane):
+        """开始一个通道，返回该通道的截止时刻 (perf_counter，None 表示不限)"""
+        self._lane = {"started": time.perf_counter(), "complete": True, "deferred": []}
+        return lane_deadline(lane, self.started, self._lane["started"])
+
+    def upsert_jobs(self, stage):
+        """一个阶段的 (表, 源节点, 发件箱中待补的新增/更新ID)"""
+        for m in stage:
+            for src in ALL_DBS:
+                yield m, src, self.pending[src].get(m.__tablename__, {}).get(outbox.OP_UPSERT, ())
+
+    def finish_stage(self, stage, results):
+        """登记一个阶段的结果 {(表, 源节点): SyncJobResult}：发件箱的新增/更新在删除完成后统一标记 (预算用尽未同步完的表留到下一轮)"""
+        done = [m for m in stage if all(results[(m, src)].ok and results[(m, src)].data for src in ALL_DBS)]
+        self.upserted.update(done)
+        self._lane["complete"] = self._lane["complete"] and len(done) == len(stage)
+        self._lane["deferred"] += [m.__tablename__ for m in stage
+                                   if any(results[(m, src)].ok and not results[(m, src)].data for src in ALL_DBS)]
+
+    def delete_jobs(self, stage):
+        """一个阶段的 (表, 删除方节点, 目标节点, 被删除的ID)"""
+        for m in stage:
+            for src in ALL_DBS:
+                ids = self.pending[src].get(m.__tablename__, {}).get(outbox.OP_DELETE)
+                if not ids: continue
+                for tgt in ALL_DBS:
+                    if tgt != src: yield m, src, tgt, ids
+
+    def mark_outbox(self, stage, deletes):
+        """新增/更新与删除都成功的 (表, 节点) 标记发件箱记录为已完成"""
+        for m in stage:
+            table_name = m.__tablename__
+            for src in ALL_DBS:
+                entry = self.pending[src].get(table_name)
+                if not entry or m not in self.upserted: continue
+                if all(r.ok for (dm, dsrc, _), r in deletes.items() if dm is m and dsrc == src):
+                    outbox.mark_done(src, entry['entries'])
+
+    def finish_lane(self, lane):
+        state = self._lane
+        self.lanes[lane.name] = record_lane(lane, self.started_at, time.perf_counter() - state["started"],
+                                            state["complete"], state["deferred"])
+
+    def retry_writes(self):
+        """全部通道完成后重试到期的失败写入 (重试本身的异常只登记，不影响本轮)"""
+        started = time.perf_counter()
+        try:
+            with sync_throttle.scope():
+                self.retried = retry_failed_writes()
+        except Exception as e:
+            sync_metrics.record_error("retry_failed_writes", e)
+        self.work_time += time.perf_counter() - started
+
+    def finish(self):
+        global last_cycle_report
+        stats_buffer.flush()
+        checkouts_after = checkout_snapshot()
+        round_trips_after = round_trip_snapshot()
+        elapsed = time.perf_counter() - self.started
+        tables = sync_metrics.breakdown(self.counters_before, "table")
+        changes = int(sum(counts.get(name, 0) for counts in tables.values() for name in CHANGE_COUNTERS))
+        # 发件箱一轮只读取 OUTBOX_BATCH 条，读满说明本轮消费不完
+        next_interval, interval_reason = adaptive_interval.observe(
+            changes, sum(self.backlog.values()), saturated=any(n >= outbox.OUTBOX_BATCH for n in self.backlog.values()),
+            lagging=any(lane['missed'] for lane in self.lanes.values()))
+        publish_interval_gauges(changes)
+        try:
+            retries = {"retried": self.retried, **retry_queue.summary()}
+        except Exception as e:
+            retries = None
+            sync_metrics.record_error("retry_queue", e, node=CENTRAL_DB)
+        # 行数与耗时按快照差值统计：同一时段内的定向推送/反熵修复也会计入
+        last_cycle_report = {
+            "finished_at": datetime.now(),
+            "engine": self.engine,
+            "elapsed": round(elapsed, 3),
+            "work_time": round(self.work_time, 3),
+            "speedup": round(self.work_time / elapsed, 2) if elapsed > 0 else None,
+            "checkouts": {name: checkouts_after[name] - self.checkouts_before.get(name, 0) for name in checkouts_after},
+            "round_trips": {name: round_trips_after[name] - self.round_trips_before.get(name, 0) for name in round_trips_after},
+            "tables": tables,
+            "nodes": sync_metrics.breakdown(self.counters_before, "node"),
+            "lanes": self.lanes,
+            "changes": changes,
+            "outbox_backlog": self.backlog,
+            "next_interval": next_interval,
+            "interval_reason": interval_reason,
+            "retry_queue": retries,
+        }
+        sync_metrics.record_cycle(last_cycle_report)
+        print(f"🔌 [同步完成] 墙钟 {last_cycle_report['elapsed']}s / 任务累计 {last_cycle_report['work_time']}s | 数据库往返 {last_cycle_report['round_trips']} | 下一轮 {next_interval}s ({interval_reason})")
+
+def sync_logic():
+    """
+    全能网格广播同步引擎：基于 last_updated 水位的增量捕获、冲突锁定、ID偏移补丁、精准统计。
+    按优先级通道依次推进，通道内按外键阶段推进，每个阶段内的 (表, 源节点) 流式流水线在有界线程池中并行执行，
+    每个节点同时承担的读写受 SYNC_NODE_CONCURRENCY 限制，内存占用只与页大小有关。
+    SYNC_ENGINE=asyncio 时改由单线程的 asyncio 引擎执行 (见 sync_async)
+    """
+    if settings.SYNC_ENGINE == "asyncio":
+        from .sync_async import sync_logic_async, run_coroutine
+        return run_coroutine(sync_logic_async())
+
+    cycle = SyncCycle("threaded")
+    node_slots = {db_name: threading.BoundedSemaphore(settings.node_concurrency(db_name)) for db_name in ALL_DBS}
+
+    with ThreadPoolExecutor(max_workers=settings.SYNC_WORKERS, thread_name_prefix="sync") as pool:
+        def run_all(jobs, runner):
+            """提交一批 (key, 节点, 函数, 参数) 任务并等待全部完成"""
+            futures = {key: pool.submit(runner, db_name, fn, *args) for key, db_name, fn, args in jobs}
+            results = {key: f.result() for key, f in futures.items()}
+            cycle.work_time += sum(r.elapsed for r in results.values())
+            return results
+
+        for lane in SYNC_LANES:
+            deadline = cycle.begin_lane(lane)
+            for stage in lane.stages:
+                sync_flight.ensure_lease()
+                # 每个 (表, 源节点) 一条流式流水线并行执行：分页读取 -> 回查 Owner -> 推送到其他节点 -> 检查点，
+                # 流水线每访问一个节点时占用该节点的槽位；失败的流水线不推进水位，下一轮从检查点重试
+                cycle.finish_stage(stage, run_all([
+                    ((m, src), src, stream_source, (m, src, node_slots, cycle.watermarks, outbox_ids, deadline))
+                    for m, src, outbox_ids in cycle.upsert_jobs(stage)
+                ], run_job))
+
+            # 删除阶段：按外键逆序 (先子表后父表) 同步发件箱中的删除
+            for stage in reversed(lane.stages):
+                sync_flight.ensure_lease()
+                cycle.mark_outbox(stage, run_all([
+                    ((m, src, tgt), tgt, apply_deletes, (m, src, tgt, ids))
+                    for m, src, tgt, ids in cycle.delete_jobs(stage)
+                ], partial(run_node_job, node_slots)))
+            cycle.finish_lane(lane)
+
+    sync_flight.ensure_lease()
+    cycle.retry_writes()
+    cycle.finish()
+
+# 集群级单飞：同一时刻只有持有总库租约的进程执行同步，运行期间的触发合并为下一轮
+sync_flight = SingleFlight("sync", sync_logic, scheduler, min_gap=lambda: adaptive_interval.current() * SYNC_MIN_GAP_RATIO)
+
+def request_sync():
+    """人工触发一轮同步 (不在请求线程中执行)，返回 'scheduled' / 'merged'，本进程不执行同步时返回 'queued'"""
+    return sync_flight.request()
 
 def scheduled_task():
-    """定时任务：自动刷新配置并执行同步"""
+    """
+    定时任务：自动刷新配置并执行同步；执行后按当前生效的周期重新调度
+    (覆盖自适应周期的调整，以及在其他进程如 API 的设置页修改了周期或上下限)
+    """
     settings.refresh()
     if settings.SCHEDULED_SYNC: 
-        sync_logic()
+        sync_flight.run()
+    publish_interval_gauges()
+    apply_sync_interval()
+
+def start_stats_flush_job():
+    """统计缓冲定时落库 (覆盖定时同步关闭时人工仲裁产生的计数)，API 进程不跑同步时也需要"""
+    scheduler.add_job(stats_buffer.flush, 'interval', seconds=STATS_FLUSH_INTERVAL, id='stats_flush_job', coalesce=True, replace_existing=True)
+    if not scheduler.running:
+        scheduler.start()
 
 def start_sync_job():
-    # 使用动态参数启动
-    scheduler.add_job(scheduled_task, 'interval', seconds=settings.SYNC_INTERVAL, id='sync_job_id', max_instances=3, coalesce=True)
-    scheduler.start()
\ No newline at end of file
+    # 使用动态参数启动；单飞协调器保证不重叠，调度器层面也只允许一个实例
+    sync_flight.enabled = True
+    publish_interval_gauges()
+    scheduler.add_job(scheduled_task, 'interval', seconds=adaptive_interval.current(), id='sync_job_id', max_instances=1, coalesce=True)
+    scheduler.add_job(sync_flight.poll_requests, 'interval', seconds=SYNC_REQUEST_POLL_INTERVAL, id='sync_request_poll', max_instances=1, coalesce=True)
+    start_stats_flush_job()
\ No newline at end of file
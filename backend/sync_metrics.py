@@ -0,0 +1,235 @@
+# backend/sync_metrics.py
+"""
+同步指标：进程内累计的计数器 (按表/节点分标签)、最近若干轮同步的概要与耗时直方图、最近的错误。
+同步引擎、定向推送与反熵修复都往同一个收集器里记账，/stats 下以 JSON 与 Prometheus 文本两种格式导出。
+"""
+import threading
+from collections import deque
+from datetime import datetime
+from .database import pool_checkouts, query_counts
+
+# 保留最近多少轮同步的概要
+CYCLE_HISTORY = 100
+
+# 保留最近多少条错误
+ERROR_HISTORY = 50
+
+# 每轮墙钟耗时直方图的桶上界 (秒)
+DURATION_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# 计数器说明 (Prometheus HELP)
+COUNTER_HELP = {
+    "sync_rows_scanned_total": "源节点读取的行数",
+    "sync_rows_inserted_total": "写入目标节点的新增行数",
+    "sync_rows_updated_total": "目标节点被更新的行数",
+    "sync_rows_deleted_total": "目标节点被同步删除的行数",
+    "sync_conflicts_total": "检测到的冲突数",
+    "sync_errors_total": "同步过程中出现的错误数",
+    "sync_job_seconds_total": "同步任务累计耗时 (秒)",
+    "sync_leader_cycles_total": "本进程持有租约执行的轮数",
+    "sync_triggers_merged_total": "执行期间到达、被合并到下一轮的触发次数",
+    "sync_triggers_skipped_total": "因集群内已在执行或刚执行完而跳过的定时触发次数",
+    "sync_throttle_wait_seconds_total": "同步任务因节点限流等待的累计时间 (秒)",
+    "sync_lane_seconds_total": "各优先级通道累计耗时 (秒)",
+    "sync_lane_deferred_total": "通道因预算用尽未同步完、留到下一轮的次数",
+    "sync_lane_target_missed_total": "通道延迟超出目标的轮数",
+    "sync_retry_queued_total": "目标写入失败、登记到重试队列的次数",
+    "sync_retry_succeeded_total": "重试队列中同步成功 (或已无需同步) 而移出的记录数",
+    "sync_retry_parked_total": "连续失败达到上限而搁置的记录数",
+    "conflict_mails_sent_total": "已发送的冲突摘要邮件数",
+    "hlc_drift_observed_total": "观察到的版本戳领先本机时钟超过 HLC_MAX_DRIFT 的次数",
+    "conflict_mails_abandoned_total": "重试多次仍失败而放弃的冲突摘要邮件数",
+}
+
+# 仪表盘指标说明 (Prometheus HELP)
+GAUGE_HELP = {
+    "sync_interval_base_seconds": "设置页配置的基准同步周期",
+    "sync_interval_min_seconds": "自适应周期下限",
+    "sync_interval_max_seconds": "自适应周期上限",
+    "sync_adaptive_enabled": "是否开启自适应周期",
+    "sync_outbox_backlog": "最近一轮开始时各节点发件箱中待消费的记录数",
+    "sync_last_cycle_changes": "最近一轮同步的变更行数 (新增 + 更新 + 删除 + 冲突)",
+    "sync_throttle_scale": "节点限额相对配置上限的比例 (随语句耗时自动调整)",
+    "sync_throttle_rows_per_second": "节点当前的同步行数限额",
+    "sync_throttle_queries_per_second": "节点当前的同步语句数限额",
+    "sync_query_latency_p95_seconds": "最近一个调整窗口内同步语句耗时的 p95",
+    "sync_lane_lag_seconds": "通道数据最多落后的时间 (距最近一次完整同步开始)",
+    "sync_lane_synced_timestamp_seconds": "通道最近一次完整同步的开始时间",
+    "sync_lane_latency_target_seconds": "通道的同步延迟目标",
+    "sync_retry_queue_depth": "重试队列中的记录数 (按状态：PENDING 待重试 / PARKED 已搁置)",
+    "sync_retry_oldest_age_seconds": "重试队列中最早一条记录自首次失败以来的时间",
+    "conflict_mail_queue_depth": "等待发送的冲突报警通知数",
+}
+
+def percentile(values, q):
+    """最近邻法求分位数"""
+    if not values: return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(labels):
+    if not labels: return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+class SyncMetrics:
+    """线程安全的同步指标收集器"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        # {(指标名, ((标签名, 值), ...)): 数值}
+        self.counters = {}
+        self.cycles = deque(maxlen=CYCLE_HISTORY)
+        self.errors = deque(maxlen=ERROR_HISTORY)
+        # {(指标名, ((标签名, 值), ...)): 当前值}
+        self.gauges = {}
+        # 全进程生命周期的累计直方图 (Prometheus 要求单调)
+        self.bucket_counts = [0] * len(DURATION_BUCKETS)
+        self.duration_sum = 0.0
+        self.duration_count = 0
+
+    def incr(self, name, n=1, **labels):
+        if not n: return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def set_gauge(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.gauges[key] = value
+
+    def snapshot(self):
+        """计数器快照，与一轮结束时的快照相减即为该轮增量"""
+        with self._lock:
+            return dict(self.counters)
+
+    def record_error(self, where, exc, **labels):
+        """登记一次错误：计数、保留最近的错误信息并打印，替代静默回滚"""
+        self.incr("sync_errors_total", where=where, **labels)
+        message = f"{type(exc).__name__}: {exc}"
+        with self._lock:
+            self.errors.append({
+                "time": datetime.now(),
+                "where": where,
+                **labels,
+                "error": message,
+            })
+        print(f"❌ [同步错误] {where} {labels} {message}")
+
+    def record_cycle(self, report):
+        with self._lock:
+            self.cycles.append(report)
+            elapsed = report["elapsed"]
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if elapsed <= bound: self.bucket_counts[i] += 1
+            self.duration_sum += elapsed
+            self.duration_count += 1
+
+    def breakdown(self, before, dimension):
+        """
+        两次快照之间的计数器增量，按某个标签 (table / node) 汇总：
+        {标签值: {"rows_inserted": n, "job_seconds": t, ...}}
+        """
+        result = {}
+        for (name, labels), value in self.snapshot().items():
+            delta = value - before.get((name, labels), 0)
+            key = dict(labels).get(dimension)
+            if not delta or key is None: continue
+            short = name.removeprefix("sync_").removesuffix("_total")
+            bucket = result.setdefault(key, {})
+            bucket[short] = round(bucket.get(short, 0) + delta, 3)
+        return result
+
+    def summary(self, sync_interval):
+        """最近若干轮的耗时分布，以及最近一轮耗时占同步周期的比例"""
+        with self._lock:
+            cycles = list(self.cycles)
+        durations = [c["elapsed"] for c in cycles]
+        last = cycles[-1] if cycles else None
+        return {
+            "cycles": len(cycles),
+            "sync_interval": sync_interval,
+            "last_elapsed": last["elapsed"] if last else None,
+            "interval_ratio": round(last["elapsed"] / sync_interval, 3) if last and sync_interval else None,
+            "p50": percentile(durations, 0.5),
+            "p95": percentile(durations, 0.95),
+            "max": max(durations) if durations else None,
+            "histogram": {
+                str(bound): sum(1 for d in durations if d <= bound) for bound in DURATION_BUCKETS
+            } | {"+Inf": len(durations)},
+        }
+
+    def to_dict(self, sync_interval):
+        with self._lock:
+            cycles = list(self.cycles)
+            errors = list(self.errors)
+            gauges = dict(self.gauges)
+        counters = {}
+        for (name, labels), value in self.snapshot().items():
+            counters.setdefault(name, []).append({**dict(labels), "value": round(value, 3) if isinstance(value, float) else value})
+        return {
+            "summary": self.summary(sync_interval),
+            "counters": counters,
+            "gauges": {(name + _labels(labels)): value for (name, labels), value in sorted(gauges.items())},
+            "db_round_trips": dict(query_counts),
+            "pool_checkouts": dict(pool_checkouts),
+            "recent_cycles": cycles,
+            "recent_errors": errors,
+        }
+
+    def render_prometheus(self, sync_interval):
+        """Prometheus 文本格式 (text/plain; version=0.0.4)"""
+        lines = []
+        grouped = {}
+        for (name, labels), value in self.snapshot().items():
+            grouped.setdefault(name, []).append((labels, value))
+        for name in sorted(grouped):
+            lines.append(f"# HELP {name} {COUNTER_HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} counter")
+            for labels, value in sorted(grouped[name]):
+                lines.append(f"{name}{_labels(labels)} {value}")
+
+        for name, source, help_text in (("sync_db_round_trips_total", query_counts, "数据库语句往返次数"),
+                                        ("sync_pool_checkouts_total", pool_checkouts, "连接池取出次数")):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for node, value in sorted(source.items()):
+                lines.append(f'{name}{{node="{node}"}} {value}')
+
+        with self._lock:
+            buckets = list(self.bucket_counts)
+            duration_sum, duration_count = self.duration_sum, self.duration_count
+            last = self.cycles[-1] if self.cycles else None
+            gauges = dict(self.gauges)
+        lines.append("# HELP sync_cycle_duration_seconds 每轮同步墙钟耗时")
+        lines.append("# TYPE sync_cycle_duration_seconds histogram")
+        for bound, count in zip(DURATION_BUCKETS, buckets):
+            lines.append(f'sync_cycle_duration_seconds_bucket{{le="{bound}"}} {count}')
+        lines.append(f'sync_cycle_duration_seconds_bucket{{le="+Inf"}} {duration_count}')
+        lines.append(f"sync_cycle_duration_seconds_sum {round(duration_sum, 6)}")
+        lines.append(f"sync_cycle_duration_seconds_count {duration_count}")
+
+        lines.append("# HELP sync_interval_seconds 当前生效的同步周期 (开启自适应时为自动选择的周期)")
+        lines.append("# TYPE sync_interval_seconds gauge")
+        lines.append(f"sync_interval_seconds {sync_interval}")
+        grouped = {}
+        for (name, labels), value in gauges.items():
+            grouped.setdefault(name, []).append((labels, value))
+        for name in sorted(grouped):
+            lines.append(f"# HELP {name} {GAUGE_HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in sorted(grouped[name]):
+                lines.append(f"{name}{_labels(labels)} {value}")
+        if last:
+            lines.append("# HELP sync_last_cycle_seconds 最近一轮同步墙钟耗时")
+            lines.append("# TYPE sync_last_cycle_seconds gauge")
+            lines.append(f"sync_last_cycle_seconds {last['elapsed']}")
+            lines.append("# HELP sync_last_cycle_timestamp_seconds 最近一轮同步结束时间")
+            lines.append("# TYPE sync_last_cycle_timestamp_seconds gauge")
+            lines.append(f"sync_last_cycle_timestamp_seconds {last['finished_at'].timestamp():.3f}")
+        return "\n".join(lines) + "\n"
+
+# 全局单例
+sync_metrics = SyncMetrics()
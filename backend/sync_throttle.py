@@ -0,0 +1,241 @@
+# backend/sync_throttle.py
+"""
+同步限流：每个节点两个令牌桶，分别限制同步引擎每秒处理的行数与每秒发出的语句数，
+避免一轮全量同步在短时间内向某个库集中发出大量查询，挤占医生开处方 (存储过程) 的事务。
+限额随该节点的语句耗时自动调整 (AIMD)：p95 明显高于近期基线或超过目标值时减半，
+恢复正常后逐步加回配置上限；只对变慢的节点退避，其他节点照常同步。
+只有同步任务线程 (scope() 内) 的语句受限并计入耗时统计，租约续约、发件箱写入等不受影响。
+语句令牌在打开事务之前按接下来要发出的语句数预付 (acquire_queries)，需要等待时在此等待，
+不会在事务中途、已持有行锁时睡眠；执行语句的钩子只扣减预付额度，未预付的语句记为欠账，由下一次预付补足。
+"""
+import time
+import asyncio
+import threading
+from collections import deque
+from contextlib import contextmanager
+from sqlalchemy import event
+from .database import engines
+from .config import settings
+from .sync_metrics import sync_metrics, percentile
+
+# 每隔多少秒根据耗时样本调整一次限额
+ADJUST_INTERVAL = 2
+
+# 一次调整至少需要的耗时样本数 (样本不足时保持原限额)
+MIN_SAMPLES = 20
+
+# 基线取最近多少个调整窗口内 p95 的最小值 (约 1 分钟)
+BASELINE_WINDOWS = 30
+
+# p95 超过基线的该倍数视为节点变慢
+LATENCY_RISE_RATIO = 2.0
+
+# 退避时限额乘以该系数，恢复时每个窗口加回配置上限的该比例
+BACKOFF_FACTOR = 0.5
+RECOVER_STEP = 0.1
+
+# 限额最低降到配置上限的该比例，保证同步总能推进
+MIN_SCALE = 0.05
+
+class TokenBucket:
+    """令牌桶：rate 为每秒补充的令牌数 (0 表示不限)，容量为一秒的量；一次取用超过余量时先透支再等待"""
+    def __init__(self, rate):
+        self._lock = threading.Lock()
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+
+    def set_rate(self, rate):
+        with self._lock:
+            self._refill()
+            self.rate = rate
+            self.tokens = min(self.tokens, rate)
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate:
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, n=1):
+        """预订 n 个令牌，返回调用方需要等待的秒数 (不在这里等待，供 asyncio 引擎使用)"""
+        with self._lock:
+            if not self.rate: return 0.0
+            self._refill()
+            self.tokens -= n
+            return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+    def acquire(self, n=1):
+        """取用 n 个令牌，返回等待的秒数"""
+        wait = self.reserve(n)
+        if wait: time.sleep(wait)
+        return wait
+
+class NodeThrottle:
+    """一个节点的行数/语句数令牌桶，以及按语句耗时调整限额的状态"""
+    def __init__(self, name):
+        self.name = name
+        self.scale = 1.0
+        self.rows = TokenBucket(self.rows_limit())
+        self.queries = TokenBucket(self.queries_limit())
+        self._lock = threading.Lock()
+        self.samples = deque(maxlen=1000)
+        self.window_p95 = deque(maxlen=BASELINE_WINDOWS)
+        self.adjusted = time.monotonic()
+        self.p95 = None
+
+    def rows_limit(self):
+        return settings.node_rows_per_sec(self.name) * self.scale
+
+    def queries_limit(self):
+        return settings.node_queries_per_sec(self.name) * self.scale
+
+    def acquire_rows(self, n):
+        if n: self._waited("rows", self.rows.acquire(n))
+
+    def acquire_queries(self, n):
+        if n: self._waited("queries", self.queries.acquire(n))
+
+    def charge_query(self):
+        """未预付的语句：只扣令牌不等待 (欠账让下一次预付多等一会儿)"""
+        self.queries.reserve()
+
+    async def acquire_rows_async(self, n):
+        if n: await self._sleep("rows", self.rows.reserve(n))
+
+    async def acquire_queries_async(self, n):
+        if n: await self._sleep("queries", self.queries.reserve(n))
+
+    async def _sleep(self, kind, seconds):
+        if seconds:
+            await asyncio.sleep(seconds)
+            self._waited(kind, seconds)
+
+    def _waited(self, kind, seconds):
+        if seconds:
+            sync_metrics.incr("sync_throttle_wait_seconds_total", seconds, node=self.name, kind=kind)
+
+    def record_latency(self, seconds):
+        with self._lock:
+            self.samples.append(seconds)
+            if time.monotonic() - self.adjusted < ADJUST_INTERVAL or len(self.samples) < MIN_SAMPLES:
+                return
+            samples = list(self.samples)
+            self.samples.clear()
+            self.adjusted = time.monotonic()
+        self.adjust(percentile(samples, 0.95))
+
+    def adjust(self, p95):
+        """AIMD：p95 高于 max(目标值, 基线 * 倍数) 时乘性减小限额，否则加性恢复"""
+        self.p95 = p95
+        baseline = min(self.window_p95) if self.window_p95 else p95
+        self.window_p95.append(p95)
+        threshold = max(settings.SYNC_LATENCY_TARGET_MS / 1000, baseline * LATENCY_RISE_RATIO)
+        old_scale = self.scale
+        if p95 > threshold:
+            self.scale = max(MIN_SCALE, self.scale * BACKOFF_FACTOR)
+        else:
+            self.scale = min(1.0, self.scale + RECOVER_STEP)
+        if self.scale != old_scale:
+            self.rows.set_rate(self.rows_limit())
+            self.queries.set_rate(self.queries_limit())
+            if self.scale < old_scale:
+                print(f"🐢 [同步限流] {self.name} p95 {p95 * 1000:.1f}ms > {threshold * 1000:.1f}ms，限额降至 {self.scale:.0%}")
+        self.publish()
+
+    def publish(self):
+        sync_metrics.set_gauge("sync_throttle_scale", round(self.scale, 3), node=self.name)
+        sync_metrics.set_gauge("sync_throttle_rows_per_second", round(self.rows_limit(), 1), node=self.name)
+        sync_metrics.set_gauge("sync_throttle_queries_per_second", round(self.queries_limit(), 1), node=self.name)
+        if self.p95 is not None:
+            sync_metrics.set_gauge("sync_query_latency_p95_seconds", round(self.p95, 6), node=self.name)
+
+throttles = {name: NodeThrottle(name) for name in engines}
+
+_local = threading.local()
+
+# asyncio 引擎的预付额度 {节点: 语句数} (只在事件循环线程中访问)
+_async_prepaid = {}
+
+@contextmanager
+def scope():
+    """标记当前线程正在执行同步任务：其间对各节点发出的语句计入限流与耗时统计"""
+    previous = getattr(_local, "active", False)
+    _local.active = True
+    try:
+        yield
+    finally:
+        _local.active = previous
+        if not previous:
+            # 令牌已经付过，离开同步任务时清掉剩余额度，不带到线程池的下一个任务
+            _local.prepaid = {}
+
+def _prepaid():
+    prepaid = getattr(_local, "prepaid", None)
+    if prepaid is None:
+        prepaid = _local.prepaid = {}
+    return prepaid
+
+def active():
+    """当前线程是否在同步任务中 (扇出到其他线程的推送据此继承限流)"""
+    return getattr(_local, "active", False)
+
+def acquire_rows(db_name, n):
+    """同步引擎读取/比对一批行之前调用 (不在同步任务线程中时不限制)"""
+    if getattr(_local, "active", False):
+        throttles[db_name].acquire_rows(n)
+
+async def acquire_rows_async(db_name, n):
+    """asyncio 引擎的行数限流 (事件循环中只 await，不阻塞其他节点的流水线)"""
+    await throttles[db_name].acquire_rows_async(n)
+
+def acquire_queries(db_name, n):
+    """
+    同步引擎在打开事务之前调用：为接下来对该节点发出的 n 条语句预付令牌 (需要等待时在此等待)，
+    不在同步任务线程中时不限制
+    """
+    if getattr(_local, "active", False):
+        throttles[db_name].acquire_queries(n)
+        prepaid = _prepaid()
+        prepaid[db_name] = prepaid.get(db_name, 0) + n
+
+def charge_query(prepaid, db_name):
+    """执行一条语句：优先扣减预付额度，没有额度时记为欠账"""
+    if prepaid.get(db_name):
+        prepaid[db_name] -= 1
+    else:
+        throttles[db_name].charge_query()
+
+async def acquire_queries_async(db_name, n):
+    """asyncio 引擎的语句令牌预付，语义同 acquire_queries"""
+    await throttles[db_name].acquire_queries_async(n)
+    _async_prepaid[db_name] = _async_prepaid.get(db_name, 0) + n
+
+def charge_query_async(db_name):
+    charge_query(_async_prepaid, db_name)
+
+def record_latency(db_name, seconds):
+    throttles[db_name].record_latency(seconds)
+
+def _make_listeners(name):
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        # 只记账与计时，不在这里等待：此时可能已在事务中持有前面语句的行锁
+        if getattr(_local, "active", False):
+            charge_query(_prepaid(), name)
+            conn.info["sync_query_started"] = time.perf_counter()
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        # 同一连接上的语句串行执行，只需记住最近一条的开始时间
+        started = conn.info.pop("sync_query_started", None)
+        if started is not None:
+            throttles[name].record_latency(time.perf_counter() - started)
+    return before_cursor_execute, after_cursor_execute
+
+def install(name, engine):
+    before, after = _make_listeners(name)
+    event.listen(engine, "before_cursor_execute", before)
+    event.listen(engine, "after_cursor_execute", after)
+
+for name, engine in engines.items():
+    install(name, engine)
+    throttles[name].publish()
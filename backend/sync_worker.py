@@ -0,0 +1,66 @@
+# backend/sync_worker.py
+"""
+独立同步进程：python -m backend.sync_worker
+运行定时同步、反熵校验与统计落库，以及供 Prometheus 抓取的指标端口，
+与 API 进程分开部署，复制任务的 CPU/数据库负载不再与请求处理共用一个进程和 GIL。
+可以启动多个实例做热备，集群内同一时刻只有持有租约的实例执行同步。
+"""
+import json
+import signal
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from .config import settings
+from .sync_engine import start_sync_job, scheduler, stats_buffer, adaptive_interval
+from .sync_metrics import sync_metrics
+from .mail_queue import conflict_mail_queue
+from . import anti_entropy
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """/metrics 为 Prometheus 文本格式，/metrics.json 为 JSON (API 的 /stats/sync-metrics 从这里转发)"""
+    def do_GET(self):
+        if self.path == "/metrics":
+            body = sync_metrics.render_prometheus(adaptive_interval.current()).encode("utf-8")
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        elif self.path == "/metrics.json":
+            data = sync_metrics.to_dict(adaptive_interval.current())
+            data["anti_entropy"] = anti_entropy.last_anti_entropy_report
+            body = json.dumps(data, default=str, ensure_ascii=False).encode("utf-8")
+            content_type = "application/json; charset=utf-8"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # 抓取请求很频繁，不打印访问日志
+        pass
+
+def serve_metrics(port):
+    server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="sync-metrics", daemon=True).start()
+    return server
+
+def main():
+    settings.refresh()
+    start_sync_job()
+    anti_entropy.start_anti_entropy_job()
+    server = serve_metrics(settings.SYNC_WORKER_METRICS_PORT)
+    print(f"🛰️ [同步进程] 已启动，周期 {adaptive_interval.current()}s{' (自适应)' if settings.ADAPTIVE_SYNC else ''}，指标端口 {settings.SYNC_WORKER_METRICS_PORT}")
+
+    stopped = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stopped.set())
+    stopped.wait()
+
+    print("🛰️ [同步进程] 正在退出...")
+    scheduler.shutdown()
+    stats_buffer.flush()
+    conflict_mail_queue.close()
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
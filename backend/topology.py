@@ -0,0 +1,76 @@
+# backend/topology.py
+"""
+集群拓扑：启动时从拓扑文件 (默认 backend/topology.json，可用环境变量 TOPOLOGY_FILE 指定) 加载节点清单，
+每个节点包括名称、显示名、数据库方言、连接串 (宿主机 / Docker 内各一份)、所拥有的分院 (仓库) ID、
+ID 换算规则 (如第二分院的药品字典 ID 整体偏移 253) 与同步并发预算，另指定一个总库节点
+(系统设置、冲突、统计、租约等集中存放)。
+数据库连接、同步引擎、反熵校验、登录路由与库存查询都从这里读取，新增分院只需在文件中增加一个节点。
+"""
+import os
+import json
+
+TOPOLOGY_FILE = os.getenv("TOPOLOGY_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "topology.json"))
+
+# 支持的方言 (决定存储过程调用、分页、执行计划等 SQL 写法)
+DIALECTS = ("mysql", "postgresql", "mssql")
+
+class Node:
+    """拓扑中的一个数据库节点"""
+    __slots__ = ('name', 'label', 'dialect', 'url', 'branches', 'id_offsets', 'workers')
+
+    def __init__(self, spec, is_docker):
+        self.name = spec["name"]
+        self.label = spec.get("label", self.name)
+        self.dialect = spec["dialect"]
+        if self.dialect not in DIALECTS:
+            raise ValueError(f"拓扑配置错误：节点 {self.name} 的方言 {self.dialect} 不受支持")
+        # Docker 内通过服务名访问，未单独配置时与宿主机相同
+        self.url = spec.get("docker_url", spec["url"]) if is_docker else spec["url"]
+        self.branches = [int(b) for b in spec.get("branches", [])]
+        self.id_offsets = {column: int(delta) for column, delta in spec.get("id_offsets", {}).items()}
+        self.workers = int(spec.get("workers", 2))
+
+class Topology:
+    def __init__(self, spec, is_docker=False):
+        self.nodes = [Node(node, is_docker) for node in spec["nodes"]]
+        self.names = [node.name for node in self.nodes]
+        self.by_name = {node.name: node for node in self.nodes}
+        if len(self.by_name) != len(self.nodes):
+            raise ValueError("拓扑配置错误：节点名称重复")
+        self.central = spec["central"]
+        if self.central not in self.by_name:
+            raise ValueError(f"拓扑配置错误：总库节点 {self.central} 不在节点清单中")
+        # 分院 (仓库) ID -> 拥有它的节点
+        self.owner_map = {}
+        for node in self.nodes:
+            for branch in node.branches:
+                if branch in self.owner_map:
+                    raise ValueError(f"拓扑配置错误：分院 {branch} 同时归属 {self.owner_map[branch]} 与 {node.name}")
+                self.owner_map[branch] = node.name
+        # 有换算规则的列 (任一节点配置了偏移)
+        self.offset_columns = {column for node in self.nodes for column in node.id_offsets}
+
+    def node(self, name):
+        return self.by_name[name]
+
+    def dialect(self, name):
+        return self.by_name[name].dialect
+
+    def owner_of(self, branch_id):
+        """分院 (仓库) ID -> 节点名，未知分院返回 None"""
+        return self.owner_map.get(branch_id)
+
+    def id_offset(self, name, column):
+        """某个节点上 column 相对标准 ID 的偏移；name 为 None (标准 ID 空间) 时为 0"""
+        node = self.by_name.get(name)
+        return node.id_offsets.get(column, 0) if node else 0
+
+    def total_workers(self):
+        return sum(node.workers for node in self.nodes)
+
+def load(path=TOPOLOGY_FILE):
+    with open(path, encoding="utf-8") as f:
+        spec = json.load(f)
+    return Topology(spec, is_docker=os.getenv("IS_DOCKER", "false").lower() == "true")
+
+topology = load()
@@ -5,51 +5,101 @@ from email.header import Header
 from email.utils import formataddr # 【新增】用于格式化标准地址
 from .config import settings
 
-def send_conflict_email(table_name, record_id, reason):
+# SMTP 连接、登录与发送的超时 (秒)，避免邮件服务器无响应时后台线程一直挂起
+SMTP_TIMEOUT = 30
+
+def build_message(subject, content):
     """
-    发送冲突报警邮件 (修复 RFC5322 合规性问题)
+    构造发给管理员的 HTML 邮件 (修复 RFC5322 合规性问题)
     """
-    if not settings.SENDER_EMAIL or not settings.SMTP_PASSWORD:
-        print("⚠️ 邮件发送失败：管理员尚未在设置面板配置邮箱或授权码")
-        return
+    message = MIMEText(content, 'html', 'utf-8')
 
-    subject = "【系统预警】分布式医疗系统数据冲突通知"
+    # 【核心修复点】
+    # 必须符合 "Display Name <email@domain.com>" 格式
+    # 且 email 部分必须和 settings.SENDER_EMAIL 一致
+    message['From'] = formataddr((str(Header("医疗系统监控中心", 'utf-8')), settings.SENDER_EMAIL))
+    message['To'] = formataddr((str(Header("系统管理员", 'utf-8')), settings.SENDER_EMAIL))
+
+    message['Subject'] = Header(subject, 'utf-8')
+    return message
+
+def render_conflict_digest(conflicts, dropped=0):
+    """
+    冲突报警摘要：一个时间窗口内的冲突合并为一封邮件。
+    conflicts 为 [{"time", "table", "record_id", "reason"}]，dropped 为超出队列上限未列出的条数。返回 (主题, 正文)
+    """
+    total = len(conflicts) + dropped
+    subject = "【系统预警】分布式医疗系统数据冲突通知" + (f" ({total} 条)" if total > 1 else "")
     login_url = f"{settings.FRONTEND_URL}/login"
-    
+    rows = "".join(
+        f"<tr><td>{c['time']:%Y-%m-%d %H:%M:%S}</td><td>{c['table']}</td><td>{c['record_id']}</td><td>{c['reason']}</td></tr>"
+        for c in conflicts
+    )
+    more = f"<p>另有 {dropped} 条冲突未在此列出，请登录系统查看。</p>" if dropped else ""
+
     content = f"""
     <h3>管理员您好：</h3>
-    <p>系统在自动同步过程中检测到数据冲突，相关记录已被锁定，需人工干预。</p>
+    <p>系统在自动同步过程中检测到 {total} 条数据冲突，相关记录已被锁定，需人工干预。</p>
     <table border="1" cellspacing="0" cellpadding="5">
-        <tr><td><b>涉及表</b></td><td>{table_name}</td></tr>
-        <tr><td><b>记录ID</b></td><td>{record_id}</td></tr>
-        <tr><td><b>冲突原因</b></td><td>{reason}</td></tr>
+        <tr><td><b>时间</b></td><td><b>涉及表</b></td><td><b>记录ID</b></td><td><b>冲突原因</b></td></tr>
+        {rows}
     </table>
+    {more}
     <p>请点击下方链接登录系统进行处理：</p>
     <a href="{login_url}">{login_url}</a>
     <br>
     <p>此邮件为系统自动发送，请勿回复。</p>
     """
+    return subject, content
 
-    message = MIMEText(content, 'html', 'utf-8')
-    
-    # 【核心修复点】
-    # 必须符合 "Display Name <email@domain.com>" 格式
-    # 且 email 部分必须和 settings.SENDER_EMAIL 一致
-    message['From'] = formataddr((str(Header("医疗系统监控中心", 'utf-8')), settings.SENDER_EMAIL))
-    message['To'] = formataddr((str(Header("系统管理员", 'utf-8')), settings.SENDER_EMAIL))
-    
-    message['Subject'] = Header(subject, 'utf-8')
+class SmtpConnection:
+    """
+    复用的 SMTP 连接：首次发送时连接并登录，之后每次发送前用 NOOP 探活，
+    连接已断开或设置页修改了邮箱/授权码时重新连接。只在邮件队列的后台线程中使用
+    """
+    def __init__(self):
+        self.server = None
+        self.credentials = None
+
+    def _connect(self):
+        # 生产环境使用 SSL (QQ 邮箱 465)；本地调试可设置 SMTP_SSL=false 指向不加密的 SMTP 替身
+        server_class = smtplib.SMTP_SSL if settings.SMTP_SSL else smtplib.SMTP
+        server = server_class(settings.SMTP_SERVER, settings.SMTP_PORT, timeout=SMTP_TIMEOUT)
+        try:
+            server.ehlo()
+            # 这里的 login 账号必须和 message['From'] 里的邮箱地址一致 (不支持认证的本地替身跳过登录)
+            if server.has_extn("auth"):
+                server.login(settings.SENDER_EMAIL, settings.SMTP_PASSWORD)
+        except Exception:
+            server.close()
+            raise
+        self.server = server
+
+    def _alive(self):
+        try:
+            return self.server.noop()[0] == 250
+        except Exception:
+            return False
+
+    def send(self, message):
+        credentials = (settings.SMTP_SERVER, settings.SMTP_PORT, settings.SENDER_EMAIL, settings.SMTP_PASSWORD)
+        if self.server is not None and (credentials != self.credentials or not self._alive()):
+            self.close()
+        if self.server is None:
+            self._connect()
+            self.credentials = credentials
+        try:
+            # sendmail(发件人, [收件人列表], 邮件字符串)
+            self.server.sendmail(settings.SENDER_EMAIL, [settings.SENDER_EMAIL], message.as_string())
+        except Exception:
+            # 出错后连接状态未知，下次重新建立
+            self.close()
+            raise
 
-    try:
-        # 使用 SSL 连接
-        server = smtplib.SMTP_SSL(settings.SMTP_SERVER, settings.SMTP_PORT)
-        # 这里的 login 账号必须和 message['From'] 里的邮箱地址一致
-        server.login(settings.SENDER_EMAIL, settings.SMTP_PASSWORD)
-        
-        # 发送邮件
-        # sendmail(发件人, [收件人列表], 邮件字符串)
-        server.sendmail(settings.SENDER_EMAIL, [settings.SENDER_EMAIL], message.as_string())
-        server.quit()
-        print(f"✅ 邮件已成功发送至 {settings.SENDER_EMAIL}")
-    except Exception as e:
-        print(f"❌ 邮件发送出错: {str(e)}")
\ No newline at end of file
+    def close(self):
+        if self.server is None: return
+        try:
+            self.server.quit()
+        except Exception:
+            self.server.close()
+        self.server = None
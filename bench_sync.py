@@ -0,0 +1,183 @@
+# bench_sync.py
+"""
+同步引擎微基准：
+1. 行比对：不连接数据库，用内存中的处方明细行测量逐行比对/换算的 CPU 开销；
+2. 同步热循环：两个内存 SQLite 库之间 "读取源页 -> 按主键回查目标 -> 归属判断 -> 比对" 的每行 CPU 开销，
+   对比 ORM 实例 (改造前) 与 Core 元组 (现行实现)；
+3. 引擎对比：在已配置的三个库 (docker compose 启动并导入数据后) 上，清空水位强制全量扫描同一份数据，
+   对比线程池引擎与 asyncio 引擎一轮同步的墙钟耗时与数据库往返 (需要安装 asyncpg / aiomysql)；
+   不要开启同步限流 (SYNC_ROWS_PER_SEC / SYNC_QUERIES_PER_SEC 保持默认 0)，避免限额掩盖两者的差异。
+运行：python bench_sync.py             (1、2)
+      python bench_sync.py engines [轮数] (3)
+"""
+import sys
+import time
+import uuid
+import random
+from datetime import datetime
+from sqlalchemy import inspect, create_engine, insert, delete
+from sqlalchemy.orm import sessionmaker
+from backend import models
+from backend.config import settings
+from backend.database import SessionLocals, CENTRAL_DB
+from backend.row_transform import get_transformer, row_columns
+from backend.sync_engine import get_owner_db, classify_rows, fetch_page, fetch_rows_by_ids, sync_row, chunked
+
+ROWS = 20000
+
+def make_rows(n, medicine_offset=0, changed_ratio=0.0):
+    now = datetime.now()
+    rows = []
+    for i in range(n):
+        rows.append(models.PrescriptionItem(
+            id=str(uuid.uuid4()), prescription_id=str(uuid.uuid4()),
+            medicine_id=random.randint(1, 45) + medicine_offset,
+            quantity=random.randint(1, 3), price_snapshot=round(random.uniform(1, 100), 2),
+            last_updated=now,
+        ))
+    return rows
+
+def legacy_diff(obj1, obj2, model_class, source_db, target_db):
+    """改造前的逐行比对：每行 inspect 模型、逐列分支判断偏移、拼接字符串"""
+    mapper = inspect(model_class)
+    diffs = []
+    for column in mapper.attrs:
+        prop_name = column.key
+        if prop_name in ['last_updated', 'create_time'] or prop_name.startswith('_'):
+            continue
+        v1 = getattr(obj1, prop_name)
+        v2 = getattr(obj2, prop_name)
+        if prop_name == 'medicine_id':
+            if source_db != 'pg' and target_db == 'pg':
+                if v1 is not None: v1 += 253
+            elif source_db == 'pg' and target_db != 'pg':
+                if v1 is not None: v1 -= 253
+        is_different = False
+        if isinstance(v1, float) and isinstance(v2, float):
+            if abs(v1 - v2) > 0.001: is_different = True
+        elif v1 != v2:
+            is_different = True
+        if is_different:
+            diffs.append(f"{prop_name}:[{v1} vs {v2}]")
+    return ", ".join(diffs) if diffs else None
+
+def bench(label, fn, pairs):
+    started = time.perf_counter()
+    for a, b in pairs:
+        fn(a, b)
+    elapsed = time.perf_counter() - started
+    print(f"   {label:<28} {elapsed * 1e6 / len(pairs):8.2f} µs/行")
+    return elapsed
+
+def as_tuple(row):
+    return tuple(getattr(row, c.key) for c in row_columns(models.PrescriptionItem))
+
+def make_pairs(n):
+    """同一批处方明细在 mysql (源) 与 pg (目标，medicine_id + 253) 上的两份副本"""
+    source = make_rows(n)
+    target = []
+    for row in source:
+        copy = models.PrescriptionItem(**{k: getattr(row, k) for k in ('id', 'prescription_id', 'quantity', 'price_snapshot', 'last_updated')})
+        copy.medicine_id = row.medicine_id + 253
+        target.append(copy)
+    return source, target
+
+def bench_row_transform():
+    print(f"🔬 [行比对] {ROWS} 行 mysql -> pg 处方明细 (内容相同，仅需判断无差异)")
+    source, target = make_pairs(ROWS)
+    transformer = get_transformer(models.PrescriptionItem, 'mysql', 'pg')
+    old = bench("逐行 inspect + f-string", lambda a, b: legacy_diff(a, b, models.PrescriptionItem, 'mysql', 'pg'), list(zip(source, target)))
+    new = bench("预编译转换器 (元组)", transformer.diff, [(as_tuple(a), as_tuple(b)) for a, b in zip(source, target)])
+    print(f"   提速 {old / new:.1f}x")
+
+def memory_db(rows):
+    engine = create_engine("sqlite://")
+    models.PrescriptionItem.__table__.create(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(models.PrescriptionItem.__table__), [{c.key: getattr(r, c.key) for c in row_columns(models.PrescriptionItem)} for r in rows])
+    return sessionmaker(bind=engine)
+
+def orm_diff(transformer, item, target):
+    """改造前的预编译比对：与现行实现相同的比对清单，但通过 getattr 读取 ORM 实例的属性"""
+    for _, key, delta, is_float in transformer.compare:
+        v1 = getattr(item, key)
+        v2 = getattr(target, key)
+        if delta and v1 is not None: v1 += delta
+        if is_float and isinstance(v1, float) and isinstance(v2, float):
+            if abs(v1 - v2) > 0.001: return True
+        elif v1 != v2:
+            return True
+    return False
+
+def legacy_orm_pass(src_session, tgt_session, model_class, source_db, target_db, chunk_size):
+    """改造前的热循环：整页构造 ORM 实例，目标行 populate_existing 回查，getattr 逐列比对"""
+    transformer = get_transformer(model_class, source_db, target_db)
+    items = src_session.query(model_class).order_by(model_class.id).all()
+    for chunk in chunked(items, chunk_size):
+        ids = [item.id for item in chunk]
+        target_map = {t.id: t for t in tgt_session.query(model_class).filter(model_class.id.in_(ids)).populate_existing().all()}
+        for item in chunk:
+            get_owner_db(item, source_db)
+            target = target_map.get(item.id)
+            diff = orm_diff(transformer, item, target)
+            if item.last_updated >= target.last_updated and not diff:
+                target.last_updated = item.last_updated
+
+def core_pass(src_session, tgt_session, model_class, source_db, target_db, chunk_size):
+    """现行热循环：Core 元组 + 预编译归属下标 + 按下标比对"""
+    items = fetch_page(src_session, model_class, None, None, ROWS)
+    owned, _ = classify_rows(items, model_class, source_db)
+    transformer = get_transformer(model_class, source_db, target_db)
+    for chunk in chunked(owned, chunk_size):
+        target_map = {row.id: row for row in fetch_rows_by_ids(tgt_session, model_class, [item.id for item in chunk])}
+        for item in chunk:
+            sync_row(item, target_map.get(item.id), transformer)
+
+def bench_hot_loop(chunk_size=500):
+    print(f"🔬 [同步热循环] {ROWS} 行 mysql -> pg 处方明细，读取 + 回查 + 比对 (SQLite 内存库，按进程 CPU 时间计)")
+    source, target = make_pairs(ROWS)
+    src_factory, tgt_factory = memory_db(source), memory_db(target)
+    results = {}
+    for label, fn in (("ORM 实例", legacy_orm_pass), ("Core 元组", core_pass)):
+        src_session, tgt_session = src_factory(), tgt_factory()
+        started = time.process_time()
+        fn(src_session, tgt_session, models.PrescriptionItem, 'mysql', 'pg', chunk_size)
+        results[label] = time.process_time() - started
+        src_session.close()
+        tgt_session.close()
+        print(f"   {label:<28} {results[label] * 1e6 / ROWS:8.2f} µs/行")
+    print(f"   提速 {results['ORM 实例'] / results['Core 元组']:.1f}x")
+
+def reset_watermarks():
+    """清空全部水位与检查点，下一轮对每张表做全量扫描"""
+    db = SessionLocals[CENTRAL_DB]()
+    try:
+        db.execute(delete(models.SyncWatermark))
+        db.commit()
+    finally:
+        db.close()
+
+def bench_engines(rounds=3):
+    from backend import sync_engine
+    print(f"🔬 [引擎对比] 已配置的三个库，每轮清空水位后全量扫描 (数据已一致，主要是读取与比对的往返)，交替执行 {rounds} 轮")
+    results = {"threaded": [], "asyncio": []}
+    for i in range(rounds):
+        # 交替先后顺序，抵消数据库缓存预热的影响
+        for engine in (("threaded", "asyncio") if i % 2 == 0 else ("asyncio", "threaded")):
+            settings.SYNC_ENGINE = engine
+            reset_watermarks()
+            sync_engine.sync_logic()
+            results[engine].append(sync_engine.last_cycle_report)
+    for engine, reports in results.items():
+        elapsed = sorted(r["elapsed"] for r in reports)
+        round_trips = sum(reports[-1]["round_trips"].values())
+        print(f"   {engine:<10} 墙钟中位数 {elapsed[len(elapsed) // 2]:7.3f}s  任务累计/墙钟 {reports[-1]['speedup']}  数据库往返 {round_trips}")
+    median = {engine: sorted(r["elapsed"] for r in reports)[len(reports) // 2] for engine, reports in results.items()}
+    print(f"   asyncio / threaded 墙钟比 {median['asyncio'] / median['threaded']:.2f}")
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "engines":
+        bench_engines(int(sys.argv[2]) if len(sys.argv) > 2 else 3)
+    else:
+        bench_row_transform()
+        bench_hot_loop()
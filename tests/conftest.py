@@ -0,0 +1,49 @@
+# tests/conftest.py
+"""
+测试夹具：把拓扑中的每个节点换成临时目录下的 SQLite 库，不需要真实的 MySQL / PostgreSQL / SQL Server。
+引擎与会话工厂直接替换 database 模块中的字典，同步引擎、协调器等按节点名取到的都是测试库
+"""
+import uuid
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from backend import database, models, sync_throttle
+from backend.topology import topology
+
+class RecordingScheduler:
+    """只记录提交的任务，不执行 (SingleFlight.request 的人工触发)"""
+    def __init__(self):
+        self.jobs = []
+
+    def add_job(self, fn, *args, **kwargs):
+        self.jobs.append((fn, kwargs.get("kwargs", {})))
+
+@pytest.fixture
+def nodes(tmp_path, monkeypatch):
+    """每个节点一个空的 SQLite 库 (已建表)，返回 {节点: 会话工厂}"""
+    for name in topology.names:
+        engine = create_engine(f"sqlite:///{tmp_path / name}.db")
+        models.Base.metadata.create_all(engine)
+        event.listen(engine, "checkout", database._make_checkout_counter(name))
+        event.listen(engine, "before_cursor_execute", database._make_query_counter(name))
+        sync_throttle.install(name, engine)
+        monkeypatch.setitem(database.engines, name, engine)
+        monkeypatch.setitem(database.SessionLocals, name,
+                            sessionmaker(autocommit=False, autoflush=False, bind=engine, info={"node": name}))
+    return database.SessionLocals
+
+@pytest.fixture
+def scheduler():
+    return RecordingScheduler()
+
+def add_prescription(sessions, db_name, warehouse_id, **values):
+    """在某个节点直接写入一张处方 (不经过业务接口)，返回处方 ID"""
+    pid = values.pop("id", None) or str(uuid.uuid4())
+    session = sessions[db_name]()
+    try:
+        session.add(models.Prescription(id=pid, prescription_no=values.pop("prescription_no", pid[:12]), patient_name="p",
+                                        doctor_id=warehouse_id, warehouse_id=warehouse_id, **values))
+        session.commit()
+    finally:
+        session.close()
+    return pid
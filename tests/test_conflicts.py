@@ -0,0 +1,61 @@
+# tests/test_conflicts.py
+"""冲突登记：各进程各自的锁定集合之外，按总库中已有的 PENDING 冲突去重"""
+import pytest
+from backend import sync_engine, models
+from backend.database import CENTRAL_DB
+
+@pytest.fixture
+def mails(monkeypatch):
+    sent = []
+    monkeypatch.setattr(sync_engine.conflict_mail_queue, "enqueue", lambda *args: sent.append(args))
+    return sent
+
+def conflict(record_id):
+    return ("prescriptions", record_id, "mysql", "pg", [("total_amount", 1.0, 2.0)])
+
+def pending_ids(nodes):
+    session = nodes[CENTRAL_DB]()
+    try:
+        return sorted(r.record_id for r in session.query(models.SyncConflictLog.record_id).filter(
+            models.SyncConflictLog.status == 'PENDING'))
+    finally:
+        session.close()
+
+def test_conflict_pending_in_another_process_is_not_logged_again(nodes, mails, monkeypatch):
+    session = nodes[CENTRAL_DB]()
+    try:
+        # 另一个进程已登记的冲突：本进程的锁定集合中没有
+        session.add(models.SyncConflictLog(table_name="prescriptions", record_id="a", source_db="mysql",
+                                           target_db="pg", conflict_reason="x", status="PENDING"))
+        session.commit()
+    finally:
+        session.close()
+    monkeypatch.setattr(sync_engine, "locked_records", set())
+
+    session = nodes[CENTRAL_DB]()
+    try:
+        assert sync_engine.log_conflicts(session, [conflict("a"), conflict("b")]) == 1
+    finally:
+        session.close()
+    assert pending_ids(nodes) == ["a", "b"]
+    assert [m[1] for m in mails] == ["b"]
+    # 两条都已锁定：之后的同步跳过它们
+    assert sync_engine.is_record_locked("prescriptions", "a")
+    assert sync_engine.is_record_locked("prescriptions", "b")
+
+def test_resolved_conflict_can_be_logged_again(nodes, mails, monkeypatch):
+    session = nodes[CENTRAL_DB]()
+    try:
+        session.add(models.SyncConflictLog(table_name="prescriptions", record_id="a", source_db="mysql",
+                                           target_db="pg", conflict_reason="x", status="RESOLVED"))
+        session.commit()
+    finally:
+        session.close()
+    monkeypatch.setattr(sync_engine, "locked_records", set())
+
+    session = nodes[CENTRAL_DB]()
+    try:
+        assert sync_engine.log_conflicts(session, [conflict("a")]) == 1
+    finally:
+        session.close()
+    assert pending_ids(nodes) == ["a"]
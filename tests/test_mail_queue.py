@@ -0,0 +1,123 @@
+# tests/test_mail_queue.py
+"""冲突报警邮件队列：对着本地 SMTP 替身验证摘要合并、连接复用、失败重试与关闭时发送"""
+import email
+import time
+import threading
+import socketserver
+import pytest
+from backend import mail_queue
+from backend.config import settings
+
+class FakeSmtp(socketserver.ThreadingTCPServer):
+    """最小的 SMTP 替身：记录连接数与收到的邮件正文，fail 次数内对 DATA 返回 451"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FakeSmtpHandler)
+        self.connections = 0
+        self.mails = []
+        self.fail = 0
+
+    def bodies(self):
+        return [email.message_from_string(m).get_payload(decode=True).decode("utf-8") for m in self.mails]
+
+class FakeSmtpHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write((line + "\r\n").encode())
+
+    def handle(self):
+        server = self.server
+        server.connections += 1
+        self.reply("220 fake")
+        data = None
+        for raw in self.rfile:
+            line = raw.decode().rstrip("\r\n")
+            if data is not None:
+                if line != ".":
+                    data.append(line[1:] if line.startswith("..") else line)
+                    continue
+                if server.fail > 0:
+                    server.fail -= 1
+                    self.reply("451 try later")
+                else:
+                    server.mails.append("\n".join(data))
+                    self.reply("250 ok")
+                data = None
+            elif line.upper().startswith("EHLO"):
+                self.reply("250 fake")
+            elif line.upper().startswith("DATA"):
+                data = []
+                self.reply("354 go ahead")
+            elif line.upper().startswith("QUIT"):
+                self.reply("221 bye")
+                return
+            else:
+                self.reply("250 ok")
+
+@pytest.fixture
+def smtp(monkeypatch):
+    server = FakeSmtp()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(settings, "SMTP_SERVER", "127.0.0.1")
+    monkeypatch.setattr(settings, "SMTP_PORT", server.server_address[1])
+    monkeypatch.setattr(settings, "SMTP_SSL", False)
+    monkeypatch.setattr(settings, "SENDER_EMAIL", "admin@example.com")
+    monkeypatch.setattr(settings, "SMTP_PASSWORD", "x")
+    monkeypatch.setattr(settings, "MAIL_DIGEST_WINDOW", 0.3)
+    monkeypatch.setattr(mail_queue, "MAIL_RETRY_BASE", 0.2)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def queue():
+    q = mail_queue.ConflictMailQueue()
+    yield q
+    q.close()
+
+def wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate(): return True
+        time.sleep(0.05)
+    return predicate()
+
+def test_burst_is_one_digest_over_one_connection(smtp, queue):
+    started = time.perf_counter()
+    for i in range(20):
+        queue.enqueue("inventory", 1000 + i, "内容冲突")
+    # 入队不等待邮件服务器
+    assert time.perf_counter() - started < 0.1
+
+    assert wait_for(lambda: len(smtp.mails) == 1)
+    body = smtp.bodies()[0]
+    assert all(f"<td>{1000 + i}</td>" in body for i in range(20))
+
+    queue.enqueue("inventory", 2000, "内容冲突")
+    assert wait_for(lambda: len(smtp.mails) == 2)
+    # 第二封复用已登录的连接
+    assert smtp.connections == 1
+
+def test_failed_send_is_retried_and_merged_with_later_conflicts(smtp, queue):
+    smtp.fail = 1
+    for i in range(3):
+        queue.enqueue("users", 100 + i, "x")
+    assert wait_for(lambda: smtp.fail == 0)
+    for i in range(3):
+        queue.enqueue("users", 200 + i, "y")
+
+    assert wait_for(lambda: smtp.mails)
+    time.sleep(0.5)
+    sent = "".join(smtp.bodies())
+    assert all(f"<td>{rid}</td>" in sent for rid in (100, 101, 102, 200, 201, 202))
+    assert len(smtp.mails) <= 2
+
+def test_close_flushes_without_waiting_for_the_window(smtp, queue, monkeypatch):
+    monkeypatch.setattr(settings, "MAIL_DIGEST_WINDOW", 60)
+    queue.enqueue("users", 999, "z")
+    started = time.monotonic()
+    queue.close()
+    assert time.monotonic() - started < 5
+    assert len(smtp.mails) == 1
+    assert "<td>999</td>" in smtp.bodies()[0]
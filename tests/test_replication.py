@@ -0,0 +1,51 @@
+# tests/test_replication.py
+"""API 进程的定向同步：冲突锁定与重试队列键在每个任务开始前从总库加载"""
+from backend import sync_engine, models
+from backend.database import CENTRAL_DB
+from backend.topology import topology
+from backend.replication import replication_queue
+from conftest import add_prescription
+
+def test_job_skips_rows_locked_by_a_pending_conflict(nodes, monkeypatch):
+    # API 进程从未跑过同步：内存中的锁定集合为空
+    monkeypatch.setattr(sync_engine, "locked_records", set())
+    owner = topology.owner_of(1)
+    pid = add_prescription(nodes, owner, 1)
+    central = nodes[CENTRAL_DB]()
+    try:
+        central.add(models.SyncConflictLog(table_name="prescriptions", record_id=pid, source_db=owner,
+                                           target_db=CENTRAL_DB, conflict_reason="x", status="PENDING"))
+        central.commit()
+    finally:
+        central.close()
+
+    job = replication_queue.get(replication_queue.submit(owner, [("prescriptions", pid)]))
+    assert job.done.wait(10)
+    assert job.status == 'DONE'
+    for db_name in topology.names:
+        if db_name == owner: continue
+        session = nodes[db_name]()
+        try:
+            assert session.get(models.Prescription, pid) is None
+        finally:
+            session.close()
+    central = nodes[CENTRAL_DB]()
+    try:
+        assert central.query(models.SyncConflictLog).count() == 1
+    finally:
+        central.close()
+
+def test_job_pushes_unlocked_rows(nodes, monkeypatch):
+    monkeypatch.setattr(sync_engine, "locked_records", set())
+    owner = topology.owner_of(1)
+    pid = add_prescription(nodes, owner, 1)
+
+    job = replication_queue.get(replication_queue.submit(owner, [("prescriptions", pid)]))
+    assert job.done.wait(10)
+    assert job.status == 'DONE'
+    for db_name in topology.names:
+        session = nodes[db_name]()
+        try:
+            assert session.get(models.Prescription, pid) is not None
+        finally:
+            session.close()
@@ -0,0 +1,62 @@
+# tests/test_sync_chunk.py
+"""批量推送的失败处理：连接级错误让整条流水线失败，单行错误隔离到重试队列"""
+from sqlalchemy.exc import OperationalError, IntegrityError
+from backend import sync_engine, models
+from backend.database import CENTRAL_DB
+from backend.topology import topology
+from conftest import add_prescription
+
+def source_rows(nodes, owner, ids):
+    session = nodes[owner]()
+    try:
+        return sync_engine.fetch_rows_by_ids(session, models.Prescription, ids)
+    finally:
+        session.close()
+
+def retry_rows(nodes):
+    central = nodes[CENTRAL_DB]()
+    try:
+        return central.query(models.SyncRetry).all()
+    finally:
+        central.close()
+
+def target_of(owner):
+    return next(db for db in topology.names if db != owner)
+
+def test_unreachable_target_fails_the_chunk_without_replay(nodes, monkeypatch):
+    owner = topology.owner_of(1)
+    items = source_rows(nodes, owner, [add_prescription(nodes, owner, 1) for _ in range(5)])
+    calls = []
+
+    def unreachable(session, model_class, ids):
+        calls.append(ids)
+        raise OperationalError("SELECT", {}, TimeoutError("connect timed out"))
+    monkeypatch.setattr(sync_engine, "fetch_rows_by_ids", unreachable)
+
+    with sync_engine.SyncPass() as sp:
+        assert not sync_engine.sync_chunk(sp, items, models.Prescription, owner, target_of(owner))
+    assert len(calls) == 1
+    assert retry_rows(nodes) == []
+
+def test_row_error_is_isolated_to_the_retry_queue(nodes, monkeypatch):
+    owner = topology.owner_of(1)
+    ids = [add_prescription(nodes, owner, 1) for _ in range(3)]
+    items = source_rows(nodes, owner, ids)
+    bad = ids[1]
+    fetch = sync_engine.fetch_rows_by_ids
+
+    def flaky(session, model_class, row_ids):
+        if bad in row_ids:
+            raise IntegrityError("INSERT", {}, Exception("constraint failed"))
+        return fetch(session, model_class, row_ids)
+    monkeypatch.setattr(sync_engine, "fetch_rows_by_ids", flaky)
+
+    target = target_of(owner)
+    with sync_engine.SyncPass() as sp:
+        assert sync_engine.sync_chunk(sp, items, models.Prescription, owner, target)
+    assert [r.record_id for r in retry_rows(nodes)] == [bad]
+    session = nodes[target]()
+    try:
+        assert {pid for pid in ids if session.get(models.Prescription, pid)} == set(ids) - {bad}
+    finally:
+        session.close()
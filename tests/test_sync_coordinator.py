@@ -0,0 +1,116 @@
+# tests/test_sync_coordinator.py
+"""集群租约：抢占、续约、失效中止，以及维护任务借用同步租约"""
+import time
+import pytest
+from backend import sync_coordinator as sc, sync_engine, models
+from backend.config import settings
+
+def work(flight, seconds, pages):
+    """模拟一轮同步：每 0.1 秒处理一页，每页开始前检查租约"""
+    def fn():
+        end = time.monotonic() + seconds
+        while time.monotonic() < end:
+            flight.ensure_lease()
+            pages.append(1)
+            time.sleep(0.1)
+    return fn
+
+@pytest.fixture
+def short_ttl(monkeypatch):
+    # 有效期 3 秒：心跳每秒续约一次
+    monkeypatch.setattr(settings, "SYNC_LEASE_TTL", 3)
+
+def test_acquire_is_exclusive_across_holders(nodes, scheduler, monkeypatch):
+    me = sc.HOLDER_ID
+    flight = sc.SingleFlight("t", None, scheduler)
+    assert flight.acquire()
+    monkeypatch.setattr(sc, "HOLDER_ID", "other-process")
+    assert not flight.acquire()
+    assert not flight.renew()
+    monkeypatch.setattr(sc, "HOLDER_ID", me)
+    assert flight.renew()
+    assert flight.release() == 'released'
+    monkeypatch.setattr(sc, "HOLDER_ID", "other-process")
+    assert flight.acquire()
+
+def test_min_gap_skips_right_after_a_round(nodes, scheduler):
+    flight = sc.SingleFlight("t", lambda: None, scheduler, min_gap=lambda: 60)
+    assert flight.run()
+    assert not flight.run()
+    assert flight.run(force=True)
+
+def test_transient_renew_error_keeps_the_cycle_running(nodes, scheduler, short_ttl):
+    pages = []
+    flight = sc.SingleFlight("t", None, scheduler)
+    flight.fn = work(flight, 2.5, pages)
+    renew, calls = flight.renew, []
+    def flaky():
+        calls.append(1)
+        if len(calls) == 1: raise RuntimeError("central hiccup")
+        return renew()
+    flight.renew = flaky
+
+    assert flight.run(force=True)
+    assert len(calls) >= 2
+    assert len(pages) >= 20
+    session = nodes[sc.LEASE_DB]()
+    try:
+        assert session.get(models.SyncLease, "t").holder is None
+    finally:
+        session.close()
+
+def test_rejected_renew_aborts_at_the_next_page(nodes, scheduler, short_ttl):
+    pages, errors = [], []
+    flight = sc.SingleFlight("t", None, scheduler)
+    inner = work(flight, 10, pages)
+    def fn():
+        try:
+            inner()
+        except sc.LeaseLost as e:
+            errors.append(e)
+            raise
+    flight.fn = fn
+    flight.renew = lambda: False
+
+    started = time.monotonic()
+    flight.run(force=True)
+    assert time.monotonic() - started < 3
+    assert errors
+    assert not flight.lease_lost.is_set()
+
+def test_renew_failing_until_expiry_aborts_before_the_ttl(nodes, scheduler, short_ttl):
+    pages = []
+    flight = sc.SingleFlight("t", None, scheduler)
+    flight.fn = work(flight, 10, pages)
+    def down(): raise RuntimeError("central down")
+    flight.renew = down
+
+    started = time.monotonic()
+    flight.run(force=True)
+    assert time.monotonic() - started < settings.SYNC_LEASE_TTL
+
+def test_sync_with_lost_lease_saves_no_watermark(nodes):
+    sync_engine.sync_flight.lease_lost.set()
+    try:
+        with pytest.raises(sc.LeaseLost):
+            sync_engine.sync_logic()
+    finally:
+        sync_engine.sync_flight.lease_lost.clear()
+    session = nodes[sc.LEASE_DB]()
+    try:
+        assert session.query(models.SyncWatermark).count() == 0
+    finally:
+        session.close()
+
+def test_run_exclusive_shares_the_lease(nodes, scheduler):
+    ran = []
+    flight = sc.SingleFlight("t", lambda: ran.append("sync"), scheduler, min_gap=lambda: 60)
+    assert flight.run_exclusive(lambda: ran.append("maintenance"))
+    # 维护任务不记录结束时间，不影响定时同步
+    assert flight.run()
+    assert ran == ["maintenance", "sync"]
+
+    flight._running = True
+    assert not flight.run_exclusive(lambda: ran.append("maintenance"))
+    flight._running = False
+    assert ran == ["maintenance", "sync"]
@@ -0,0 +1,36 @@
+# tests/test_sync_throttle.py
+"""同步限流：默认不限；开启后语句令牌在事务前预付，执行语句的钩子不等待"""
+import time
+from sqlalchemy import text
+from backend import sync_throttle
+from backend.config import SystemConfig
+from backend.topology import topology
+
+def test_throttle_is_off_by_default(monkeypatch):
+    monkeypatch.delenv("SYNC_ROWS_PER_SEC", raising=False)
+    monkeypatch.delenv("SYNC_QUERIES_PER_SEC", raising=False)
+    config = SystemConfig()
+    for name in topology.names:
+        assert config.node_rows_per_sec(name) == 0
+        assert config.node_queries_per_sec(name) == 0
+
+def test_cursor_hook_never_sleeps(nodes, monkeypatch):
+    name = topology.central
+    bucket = sync_throttle.TokenBucket(10)
+    bucket.tokens = -50  # 已经欠下 5 秒的令牌
+    monkeypatch.setattr(sync_throttle.throttles[name], "queries", bucket)
+    slept = []
+    monkeypatch.setattr(time, "sleep", slept.append)
+
+    with sync_throttle.scope():
+        session = nodes[name]()
+        try:
+            for _ in range(5):
+                session.execute(text("select 1"))
+        finally:
+            session.close()
+        assert slept == []
+        assert bucket.tokens < -50
+        # 欠账由下一次 (事务开始前的) 预付补足
+        sync_throttle.acquire_queries(name, 1)
+    assert slept and slept[0] > 0